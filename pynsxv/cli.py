@@ -48,6 +48,9 @@ def main():
                         "--debug",
                         help="print low level debug of http transactions",
                         action="store_true")
+    parser.add_argument("--refresh-cache",
+                        help="ignore the on-disk inventory cache and read all objects again from NSX Manager",
+                        action="store_true")
 
     subparsers = parser.add_subparsers()
     lswitch.contruct_parser(subparsers)
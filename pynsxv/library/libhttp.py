@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2015-2016 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the X11 (MIT) (the “License”) set forth below;
+#
+# you may not use this file except in compliance with the License. Unless required by applicable law or agreed to in
+# writing, software distributed under the License is distributed on an “AS IS” BASIS, without warranties or conditions
+# of any kind, EITHER EXPRESS OR IMPLIED. See the License for the specific language governing permissions and
+# limitations under the License. Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+#
+# "THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN
+# AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.”
+
+from requests.adapters import HTTPAdapter
+import atexit
+import random
+import threading
+import time
+
+__author__ = 'Dimitri Desmidt, Emanuele Mazza, Yves Fauser, Andreas La Quiante'
+
+# Default number of kept-alive connections per NSX Manager, at least the number of concurrent calls of the library
+DEFAULT_POOL_SIZE = 10
+
+# Statuses NSX Manager answers when it is overloaded, the request was not processed and can be sent again
+RETRYABLE_STATUSES = (429, 503)
+DEFAULT_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 30.0
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def method_kind(method):
+    """
+    :param method: The http method of a request
+    :return: 'get' for the read only methods, 'write' for PUT, POST and DELETE
+    """
+    if method.upper() in ('GET', 'HEAD', 'OPTIONS'):
+        return 'get'
+    return 'write'
+
+
+class TokenBucket(object):
+    """
+    A token bucket limiting the rate of calls, shared by the threads of the process. A call takes a token, the tokens
+    are refilled at the rate and up to the burst size, a call finding no token waits for its turn
+    """
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: The number of calls per second
+        :param burst: (Optional) The number of calls made without waiting after an idle period, defaults to the rate
+        """
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        This method takes a token, waiting until one is available
+        :return: The seconds waited
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # the token is reserved before waiting, so that concurrent callers are spaced instead of woken together
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def rate_limiter(nsx_manager, kind, rate):
+    """
+    This function returns the token bucket of an NSX Manager and a method kind, shared by all the client sessions of
+    the process talking to this NSX Manager
+    :param nsx_manager: The NSX Manager name or IP
+    :param kind: The method kind, 'get' or 'write'
+    :param rate: The number of calls per second, 0 or None for no limit
+    :return: A TokenBucket instance, or None if the rate is not limited
+    """
+    if not rate:
+        return None
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get((nsx_manager, kind))
+        if not limiter or limiter.rate != rate:
+            limiter = _rate_limiters[(nsx_manager, kind)] = TokenBucket(rate)
+    return limiter
+
+
+class RetryPolicy(object):
+    """
+    The retries of the calls answered with a retryable status, waiting an exponential backoff with full jitter between
+    the attempts, or the Retry-After delay of NSX Manager if it sends one
+    """
+    def __init__(self, retries=DEFAULT_RETRIES, backoff=DEFAULT_RETRY_BACKOFF, statuses=RETRYABLE_STATUSES):
+        """
+        :param retries: (Optional) The number of retries after the first attempt, 0 disables the retries
+        :param backoff: (Optional) The maximum seconds waited before the first retry, doubled at each retry
+        :param statuses: (Optional) The retryable status codes
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.statuses = statuses
+
+    def delay(self, attempt, response):
+        """
+        :param attempt: The number of retries already made
+        :param response: The response with a retryable status
+        :return: The seconds to wait before the next attempt
+        """
+        retry_after = response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), MAX_RETRY_BACKOFF)
+        return random.uniform(0, min(self.backoff * 2 ** attempt, MAX_RETRY_BACKOFF))
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    A requests adapter keeping the connections to NSX Manager open between calls, so that a sequence of calls pays the
+    TCP and TLS handshake once per pooled connection instead of once per call. It counts the requests sent and the
+    connections opened, to show how often a connection was reused.
+    The calls can be rate limited and retried per method kind, 'get' or 'write', it counts the calls which waited for
+    the rate limiter and the retries
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, rate_limiters=None, retry_policies=None):
+        """
+        :param pool_size: (Optional) The maximum number of connections kept open per host, the connections opened
+                          by concurrent calls above this number are closed after their call
+        :param rate_limiters: (Optional) A dictionary of TokenBucket per method kind
+        :param retry_policies: (Optional) A dictionary of RetryPolicy per method kind, defaults to DEFAULT_RETRIES
+                               retries of all methods
+        """
+        super(PooledHTTPAdapter, self).__init__(pool_connections=1, pool_maxsize=pool_size)
+        self.pool_size = pool_size
+        self.rate_limiters = rate_limiters or {}
+        if retry_policies is None:
+            retry_policies = {'get': RetryPolicy(), 'write': RetryPolicy()}
+        self.retry_policies = retry_policies
+        self._closed_pools_stats = {'requests': 0, 'connections': 0}
+        self._call_stats = {'throttled': 0, 'throttled_seconds': 0.0, 'retried': 0, 'retries_exhausted': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat, value=1):
+        with self._stats_lock:
+            self._call_stats[stat] += value
+
+    def send(self, request, **kwargs):
+        kind = method_kind(request.method)
+        limiter = self.rate_limiters.get(kind)
+        policy = self.retry_policies.get(kind)
+        attempt = 0
+        while True:
+            if limiter:
+                waited = limiter.acquire()
+                if waited:
+                    self._count('throttled')
+                    self._count('throttled_seconds', waited)
+            response = super(PooledHTTPAdapter, self).send(request, **kwargs)
+            if not policy or response.status_code not in policy.statuses:
+                return response
+            if attempt >= policy.retries:
+                if policy.retries:
+                    self._count('retries_exhausted')
+                return response
+            delay = policy.delay(attempt, response)
+            # reading the error body gives the connection back to the pool
+            response.content
+            response.close()
+            attempt += 1
+            self._count('retried')
+            time.sleep(delay)
+
+    def stats(self):
+        """
+        :return: A dictionary with the number of requests sent, of connections opened, of requests sent over an
+                 already open connection, of calls which waited for the rate limiter and the seconds waited, of
+                 retries and of calls still failing after their last retry
+        """
+        with self._stats_lock:
+            requests_count = self._closed_pools_stats['requests']
+            connections_count = self._closed_pools_stats['connections']
+            for pool_key in self.poolmanager.pools.keys():
+                pool = self.poolmanager.pools.get(pool_key)
+                if pool is not None:
+                    requests_count += pool.num_requests
+                    connections_count += pool.num_connections
+            stats = dict(self._call_stats)
+        stats.update({'requests': requests_count, 'connections': connections_count,
+                      'reused': max(requests_count - connections_count, 0)})
+        return stats
+
+    def close(self):
+        stats = self.stats()
+        with self._stats_lock:
+            self._closed_pools_stats = {'requests': stats['requests'], 'connections': stats['connections']}
+            super(PooledHTTPAdapter, self).close()
+
+
+def mount_pooled_adapter(client_session, pool_size=DEFAULT_POOL_SIZE, rate_limiters=None, retry_policies=None):
+    """
+    This function replaces the default adapter of the requests session used by a client session with a
+    PooledHTTPAdapter
+    :param client_session: An instance of an NsxClient Session
+    :param pool_size: (Optional) The maximum number of connections kept open to NSX Manager
+    :param rate_limiters: (Optional) A dictionary of TokenBucket per method kind, 'get' or 'write'
+    :param retry_policies: (Optional) A dictionary of RetryPolicy per method kind, 'get' or 'write'
+    :return: The PooledHTTPAdapter instance
+    """
+    adapter = PooledHTTPAdapter(pool_size, rate_limiters, retry_policies)
+    http_session = client_session._httpsession._session
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    http_session.headers['Connection'] = 'keep-alive'
+    return adapter
+
+
+def connection_stats(client_session):
+    """
+    :param client_session: An instance of an NsxClient Session
+    :return: The statistics of PooledHTTPAdapter.stats, or None if no PooledHTTPAdapter is mounted on the session
+    """
+    adapter = client_session._httpsession._session.get_adapter(client_session._nsxraml._base_uri)
+    if isinstance(adapter, PooledHTTPAdapter):
+        return adapter.stats()
+    return None
+
+
+def print_connection_stats_at_exit(client_session, nsx_manager):
+    """
+    This function prints the connection statistics of a client session when the process ends, used in debug mode
+    :param client_session: An instance of an NsxClient Session
+    :param nsx_manager: The NSX Manager name printed with the statistics
+    """
+    def print_stats():
+        stats = connection_stats(client_session)
+        if stats:
+            print 'http connections to {}: {} requests, {} connections opened, {} requests on a reused ' \
+                  'connection'.format(nsx_manager, stats['requests'], stats['connections'], stats['reused'])
+            print 'rate limits of {}: {} calls throttled for {:.1f} seconds, {} retries, {} calls failed after ' \
+                  'their last retry'.format(nsx_manager, stats['throttled'], stats['throttled_seconds'],
+                                            stats['retried'], stats['retries_exhausted'])
+
+    atexit.register(print_stats)
@@ -22,9 +22,31 @@
 # AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.”
 
+from libhttp import DEFAULT_POOL_SIZE, DEFAULT_RETRIES, DEFAULT_RETRY_BACKOFF, RetryPolicy
+from libhttp import mount_pooled_adapter, print_connection_stats_at_exit, rate_limiter
 from pyVim.connect import SmartConnect
-from pyVmomi import vim
+from pyVmomi import vim, vmodl
+from nsxramlclient import http_session
+from nsxramlclient.client import NsxClient, NsxRaml
+from nsxramlclient.exceptions import NsxError
+from pkg_resources import resource_filename
+from collections import namedtuple
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import cPickle
+import ConfigParser
+import csv
+import hashlib
+import json
+import os
+import pyraml.parser
+import re
 import ssl
+import sys
+import tempfile
+import threading
+import time
+import yaml
 
 __author__ = 'Dimitri Desmidt, Emanuele Mazza, Yves Fauser, Andreas La Quiante'
 
@@ -43,26 +65,46 @@ VIM_TYPES = {'datacenter': [vim.Datacenter],
              'vapp': [vim.ResourcePool],
              'vnic': [vim.VirtualMachine]}
 
+# Maximum number of objects returned per PropertyCollector call, the rest is read in further pages
+PROPERTY_COLLECTOR_PAGE_SIZE = 1000
+
+# Bumped whenever the layout of the pre-parsed RAML spec cache changes
+RAML_CACHE_VERSION = 1
+
+_raml_specs = {}
+_nsx_clients = {}
+_nsx_clients_lock = threading.Lock()
+
+# Seconds an edge name to id index is trusted before the edge list is read again from NSX Manager
+EDGE_CACHE_TTL = 300
+
+_edge_cache = {}
+_edge_cache_stats = {'hits': 0, 'misses': 0}
+_edge_cache_lock = threading.Lock()
+
+# Default seconds an object list stored in the on-disk inventory cache is trusted, per object type
+INVENTORY_CACHE_TTLS = {'edges': 300,
+                        'logical_switches': 300,
+                        'ipsets': 600,
+                        'macsets': 600,
+                        'secgroups': 600}
+
+_inventory_caches = {}
+
+# Default number of concurrent NSX Manager calls of parallel_map, kept low so that a report does not crowd out the
+# other API clients of NSX Manager
+PARALLEL_WORKERS = 8
+
 
 def nametovalue (vccontent, client_session, name, type):
     if type == 'ipset':
-        ipset_id = str()
         scopename = 'globalroot-0'
-        ipsets = get_ipsets(client_session, scopename)
-        ipsets_list = ipsets.items()[1][1]['list']['ipset']
-        for i, val in enumerate(ipsets_list):
-            if str(val['name']) == name:
-                ipset_id = val['objectId']
+        ipset_id = _scoped_object_id(get_ipsets, 'ipset', client_session, scopename, name)
         return str(ipset_id)
 
     elif type == 'macset':
-        macset_id = str()
         scopename = 'globalroot-0'
-        macsets = get_macsets(client_session, scopename)
-        macsets_list = macsets.items()[1][1]['list']['macset']
-        for i, val in enumerate(macsets_list):
-            if str(val['name']) == name:
-                macset_id = val['objectId']
+        macset_id = _scoped_object_id(get_macsets, 'macset', client_session, scopename, name)
         return str(macset_id)
 
     elif type == 'ls':
@@ -71,13 +113,8 @@ def nametovalue (vccontent, client_session, name, type):
         return str(ls_id)
 
     elif type == 'secgroup':
-        secgroup_id = str()
         scopename = 'globalroot-0'
-        secgroups = get_secgroups(client_session, scopename)
-        secgroups_list = secgroups.items()[1][1]['list']['securitygroup']
-        for i, val in enumerate(secgroups_list):
-            if str(val['name']) == name:
-                secgroup_id = val['objectId']
+        secgroup_id = _scoped_object_id(get_secgroups, 'securitygroup', client_session, scopename, name)
         return str(secgroup_id)
 
     else:
@@ -85,6 +122,57 @@ def nametovalue (vccontent, client_session, name, type):
         return str(obj._moId)
 
 
+def name_to_value_index(vccontent, client_session, type):
+    """
+    This function returns all the names of an object type with their ids, to translate many names with one read
+    :param vccontent: The vCenter service content, only used for the vCenter object types of VIM_TYPES
+    :param client_session: An instance of an NsxClient Session
+    :param type: The object type as used with nametovalue, e.g. 'ipset', 'macset', 'secgroup', 'ls' or 'vm'
+    :return: A dictionary with the object names as keys and the object ids as values
+    """
+    scopename = 'globalroot-0'
+    if type in ['ipset', 'macset', 'secgroup']:
+        get_function, list_key = {'ipset': (get_ipsets, 'ipset'),
+                                  'macset': (get_macsets, 'macset'),
+                                  'secgroup': (get_secgroups, 'securitygroup')}[type]
+        objects = get_function(client_session, scopename)
+        objects_list = client_session.normalize_list_return(objects.items()[1][1]['list'][list_key])
+        index = {}
+        for val in objects_list:
+            index.setdefault(str(val['name']), str(val['objectId']))
+        return index
+
+    elif type == 'ls':
+        all_lswitches = _inventory_cache_read(client_session, 'logical_switches')
+        if all_lswitches is None:
+            all_lswitches = client_session.read_all_pages('logicalSwitchesGlobal', 'read')
+            _inventory_cache_write(client_session, 'logical_switches', all_lswitches)
+        index = {}
+        for val in all_lswitches:
+            index.setdefault(str(val['name']), str(val['objectId']))
+        return index
+
+    else:
+        return get_name_to_moid(vccontent, VIM_TYPES[type])
+
+
+def _scoped_object_id(get_function, list_key, client_session, scopename, name):
+    object_id = str()
+    objects = get_function(client_session, scopename)
+    objects_list = objects.items()[1][1]['list'][list_key]
+    for i, val in enumerate(objects_list):
+        if str(val['name']) == name:
+            object_id = val['objectId']
+    if not object_id and _session_key(client_session) in _inventory_caches:
+        # the name might be missing from a cached list only, so look it up in a fresh one
+        objects = get_function(client_session, scopename, use_cache=False)
+        objects_list = objects.items()[1][1]['list'][list_key]
+        for i, val in enumerate(objects_list):
+            if str(val['name']) == name:
+                object_id = val['objectId']
+    return object_id
+
+
 def get_scope(client_session, transport_zone_name):
     """
     :param client_session: An instance of an NsxClient Session
@@ -103,21 +191,36 @@ def get_scope(client_session, transport_zone_name):
     return vdn_scope['objectId'], vdn_scope
 
 
-def get_ipsets(client_session, scopename):
+def get_ipsets(client_session, scopename, use_cache=True):
     #TODO documentation
-    ip_sets = client_session.read('ipsetList', uri_parameters={'scopeMoref': scopename})
+    cache_name = 'ipsets_{}'.format(scopename)
+    ip_sets = _inventory_cache_read(client_session, 'ipsets', cache_name) if use_cache else None
+    if ip_sets is None:
+        ip_sets = client_session.read('ipsetList', uri_parameters={'scopeMoref': scopename})
+        if ip_sets['status'] == 200:
+            _inventory_cache_write(client_session, 'ipsets', ip_sets, cache_name)
     return ip_sets
 
 
-def get_macsets(client_session, scopename):
+def get_macsets(client_session, scopename, use_cache=True):
     #TODO documentation
-    mac_sets = client_session.read('macsetScopes', uri_parameters={'scopeId': scopename})
+    cache_name = 'macsets_{}'.format(scopename)
+    mac_sets = _inventory_cache_read(client_session, 'macsets', cache_name) if use_cache else None
+    if mac_sets is None:
+        mac_sets = client_session.read('macsetScopes', uri_parameters={'scopeId': scopename})
+        if mac_sets['status'] == 200:
+            _inventory_cache_write(client_session, 'macsets', mac_sets, cache_name)
     return mac_sets
 
 
-def get_secgroups(client_session, scopename):
+def get_secgroups(client_session, scopename, use_cache=True):
     #TODO documentation
-    secgroups = client_session.read('secGroupScope', uri_parameters={'scopeId': scopename})
+    cache_name = 'secgroups_{}'.format(scopename)
+    secgroups = _inventory_cache_read(client_session, 'secgroups', cache_name) if use_cache else None
+    if secgroups is None:
+        secgroups = client_session.read('secGroupScope', uri_parameters={'scopeId': scopename})
+        if secgroups['status'] == 200:
+            _inventory_cache_write(client_session, 'secgroups', secgroups, cache_name)
     return secgroups
 
 
@@ -128,7 +231,11 @@ def get_logical_switch(client_session, logical_switch_name):
     :return: A tuple, with the first item being the logical switch id as string of the first Scope found with the
              right name and the second item being a dictionary of the logical parameters as return by the NSX API
     """
-    all_lswitches = client_session.read_all_pages('logicalSwitchesGlobal', 'read')
+    all_lswitches = _inventory_cache_read(client_session, 'logical_switches')
+    if all_lswitches is None or not [scope for scope in all_lswitches if scope['name'] == logical_switch_name]:
+        # a switch missing from the cached list may have been created by an other client, so read it again
+        all_lswitches = client_session.read_all_pages('logicalSwitchesGlobal', 'read')
+        _inventory_cache_write(client_session, 'logical_switches', all_lswitches)
     try:
         logical_switch_params = [scope for scope in all_lswitches if scope['name'] == logical_switch_name][0]
         logical_switch_id = logical_switch_params['objectId']
@@ -138,21 +245,68 @@ def get_logical_switch(client_session, logical_switch_name):
     return logical_switch_id, logical_switch_params
 
 
+def retrieve_properties(content, vimtype, properties=None, page_size=None):
+    """
+    This function reads properties of all objects of the given types in one PropertyCollector query, instead of one
+    round-trip per object and property
+    :param content: The vCenter service content as returned by connect_to_vc
+    :param vimtype: A list of managed object types, e.g. one of the values of VIM_TYPES
+    :param properties: (Optional) A list of property paths to read in addition to the name,
+                       e.g. ['hardware.cpuInfo.numCpuPackages', 'vm']
+    :param page_size: (Optional) The maximum number of objects per call, defaults to PROPERTY_COLLECTOR_PAGE_SIZE
+    :return: A list of tuples, the first item being the managed object and the second a dictionary of the retrieved
+             property paths and values. Properties not set on an object are missing from its dictionary
+    """
+    path_set = ['name'] + [prop for prop in properties or [] if prop != 'name']
+    collector = content.propertyCollector
+    container = content.viewManager.CreateContainerView(content.rootFolder, vimtype, True)
+
+    try:
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(name='traverseView', path='view', skip=False,
+                                                                     type=vim.view.ContainerView)
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=container, skip=True, selectSet=[traversal_spec])
+        property_specs = [vmodl.query.PropertyCollector.PropertySpec(type=mo_type, pathSet=path_set, all=False)
+                          for mo_type in vimtype]
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=property_specs)
+        options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=page_size or PROPERTY_COLLECTOR_PAGE_SIZE)
+
+        objects = []
+        result = collector.RetrievePropertiesEx([filter_spec], options)
+        while result:
+            for object_content in result.objects:
+                objects.append((object_content.obj, dict((prop.name, prop.val) for prop in object_content.propSet)))
+            if not result.token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(result.token)
+    finally:
+        container.Destroy()
+
+    return objects
+
+
+def get_name_to_moid(content, vimtype):
+    """
+    :param content: The vCenter service content as returned by connect_to_vc
+    :param vimtype: A list of managed object types, e.g. one of the values of VIM_TYPES
+    :return: A dictionary with the names of all objects of the given types as keys and their moids as values
+    """
+    name_to_moid = {}
+    for managed_object_ref, props in retrieve_properties(content, vimtype):
+        name_to_moid.setdefault(props.get('name'), str(managed_object_ref._moId))
+    return name_to_moid
+
+
 def get_mo_by_name(content, searchedname, vim_type):
-    mo_dict = get_all_objs(content, vim_type)
-    for obj in mo_dict:
-        if obj.name == searchedname:
-            return obj
+    for managed_object_ref, props in retrieve_properties(content, vim_type):
+        if props.get('name') == searchedname:
+            return managed_object_ref
     return None
 
 
 def get_all_objs(content, vimtype):
     obj = {}
-    container = content.viewManager.CreateContainerView(content.rootFolder, vimtype, True)
-
-    for managed_object_ref in container.view:
-        obj.update({managed_object_ref: managed_object_ref.name})
-    container.Destroy()
+    for managed_object_ref, props in retrieve_properties(content, vimtype):
+        obj.update({managed_object_ref: props.get('name')})
     return obj
 
 
@@ -178,6 +332,427 @@ def connect_to_vc(vchost, user, pwd):
     return service_instance.RetrieveContent()
 
 
+def _raml_spec_digest(raml_file):
+    # the spec includes the schemas next to it, so changes to them need to invalidate the cache as well
+    digest = hashlib.sha1()
+    with open(raml_file, 'rb') as raml_fd:
+        digest.update(raml_fd.read())
+    schemas_dir = os.path.join(os.path.dirname(os.path.abspath(raml_file)), 'schemas')
+    if os.path.isdir(schemas_dir):
+        for schema_file in sorted(os.listdir(schemas_dir)):
+            schema_path = os.path.join(schemas_dir, schema_file)
+            if os.path.isfile(schema_path):
+                digest.update(schema_file)
+                with open(schema_path, 'rb') as schema_fd:
+                    digest.update(schema_fd.read())
+    return digest.hexdigest()
+
+
+def _raml_cache_files(raml_file):
+    # next to the spec if possible, the users home directory is used if the spec directory is not writable
+    raml_file = os.path.abspath(raml_file)
+    cache_name = '.{}.cache'.format(os.path.basename(raml_file))
+    home_name = '{}_{}.cache'.format(os.path.basename(raml_file), hashlib.sha1(raml_file).hexdigest()[:12])
+    return [os.path.join(os.path.dirname(raml_file), cache_name),
+            os.path.join(os.path.expanduser('~'), '.pynsxv', 'raml_cache', home_name)]
+
+
+def load_raml_spec(raml_file):
+    """
+    This function returns the parsed RAML spec, using a pre-parsed copy stored next to the spec file when it is still
+    valid for the spec and its schemas. The parsed spec is kept for the lifetime of the process
+    :param raml_file: The path to the RAML file
+    :return: The root of the parsed RAML spec as returned by pyraml.parser.load
+    """
+    raml_file = os.path.abspath(raml_file)
+    if raml_file in _raml_specs:
+        return _raml_specs[raml_file]
+
+    try:
+        digest = _raml_spec_digest(raml_file)
+    except IOError:
+        digest = None
+
+    raml_root = None
+    if digest:
+        for cache_file in _raml_cache_files(raml_file):
+            try:
+                with open(cache_file, 'rb') as cache_fd:
+                    cached = cPickle.load(cache_fd)
+                if cached['version'] == RAML_CACHE_VERSION and cached['digest'] == digest:
+                    raml_root = cached['raml']
+                    break
+            except Exception:
+                # a missing, outdated or unreadable cache only means that the spec is parsed again
+                continue
+
+    if raml_root is None:
+        raml_root = pyraml.parser.load(raml_file)
+        if digest:
+            _write_raml_cache(raml_file, {'version': RAML_CACHE_VERSION, 'digest': digest, 'raml': raml_root})
+
+    _raml_specs[raml_file] = raml_root
+    return raml_root
+
+
+def _write_raml_cache(raml_file, cached):
+    for cache_file in _raml_cache_files(raml_file):
+        temp_file = None
+        try:
+            if not os.path.isdir(os.path.dirname(cache_file)):
+                os.makedirs(os.path.dirname(cache_file))
+            temp_fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file), suffix='.tmp')
+            with os.fdopen(temp_fd, 'wb') as cache_fd:
+                cPickle.dump(cached, cache_fd, cPickle.HIGHEST_PROTOCOL)
+            if os.name == 'nt':
+                _remove_cache_file(cache_file)
+            os.rename(temp_file, cache_file)
+            return
+        except Exception:
+            if temp_file:
+                _remove_cache_file(temp_file)
+
+
+class SpecCachedNsxClient(NsxClient):
+    """
+    An NsxClient built from the parsed RAML spec returned by load_raml_spec, instead of parsing the spec for every
+    client
+    """
+    def __init__(self, raml_file, nsxmanager, nsx_username, nsx_password, debug=None, verify=None,
+                 suppress_warnings=None, fail_mode=None):
+        self._nsx_raml_file = raml_file
+        self._nsxraml = NsxRaml.__new__(NsxRaml)
+        self._nsxraml._nsxraml = load_raml_spec(raml_file)
+        self._nsxraml._base_uri = re.sub('\{nsxmanager\}', nsxmanager, self._nsxraml._nsxraml.baseUri)
+        self._nsx_username = nsx_username
+        self._nsx_password = nsx_password
+        self._debug = debug
+        self._verify = verify
+        if suppress_warnings:
+            self._suppress_warnings = suppress_warnings
+        else:
+            self._suppress_warnings = True
+        if fail_mode:
+            self.fail_mode = fail_mode
+        else:
+            self.fail_mode = 'exit'
+
+        self._httpsession = http_session.Session(self._nsx_username, self._nsx_password, self._debug, self._verify,
+                                                 self._suppress_warnings, self.fail_mode)
+
+
+def get_raml_file(config):
+    """
+    :param config: The ConfigParser instance of the ini file
+    :return: The RAML file set in the [nsxraml] section of the ini file, or the bundled spec if not set
+    """
+    try:
+        return config.get('nsxraml', 'nsxraml_file')
+    except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
+        return '{}/nsxvapi.raml'.format(nsxramlfile_dir)
+
+
+def _http_policies_from_config(config, nsx_manager):
+    """
+    This function reads the rate limits and the retries of the [nsxv] section, per method kind: 'get' for GET calls
+    and 'write' for PUT, POST and DELETE calls. The options are get_rate_limit and write_rate_limit in calls per
+    second (0, the default, does not limit), get_retries and write_retries, and retry_backoff in seconds
+    :param config: The ConfigParser instance of the ini file
+    :param nsx_manager: The NSX Manager name, the rate limiters are shared by the sessions of an NSX Manager
+    :return: A tuple with the dictionaries of rate limiters and of retry policies per method kind
+    """
+    def option(name, default):
+        if config.has_option('nsxv', name):
+            return config.getfloat('nsxv', name)
+        return default
+
+    backoff = option('retry_backoff', DEFAULT_RETRY_BACKOFF)
+    rate_limiters = {}
+    retry_policies = {}
+    for kind in ('get', 'write'):
+        rate_limiters[kind] = rate_limiter(nsx_manager, kind, option('{}_rate_limit'.format(kind), 0))
+        retry_policies[kind] = RetryPolicy(int(option('{}_retries'.format(kind), DEFAULT_RETRIES)), backoff)
+    return rate_limiters, retry_policies
+
+
+def nsx_client_from_config(config, debug=False, refresh_cache=False):
+    """
+    This function returns the NsxClient Session for the NSX Manager of an ini file. Sessions are created once per NSX
+    Manager and user and reused afterwards, the RAML spec is parsed once per process. The connections to NSX Manager
+    are kept open between calls, up to the pool_size option of the [nsxv] section. The calls are rate limited and
+    retried as set in the [nsxv] section, see _http_policies_from_config
+    :param config: The ConfigParser instance of the ini file
+    :param debug: (Optional) If True, the client prints low level debug of http transactions
+    :param refresh_cache: (Optional) If True, the on-disk inventory cache of the NSX Manager is dropped
+    :return: An instance of an NsxClient Session
+    """
+    raml_file = get_raml_file(config)
+    nsx_manager = config.get('nsxv', 'nsx_manager')
+    client_key = (os.path.abspath(raml_file), nsx_manager, config.get('nsxv', 'nsx_username'), bool(debug))
+
+    with _nsx_clients_lock:
+        client_session = _nsx_clients.get(client_key)
+        if not client_session:
+            client_session = SpecCachedNsxClient(raml_file, nsx_manager, config.get('nsxv', 'nsx_username'),
+                                                 config.get('nsxv', 'nsx_password'), debug=debug)
+            pool_size = DEFAULT_POOL_SIZE
+            if config.has_option('nsxv', 'pool_size'):
+                pool_size = config.getint('nsxv', 'pool_size')
+            rate_limiters, retry_policies = _http_policies_from_config(config, nsx_manager)
+            mount_pooled_adapter(client_session, pool_size, rate_limiters, retry_policies)
+            if debug:
+                print_connection_stats_at_exit(client_session, nsx_manager)
+            _nsx_clients[client_key] = client_session
+
+    inventory_cache_from_config(client_session, config, refresh=refresh_cache)
+    return client_session
+
+
+class LazyVcContent(object):
+    """
+    A stand-in for the vCenter service content returned by connect_to_vc. The connection to vCenter is only made when
+    the first attribute is accessed, so commands that never use vCenter don't need to connect to it
+    """
+    def __init__(self, vchost, user, pwd):
+        self._vc_credentials = (vchost, user, pwd)
+        self._vc_content = None
+        self._vc_lock = threading.Lock()
+
+    def _connect(self):
+        with self._vc_lock:
+            if self._vc_content is None:
+                self._vc_content = connect_to_vc(*self._vc_credentials)
+        return self._vc_content
+
+    @property
+    def connected(self):
+        return self._vc_content is not None
+
+    def __getattr__(self, name):
+        return getattr(self._connect(), name)
+
+
+def lazy_connect_to_vc(vchost, user, pwd):
+    """
+    :param vchost: The vCenter host name or IP, optionally followed by :port
+    :param user: The vCenter user name
+    :param pwd: The vCenter password
+    :return: A LazyVcContent instance, which connects to vCenter the first time it is used
+    """
+    return LazyVcContent(vchost, user, pwd)
+
+
+def _session_key(client_session):
+    # Sessions talking to the same NSX Manager share their cached indexes
+    try:
+        return client_session._nsxraml._base_uri
+    except AttributeError:
+        return id(client_session)
+
+
+def enable_inventory_cache(client_session, cache_dir, nsx_manager, ttls=None, refresh=False):
+    """
+    This function enables the on-disk inventory cache for the lookups done with a client session. The cache is shared
+    by all pynsxv runs using the same cache directory and NSX Manager
+    :param client_session: An instance of an NsxClient Session
+    :param cache_dir: The directory holding the cache files, a sub directory is used per NSX Manager
+    :param nsx_manager: The NSX Manager as configured in the ini file, used as the cache key
+    :param ttls: (Optional) A dictionary of object type to seconds, overriding the entries of INVENTORY_CACHE_TTLS
+    :param refresh: (Optional) If True, the cached files of this NSX Manager are dropped and read again when needed
+    :return: The directory used for the cache files of this NSX Manager
+    """
+    directory = os.path.join(os.path.expanduser(cache_dir), re.sub(r'[^\w.-]', '_', nsx_manager))
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # an other run might have created it in the meantime
+            if not os.path.isdir(directory):
+                raise
+
+    cache_ttls = dict(INVENTORY_CACHE_TTLS)
+    if ttls:
+        cache_ttls.update(ttls)
+
+    _inventory_caches[_session_key(client_session)] = {'directory': directory, 'ttls': cache_ttls}
+
+    if refresh:
+        for cache_file in os.listdir(directory):
+            if cache_file.endswith('.cache'):
+                _remove_cache_file(os.path.join(directory, cache_file))
+
+    return directory
+
+
+def inventory_cache_from_config(client_session, config, refresh=False):
+    """
+    This function enables the on-disk inventory cache if the ini file has a [cache] section with a cache_dir option.
+    TTLs per object type are set with options like ttl_edges = 300
+    :param client_session: An instance of an NsxClient Session
+    :param config: The ConfigParser instance of the ini file
+    :param refresh: (Optional) If True, the cached files of this NSX Manager are dropped and read again when needed
+    :return: The directory used for the cache files, or None if the cache is not configured
+    """
+    if not (config.has_section('cache') and config.has_option('cache', 'cache_dir')):
+        return None
+
+    ttls = {}
+    for object_type in INVENTORY_CACHE_TTLS:
+        if config.has_option('cache', 'ttl_{}'.format(object_type)):
+            ttls[object_type] = config.getint('cache', 'ttl_{}'.format(object_type))
+
+    return enable_inventory_cache(client_session, config.get('cache', 'cache_dir'),
+                                  config.get('nsxv', 'nsx_manager'), ttls=ttls, refresh=refresh)
+
+
+def _cache_file_path(client_session, object_type, cache_name):
+    settings = _inventory_caches.get(_session_key(client_session))
+    if not settings or not settings['ttls'].get(object_type):
+        return None, None
+    return os.path.join(settings['directory'], '{}.cache'.format(cache_name)), settings['ttls'][object_type]
+
+
+def _remove_cache_file(cache_file):
+    try:
+        os.remove(cache_file)
+    except OSError:
+        pass
+
+
+def _inventory_cache_read(client_session, object_type, cache_name=None):
+    cache_file, ttl = _cache_file_path(client_session, object_type, cache_name or object_type)
+    if not cache_file:
+        return None
+
+    try:
+        # pickled rather than json, so that a cached answer has the same str, dict and OrderedDict types as an answer
+        # of NSX Manager, nsxramlclient drops unicode and OrderedDict values from request bodies
+        with open(cache_file, 'rb') as cache_fd:
+            cached = cPickle.load(cache_fd)
+    except Exception:
+        return None
+
+    if time.time() - cached.get('timestamp', 0) >= ttl:
+        return None
+
+    return cached.get('data')
+
+
+def _inventory_cache_write(client_session, object_type, data, cache_name=None):
+    cache_file, ttl = _cache_file_path(client_session, object_type, cache_name or object_type)
+    if not cache_file:
+        return
+
+    try:
+        _write_file_atomically(cache_file, lambda cache_fd: cPickle.dump({'timestamp': time.time(), 'data': data},
+                                                                         cache_fd, cPickle.HIGHEST_PROTOCOL))
+    except (IOError, OSError, cPickle.PicklingError, TypeError):
+        pass
+
+
+def _write_file_atomically(target_file, dump):
+    # writes through a temporary file renamed once written, so that parallel runs never read a partial file
+    temp_file = None
+    try:
+        temp_fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target_file)), suffix='.tmp')
+        with os.fdopen(temp_fd, 'wb') as target_fd:
+            dump(target_fd)
+        if os.name == 'nt':
+            _remove_cache_file(target_file)
+        os.rename(temp_file, target_file)
+    except:
+        if temp_file:
+            _remove_cache_file(temp_file)
+        raise
+
+
+def api_text(value):
+    """
+    This function returns text as it can be sent to NSX Manager in a request body. nsxramlclient drops unicode values
+    from the request bodies, e.g. all the strings of a json file, and lxml refuses the non ASCII bytes of a str, so
+    text is sent as an ASCII str
+    :param value: The value, values other than text are returned unchanged
+    :return: The value, a unicode value being encoded to str
+    :raise ValueError: If the text has non ASCII characters, e.g. a utf-8 str read from a csv or text file
+    """
+    try:
+        if isinstance(value, unicode):
+            return value.encode('ascii')
+        elif isinstance(value, str):
+            value.decode('ascii')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        raise ValueError('{} has non ASCII characters, which cannot be sent to NSX Manager'.format(
+            value.encode('utf-8') if isinstance(value, unicode) else value))
+    return value
+
+
+def write_json_file(json_file, data):
+    """
+    This function writes data to a json file through a temporary file renamed once written, so that parallel runs
+    never read a partially written file
+    :param json_file: The path of the file
+    :param data: The data to write, it must be serializable to json
+    """
+    _write_file_atomically(json_file, lambda json_fd: json.dump(data, json_fd))
+
+
+def invalidate_inventory_cache(client_session, object_type):
+    """
+    This function drops the on-disk cache of an object type, it needs to be called whenever objects of this type are
+    created or deleted
+    :param client_session: An instance of an NsxClient Session
+    :param object_type: The object type, one of the keys of INVENTORY_CACHE_TTLS
+    """
+    settings = _inventory_caches.get(_session_key(client_session))
+    if not settings:
+        return
+    for cache_file in os.listdir(settings['directory']):
+        if cache_file == '{}.cache'.format(object_type) or cache_file.startswith('{}_'.format(object_type)):
+            _remove_cache_file(os.path.join(settings['directory'], cache_file))
+
+
+def set_edge_cache_ttl(ttl):
+    """
+    :param ttl: The number of seconds an edge name to id index is used before it is read again, 0 disables caching
+    """
+    global EDGE_CACHE_TTL
+    EDGE_CACHE_TTL = int(ttl)
+
+
+def invalidate_edge_cache(client_session=None):
+    """
+    This function drops the cached edge name to id index, it needs to be called whenever edges are created or deleted
+    :param client_session: (Optional) An instance of an NsxClient Session, only the index of its NSX Manager is
+                           dropped. If not specified the indexes of all NSX Managers are dropped
+    """
+    with _edge_cache_lock:
+        if client_session:
+            _edge_cache.pop(_session_key(client_session), None)
+        else:
+            _edge_cache.clear()
+    if client_session:
+        invalidate_inventory_cache(client_session, 'edges')
+
+
+def edge_cache_stats():
+    """
+    :return: A dictionary with the number of lookups served from the edge index ('hits'), the number of lookups that
+             needed a read of all edges from NSX Manager ('misses') and the number of cached indexes ('entries')
+    """
+    with _edge_cache_lock:
+        return {'hits': _edge_cache_stats['hits'], 'misses': _edge_cache_stats['misses'],
+                'entries': len(_edge_cache)}
+
+
+def _build_edge_index(all_edge):
+    edge_index = {}
+    for edge in all_edge or []:
+        # keep the first edge found with a given name, like the former linear search did
+        edge_index.setdefault(edge.get('name'), edge)
+    return edge_index
+
+
 def get_edge(client_session, edge_name):
     """
     :param client_session: An instance of an NsxClient Session
@@ -185,13 +760,30 @@ def get_edge(client_session, edge_name):
     :return: A tuple, with the first item being the edge or dlr id as string of the first Scope found with the
              right name and the second item being a dictionary of the logical parameters as return by the NSX API
     """
-    all_edge = client_session.read_all_pages('nsxEdges', 'read')
+    cache_key = _session_key(client_session)
+
+    with _edge_cache_lock:
+        cached = _edge_cache.get(cache_key)
+        if cached and time.time() - cached['timestamp'] < EDGE_CACHE_TTL and edge_name in cached['edges']:
+            _edge_cache_stats['hits'] += 1
+            edge_params = cached['edges'][edge_name]
+            return edge_params['objectId'], edge_params
+        _edge_cache_stats['misses'] += 1
+
+    edge_index = _build_edge_index(_inventory_cache_read(client_session, 'edges'))
+    if edge_name not in edge_index:
+        # an edge missing from the on-disk list may have been created by an other client, so read it again
+        all_edge = client_session.read_all_pages('nsxEdges', 'read')
+        _inventory_cache_write(client_session, 'edges', all_edge)
+        edge_index = _build_edge_index(all_edge)
+
+    with _edge_cache_lock:
+        _edge_cache[cache_key] = {'timestamp': time.time(), 'edges': edge_index}
 
     try:
-        edge_params = [scope for scope in all_edge if scope['name'] == edge_name][0]
+        edge_params = edge_index[edge_name]
         edge_id = edge_params['objectId']
-
-    except IndexError:
+    except KeyError:
         return None, None
 
     return edge_id, edge_params
@@ -237,6 +829,186 @@ def get_vm_by_name(content, vm_name):
         return None
 
 
+def call_with_status(function, *args, **kwargs):
+    """
+    This function makes one call of a client session and returns its answer even for an error status code, whatever
+    the fail_mode of the session, e.g. so that a 412 answer to an If-match request can be retried instead of exiting.
+    The fail_mode of the session is shared by all threads using it and is left unchanged
+    :param function: The method of the client session to call, e.g. client_session.update
+    :param args: The positional arguments of the call
+    :param kwargs: The keyword arguments of the call
+    :return: The answer dictionary of the call, for an error status code the body holds the error message of NSX
+             Manager and location, objectId and Etag are None
+    """
+    try:
+        return function(*args, **kwargs)
+    except SystemExit as e:
+        # the session exits on an error status code with fail_mode 'exit'
+        bad_status = re.match(r'receive bad status code (\d+)\n?(.*)', str(e.code), re.DOTALL)
+        if not bad_status:
+            raise
+        status, body = int(bad_status.group(1)), bad_status.group(2)
+    except NsxError as e:
+        status, body = e.status, e.msg
+    return {'status': status, 'body': body, 'location': None, 'objectId': None, 'Etag': None}
+
+
+def stream_resource(client_session, searched_resource, uri_parameters=None, query_parameters_dict=None):
+    """
+    This function sends a GET for a resource without reading the body, so that a large response can be parsed while
+    it is received instead of being converted to a dictionary as a whole by nsxramlclient
+    :param client_session: An instance of an NsxClient Session
+    :param searched_resource: The display name of the resource in the RAML file, e.g. 'dfwConfig'
+    :param uri_parameters: (Optional) The uri parameters of the resource
+    :param query_parameters_dict: (Optional) The query parameters of the request
+    :return: The requests response with its body not read yet, its raw attribute can be used as a file object and it
+             needs to be closed by the caller. None is returned for an error status code if the session fail_mode is
+             'continue', the session exits or raises NsxError otherwise
+    """
+    client_session._nsxraml.check_resource_methods_by_displayname(searched_resource, 'get')
+    url = client_session._nsxraml.contruct_resource_url(searched_resource, uri_parameters)
+    if query_parameters_dict:
+        url = client_session._nsxraml.add_query_parameter_url(url, searched_resource, 'get', query_parameters_dict)
+
+    response = client_session._httpsession._session.get(url, stream=True)
+    if response.status_code != 200:
+        error_content = response.content
+        response.close()
+        if client_session._httpsession.fail_mode == 'exit':
+            sys.exit('receive bad status code {}\n{}'.format(response.status_code, error_content))
+        elif client_session._httpsession.fail_mode == 'raise':
+            raise NsxError(response.status_code, error_content)
+        return None
+
+    # the body may be gzip encoded, the raw stream is not decoded by default
+    response.raw.decode_content = True
+    return response
+
+
+def _call_catching_errors(function, item):
+    try:
+        return function(item), None
+    except (Exception, SystemExit) as e:
+        return None, e
+
+
+def parallel_map(function, items, workers=PARALLEL_WORKERS, deadline=None):
+    """
+    This function calls a function for each item of a list in a bounded pool of threads, e.g. to read the details of
+    many edges concurrently with one client session
+    :param function: The function, called with one item as its only parameter
+    :param items: The list of items
+    :param workers: (Optional) The maximum number of concurrent calls, the items are processed one after the other
+                    if set to 1
+    :param deadline: (Optional) The seconds after which the calls not finished yet are given up, they are returned
+                     with a multiprocessing.TimeoutError
+    :return: A list with a tuple per item, in the order of the items. The tuple holds the result of the call and None,
+             or None and the exception raised by the call. A SystemExit, raised for an error status code if the
+             session fail_mode is 'exit', is returned as an error of the item too
+    """
+    items = list(items)
+    workers = min(max(int(workers), 1), len(items))
+    end_time = time.time() + deadline if deadline is not None else None
+    timeout_error = TimeoutError('not finished within the deadline of {} seconds'.format(deadline))
+
+    if workers <= 1:
+        results = []
+        for item in items:
+            if end_time is not None and time.time() >= end_time:
+                results.append((None, timeout_error))
+            else:
+                results.append(_call_catching_errors(function, item))
+        return results
+
+    pool = ThreadPool(workers)
+    try:
+        async_results = [pool.apply_async(_call_catching_errors, (function, item)) for item in items]
+        results = []
+        for async_result in async_results:
+            try:
+                if end_time is None:
+                    results.append(async_result.get())
+                else:
+                    results.append(async_result.get(max(end_time - time.time(), 0)))
+            except TimeoutError:
+                results.append((None, timeout_error))
+        return results
+    finally:
+        # the calls still running after the deadline are left behind, the pool threads are daemon threads
+        pool.terminate()
+
+
+def read_records_file(records_file, records_key=None):
+    """
+    This function reads a list of records from a yaml, json or csv file
+    :param records_file: The path to the file, files ending with .csv are read as csv with a header line
+    :param records_key: (Optional) If the yaml or json file contains a dictionary, the key holding the list of records
+    :return: A list of dictionaries, csv columns left empty are returned as None
+    """
+    with open(records_file, 'rb') as records_fd:
+        if records_file.lower().endswith('.csv'):
+            return [dict((key.strip(), (value or '').strip() or None) for key, value in row.items() if key)
+                    for row in csv.DictReader(records_fd)]
+        try:
+            records = yaml.safe_load(records_fd)
+        except yaml.YAMLError as e:
+            raise ValueError('{} is not a valid yaml or json file: {}'.format(records_file, e))
+
+    if isinstance(records, dict) and records_key:
+        records = records.get(records_key)
+    if not isinstance(records, list):
+        raise ValueError('{} does not contain a list of records'.format(records_file))
+    return records
+
+
+_NAME_PATTERN_BRACES = re.compile(r'\{([^{}]*)\}')
+_NAME_PATTERN_RANGE = re.compile(r'^(-?\d+)\.\.(-?\d+)$')
+
+
+def expand_name_pattern(name_pattern):
+    """
+    This function expands the braces of a name pattern like a shell does, e.g. tenant-{1..3} gives tenant-1, tenant-2
+    and tenant-3, tenant-{01..10} keeps the zero padding and web-{a,b}-{1..2} gives web-a-1, web-a-2, web-b-1, web-b-2
+    :param name_pattern: The name pattern
+    :return: The list of names, in order
+    """
+    match = _NAME_PATTERN_BRACES.search(name_pattern)
+    if not match:
+        return [name_pattern]
+    prefix, suffix = name_pattern[:match.start()], name_pattern[match.end():]
+    range_match = _NAME_PATTERN_RANGE.match(match.group(1))
+    if range_match:
+        first, last = range_match.groups()
+        width = len(first) if first.startswith('0') and len(first) > 1 else 0
+        step = 1 if int(last) >= int(first) else -1
+        values = [str(value).zfill(width) for value in range(int(first), int(last) + step, step)]
+    else:
+        values = match.group(1).split(',')
+    return [prefix + value + name for value in values for name in expand_name_pattern(suffix)]
+
+
+def read_names_file(names_file):
+    """
+    This function reads a list of names from a file, either a text file with one name per line, or a yaml, json or
+    csv file as read by read_records_file with a name field per record. Empty lines and lines starting with # are
+    skipped in text files
+    :param names_file: The path to the file
+    :return: The list of names, as str
+    :raise ValueError: If a name is not a text, e.g. an unquoted yaml 007 read as the number 7, or if it has non
+                       ASCII characters
+    """
+    if os.path.splitext(names_file)[1].lower() in ('.csv', '.yaml', '.yml', '.json'):
+        names = [record.get('name') if isinstance(record, dict) else record
+                 for record in read_records_file(names_file)]
+        for name in names:
+            if name is not None and not isinstance(name, basestring):
+                raise ValueError('The name {} of {} is not a text, quote it to keep it as written, e.g. "007"'.format(
+                    name, names_file))
+        return [api_text(name).strip() for name in names if name]
+    with open(names_file, 'rb') as names_fd:
+        return [api_text(line.strip()) for line in names_fd if line.strip() and not line.strip().startswith('#')]
+
+
 def check_for_parameters(mandatory, args):
     param = None
     try:
@@ -251,87 +1023,147 @@ def check_for_parameters(mandatory, args):
     return True
 
 
-def dfw_rule_list_helper(client_session, dfw_section, rule_list):
-    source_list = list()
-    destination_list = list()
-    service_list = list()
-    applyto_list = list()
+# A source, destination or applied to entry of a dfw rule
+DfwRuleObject = namedtuple('DfwRuleObject', ['type', 'name', 'value'])
 
-    for rptr in dfw_section:
-        rule_id = rptr['@id']
-        if 'name' in rptr:
-            rule_name = rptr['name']
-        else:
-            rule_name = str('')
-        rule_action = rptr['action']
-        rule_direction = rptr['direction']
-        rule_packetype = rptr['packetType']
-        rule_section_id = rptr['sectionId']
-
-        if 'sources' in rptr:
-            sources = client_session.normalize_list_return(rptr['sources']['source'])
-            for srcptr in sources:
-                if srcptr['type'] == 'Ipv4Address':
-                    rule_source = str(srcptr['value'])
-                elif srcptr['type'] == 'VirtualMachine':
-                    rule_source = str(srcptr['name'])
-                else:
-                    rule_source = srcptr['name']
-                source_list.append(rule_source)
-            source_list = " - ".join(source_list)
-        else:
-            source_list = 'any'
-
-        if 'destinations' in rptr:
-            destinations = client_session.normalize_list_return(rptr['destinations']['destination'])
-            for dscptr in destinations:
-                if dscptr['type'] == 'Ipv4Address':
-                    rule_destination = dscptr['value']
-                elif dscptr['type'] == 'VirtualMachine':
-                    rule_destination = dscptr['name']
-                else:
-                    rule_destination = dscptr['name']
-                destination_list.append(rule_destination)
-            destination_list = ' - '.join(destination_list)
-        else:
-            destination_list = 'any'
-
-        if 'services' in rptr:
-            services = client_session.normalize_list_return(rptr['services']['service'])
-            for srvcptr in services:
-                if 'name' in srvcptr:
-                    rule_services = srvcptr['name']
-                    service_list.append(rule_services)
-                if 'protocol' in srvcptr:
-                    if 'sourcePort' in srvcptr:
-                        source_port = str(srvcptr['sourcePort'])
-                    else:
-                        source_port = 'any'
-                    if 'destinationPort' in srvcptr:
-                        destination_port = str(srvcptr['destinationPort'])
-                    else:
-                        destination_port = 'any'
-                    protocol = srvcptr['protocolName']
-                    rule_services = protocol + ':' + source_port + ':' + destination_port
-                    service_list.append(rule_services)
-            service_list = ' | '.join(service_list)
-        else:
-            service_list = 'any'
-
-        if 'appliedToList' in rptr:
-            applyto = client_session.normalize_list_return(rptr['appliedToList']['appliedTo'])
-            for apptr in applyto:
-                rule_applyto = apptr['name']
-                applyto_list.append(rule_applyto)
-            applyto_list = ' - '.join(applyto_list)
-        else:
-            applyto_list = 'any'
+# A service entry of a dfw rule, either a service object with its name and id or a protocol with its ports
+DfwRuleService = namedtuple('DfwRuleService', ['name', 'value', 'protocol_name', 'source_port', 'destination_port'])
+
+
+class DfwRule(object):
+    """
+    A dfw rule as listed by dfw_rule_list_helper. The sources, destinations, services and applied to entries are kept
+    as tuples of DfwRuleObject and DfwRuleService, an empty tuple meaning any. The strings of the tabular view are
+    only built when the rule is printed. For compatibility the rule also behaves like the former list of fields
+    "ID", "Name", "Source", "Destination", "Service", "Action", "Direction", "Packet Type", "Applied-To",
+    "ID (Section)"
+    """
+    __slots__ = ('rule_id', 'name', 'sources', 'destinations', 'services', 'action', 'direction', 'packet_type',
+                 'applied_to', 'section_id')
+
+    def __init__(self, rule_id, name, sources, destinations, services, action, direction, packet_type, applied_to,
+                 section_id):
+        self.rule_id = rule_id
+        self.name = name
+        self.sources = sources
+        self.destinations = destinations
+        self.services = services
+        self.action = action
+        self.direction = direction
+        self.packet_type = packet_type
+        self.applied_to = applied_to
+        self.section_id = section_id
+
+    @classmethod
+    def from_rule(cls, client_session, rule):
+        """
+        :param client_session: An instance of an NsxClient Session
+        :param rule: The rule dictionary as returned by NSX Manager
+        :return: A DfwRule instance
+        """
+        def objects(entries_key, entry_key):
+            if entries_key not in rule:
+                return ()
+            return tuple(DfwRuleObject(entry.get('type'), entry.get('name'), entry.get('value'))
+                         for entry in client_session.normalize_list_return(rule[entries_key][entry_key]))
+
+        services = ()
+        if 'services' in rule:
+            services = tuple(DfwRuleService(service.get('name'), service.get('value'),
+                                            service.get('protocolName') if 'protocol' in service else None,
+                                            service.get('sourcePort'), service.get('destinationPort'))
+                             for service in client_session.normalize_list_return(rule['services']['service']))
+
+        return cls(rule['@id'], rule.get('name', str('')), objects('sources', 'source'),
+                   objects('destinations', 'destination'), services, rule['action'], rule['direction'],
+                   rule['packetType'], objects('appliedToList', 'appliedTo'), rule['sectionId'])
+
+    @staticmethod
+    def _objects_text(entries):
+        if not entries:
+            return 'any'
+        return ' - '.join(entry.value if entry.type == 'Ipv4Address' else entry.name for entry in entries)
+
+    @staticmethod
+    def _services_text(services):
+        if not services:
+            return 'any'
+        service_texts = list()
+        for service in services:
+            if service.name is not None:
+                service_texts.append(service.name)
+            if service.protocol_name is not None:
+                service_texts.append('{}:{}:{}'.format(service.protocol_name, service.source_port or 'any',
+                                                       service.destination_port or 'any'))
+        return ' | '.join(service_texts)
+
+    def row(self):
+        """
+        :return: The rule as the list of strings printed by the dfw commands
+        """
+        return [self.rule_id, self.name, self._objects_text(self.sources), self._objects_text(self.destinations),
+                self._services_text(self.services), self.action, self.direction, self.packet_type,
+                ' - '.join(entry.name for entry in self.applied_to) if self.applied_to else 'any', self.section_id]
+
+    @staticmethod
+    def _has_object(entries, identifier):
+        return any(entry.type == 'Ipv4Address' and entry.value == identifier or entry.name == identifier
+                   for entry in entries)
 
-        rule_list.append([rule_id, rule_name, source_list, destination_list, service_list, rule_action,
-                                     rule_direction, rule_packetype, applyto_list, rule_section_id])
-        source_list = list()
-        destination_list = list()
-        service_list = list()
-        applyto_list = list()
+    def has_source(self, identifier):
+        """
+        :param identifier: An ip address or the name of an object
+        :return: True if one of the sources of the rule matches the identifier
+        """
+        return self._has_object(self.sources, identifier)
+
+    def has_destination(self, identifier):
+        """
+        :param identifier: An ip address or the name of an object
+        :return: True if one of the destinations of the rule matches the identifier
+        """
+        return self._has_object(self.destinations, identifier)
+
+    def has_applied_to(self, name):
+        """
+        :param name: The name of an applied to entry
+        :return: True if the rule is applied to this name
+        """
+        return any(entry.name == name for entry in self.applied_to)
+
+    def __getitem__(self, index):
+        return self.row()[index]
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __iter__(self):
+        return iter(self.row())
+
+    def __eq__(self, other):
+        if isinstance(other, (DfwRule, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return repr(self.row())
+
+
+def dfw_rule_list_helper(client_session, dfw_section, rule_list):
+    """
+    This function appends the rules of a section to a list of rules
+    :param client_session: An instance of an NsxClient Session
+    :param dfw_section: The list of the rule dictionaries of a section as returned by NSX Manager
+    :param rule_list: The list to which a DfwRule is appended for each rule
+    :return: The rule list
+    """
+    for rptr in dfw_section:
+        rule_list.append(DfwRule.from_rule(client_session, rptr))
 
-    return rule_list
\ No newline at end of file
+    return rule_list
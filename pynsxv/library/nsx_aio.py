@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright © 2015-2016 VMware, Inc. All Rights Reserved.
+#
+# Licensed under the X11 (MIT) (the “License”) set forth below;
+#
+# you may not use this file except in compliance with the License. Unless required by applicable law or agreed to in
+# writing, software distributed under the License is distributed on an “AS IS” BASIS, without warranties or conditions
+# of any kind, EITHER EXPRESS OR IMPLIED. See the License for the specific language governing permissions and
+# limitations under the License. Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the
+# Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of
+# the Software.
+#
+# "THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN
+# AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.”
+
+import re
+from multiprocessing.pool import ThreadPool
+from nsxramlclient.exceptions import NsxError
+from libutils import get_edge, PARALLEL_WORKERS
+from nsx_dfw import dfw_section_list
+from nsx_esg import esg_read, esg_list
+from nsx_lb import list_pools, list_members
+from nsx_logical_switch import logical_switch_create, logical_switch_list
+
+__author__ = 'yfauser'
+
+
+def _call(function, client_session, args, kwargs):
+    try:
+        return function(client_session, *args, **kwargs)
+    except SystemExit as e:
+        # the session exits on an error status code with fail_mode 'exit', which would stop the pool thread silently
+        status = re.match(r'receive bad status code (\d+)', str(e.code))
+        raise NsxError(int(status.group(1)) if status else None, e.code)
+
+
+class NsxAsync(object):
+    """
+    A non blocking facade over the library functions, for callers driving many edges or logical switches at the same
+    time. Every call is scheduled on a bounded pool of threads sharing one client session and returns at once a
+    multiprocessing.pool.AsyncResult, whose get() returns what the library function returns or raises its error. An
+    error status code of NSX Manager is raised as NsxError. The pool size limits the number of NSX Manager calls in
+    flight, the blocking library functions stay unchanged
+    """
+    def __init__(self, client_session, max_concurrency=PARALLEL_WORKERS):
+        """
+        :param client_session: An instance of an NsxClient Session
+        :param max_concurrency: (Optional) The maximum number of library calls running at the same time, it should not
+                                exceed the connection pool size of the session (pool_size of the [nsxv] section)
+        """
+        self._client_session = client_session
+        self._pool = ThreadPool(max_concurrency)
+
+    def submit(self, function, *args, **kwargs):
+        """
+        This method schedules any library function taking the client session as its first parameter
+        :param function: The library function, e.g. nsx_esg.esg_route_list
+        :param args: The parameters of the function following the client session
+        :param kwargs: The keyword parameters of the function
+        :return: A multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(_call, (function, self._client_session, args, kwargs))
+
+    def map(self, function, items):
+        """
+        This method schedules a library function once per item, e.g. esg_read for a list of edge names
+        :param function: The library function, called with the client session and one item
+        :param items: The list of items
+        :return: A list of multiprocessing.pool.AsyncResult, in the order of the items
+        """
+        return [self.submit(function, item) for item in items]
+
+    @staticmethod
+    def gather(async_results, timeout=None):
+        """
+        :param async_results: A list of multiprocessing.pool.AsyncResult returned by this class
+        :param timeout: (Optional) The seconds to wait for each result
+        :return: A list with a (result, error) tuple per AsyncResult, in the same order. error is None if the call
+                 succeeded, otherwise the exception raised by the call
+        """
+        results = []
+        for async_result in async_results:
+            try:
+                results.append((async_result.get(timeout), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def get_edge(self, edge_name):
+        """
+        :return: An AsyncResult of libutils.get_edge
+        """
+        return self.submit(get_edge, edge_name)
+
+    def logical_switch_create(self, transport_zone, logical_switch_name, control_plane_mode=None):
+        """
+        :return: An AsyncResult of nsx_logical_switch.logical_switch_create
+        """
+        return self.submit(logical_switch_create, transport_zone, logical_switch_name,
+                           control_plane_mode=control_plane_mode)
+
+    def logical_switch_list(self):
+        """
+        :return: An AsyncResult of nsx_logical_switch.logical_switch_list
+        """
+        return self.submit(logical_switch_list)
+
+    def esg_read(self, esg_name):
+        """
+        :return: An AsyncResult of nsx_esg.esg_read
+        """
+        return self.submit(esg_read, esg_name)
+
+    def esg_list(self):
+        """
+        :return: An AsyncResult of nsx_esg.esg_list
+        """
+        return self.submit(esg_list)
+
+    def list_pools(self, esg_name):
+        """
+        :return: An AsyncResult of nsx_lb.list_pools
+        """
+        return self.submit(list_pools, esg_name)
+
+    def list_members(self, esg_name, pool_name):
+        """
+        :return: An AsyncResult of nsx_lb.list_members
+        """
+        return self.submit(list_members, esg_name, pool_name)
+
+    def dfw_section_list(self):
+        """
+        :return: An AsyncResult of nsx_dfw.dfw_section_list
+        """
+        return self.submit(dfw_section_list)
+
+    def close(self):
+        """
+        This method waits for the scheduled calls to finish and stops the pool threads
+        """
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
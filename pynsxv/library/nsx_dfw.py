@@ -24,29 +24,355 @@
 
 import argparse
 import ConfigParser
+import copy
+import csv
+import sys
+import time
 from argparse import RawTextHelpFormatter
+from collections import OrderedDict, namedtuple
+from lxml import etree
+from nsxramlclient.xmloperations import xml_to_dict
 from tabulate import tabulate
-from nsxramlclient.client import NsxClient
-from pkg_resources import resource_filename
-from libutils import dfw_rule_list_helper
-from libutils import connect_to_vc
-from libutils import nametovalue
+from libutils import api_text, dfw_rule_list_helper
+from libutils import lazy_connect_to_vc
+from libutils import nametovalue, name_to_value_index
+from libutils import nsx_client_from_config
+from libutils import read_records_file, call_with_status
+from libutils import stream_resource
 
 __author__ = 'Emanuele Mazza'
 
+API_TYPES = {'dc': 'Datacenter', 'ipset': 'IPSet', 'macset': 'MACSet', 'ls': 'VirtualWire',
+             'secgroup': 'SecurityGroup', 'host': 'HostSystem', 'vm':'VirtualMachine',
+             'cluster': 'ClusterComputeResource', 'dportgroup': 'DistributedVirtualPortgroup',
+             'portgroup': 'Network', 'respool': 'ResourcePool', 'vapp': 'ResourcePool', 'vnic': 'VirtualMachine',
+             'Ipv4Address': 'Ipv4Address'}
 
-def dfw_section_list(client_session):
+APPLYTO_VALUES = {'any': 'ANY', 'dfw': 'DISTRIBUTED_FIREWALL', 'edgegw': 'ALL_EDGES'}
+
+# Rule type, configuration key, section resource and section uri parameter of the three kinds of sections
+DFW_SECTION_RESOURCES = [('LAYER3', 'layer3Sections', 'dfwL3SectionId', 'sectionId'),
+                         ('LAYER2', 'layer2Sections', 'dfwL2SectionId', 'sectionId'),
+                         ('L3REDIRECT', 'layer3RedirectSections', 'section', 'section')]
+
+# Values used by dfw_rules_bulk_create for the rule parameters not set in a rule
+DFW_RULE_DEFAULTS = {'action': 'allow', 'direction': 'inout', 'pktype': 'any', 'applyto': 'any', 'disabled': 'false',
+                     'logged': 'false', 'source_type': 'Ipv4Address', 'source_excluded': 'false',
+                     'destination_type': 'Ipv4Address', 'destination_excluded': 'false'}
+
+
+class DfwConfig(object):
+    """
+    The distributed firewall configuration read with a single dfwConfig call, with its sections indexed by id and name
+    and its rules indexed by id and name. An instance can be passed to the dfw functions, so that a batch of
+    operations is served by one read of the configuration
+    """
+    def __init__(self, client_session, firewall_configuration=None):
+        """
+        :param client_session: An instance of an NsxClient Session
+        :param firewall_configuration: (Optional) The firewallConfiguration dictionary as returned by the dfwConfig
+                                       read, it is read from NSX Manager if not specified
+        """
+        self._client_session = client_session
+        if firewall_configuration is None:
+            self.refresh()
+        else:
+            self._index(firewall_configuration)
+
+    def refresh(self):
+        """
+        This method reads the configuration again from NSX Manager
+        """
+        self._index(self._client_session.read('dfwConfig')['body']['firewallConfiguration'])
+
+    def mark_stale(self):
+        """
+        This method needs to be called after sections or rules have been created or deleted, the configuration is
+        then read again the next time it is used
+        """
+        self._stale = True
+
+    def _index(self, firewall_configuration):
+        for rule_type, sections_key, section_resource, section_parameter in DFW_SECTION_RESOURCES:
+            firewall_configuration.setdefault(sections_key, None)
+        self.firewall_configuration = firewall_configuration
+        self._stale = False
+        self._sections = dict()
+        self._sections_by_name = dict()
+        self._rules = dict()
+        self._rules_by_name = dict()
+        self._section_list = None
+        self._rule_list = None
+        self._rule_rows = None
+        self._section_etags = dict()
+
+        # Same order as the former linear scans: L3, L3 redirect, L2
+        for sections_key in ['layer3Sections', 'layer3RedirectSections', 'layer2Sections']:
+            if str(firewall_configuration.get(sections_key)) == 'None':
+                continue
+            for section in self._client_session.normalize_list_return(firewall_configuration[sections_key]['section']):
+                section_id = str(section['@id'])
+                self._sections[section_id] = section
+                self._sections_by_name.setdefault(section.get('@name', '<empty name>'), []).append(section_id)
+                for rule in self._client_session.normalize_list_return(section.get('rule')):
+                    rule_id = str(rule['@id'])
+                    self._rules[rule_id] = (section_id, rule)
+                    self._rules_by_name.setdefault((section_id, rule.get('name', '')), []).append(rule_id)
+
+    def _fresh(self):
+        if self._stale:
+            self.refresh()
+        return self
+
+    def section_list(self):
+        """
+        :return: The same as dfw_section_list
+        """
+        if self._fresh()._section_list is None:
+            self._section_list = _dfw_section_list(self.firewall_configuration)
+        return self._section_list
+
+    def rule_list(self):
+        """
+        :return: The same as dfw_rule_list
+        """
+        if self._fresh()._rule_list is None:
+            self._rule_list = _dfw_rule_list(self._client_session, self.firewall_configuration)
+        return self._rule_list
+
+    def section(self, section_id):
+        """
+        :param section_id: The id of a section
+        :return: The dictionary of the section as returned by NSX, or None if there is no such section
+        """
+        return self._fresh()._sections.get(str(section_id))
+
+    def section_type(self, section_id):
+        """
+        :param section_id: The id of a section
+        :return: The type of the section (LAYER2, LAYER3 or L3REDIRECT), or None if there is no such section
+        """
+        section = self.section(section_id)
+        return str(section['@type']) if section else None
+
+    def section_etag(self, section_id):
+        """
+        :param section_id: The id of a section
+        :return: The Etag of the section if it was read on its own and not changed since, otherwise None
+        """
+        return self._fresh()._section_etags.get(str(section_id))
+
+    def set_section_etag(self, section_id, etag):
+        """
+        This method keeps the Etag of a section read on its own, so that an If-match request on the section does not
+        need to read it again. The Etags are dropped when the configuration changes
+        :param section_id: The id of the section
+        :param etag: The Etag returned with the section
+        """
+        self._section_etags[str(section_id)] = str(etag)
+
+    def section_ids(self, section_name):
+        """
+        :param section_name: The name ( case sensitive ) of the sections
+        :return: A list of the ids of all sections with this name
+        """
+        return list(self._fresh()._sections_by_name.get(str(section_name), []))
+
+    def rule(self, rule_id):
+        """
+        :param rule_id: The id of a rule
+        :return: The dictionary of the rule as returned by NSX, or None if there is no such rule
+        """
+        rule_entry = self._fresh()._rules.get(str(rule_id))
+        return rule_entry[1] if rule_entry else None
+
+    def rule_section_id(self, rule_id):
+        """
+        :param rule_id: The id of a rule
+        :return: The id of the section of the rule, or None if there is no such rule
+        """
+        rule_entry = self._fresh()._rules.get(str(rule_id))
+        return rule_entry[0] if rule_entry else None
+
+    def rule_ids(self, section_id, rule_name):
+        """
+        :param section_id: The id of the section where the rules are searched
+        :param rule_name: The name ( case sensitive ) of the rules
+        :return: A list of the ids of the rules with this name in the section
+        """
+        return list(self._fresh()._rules_by_name.get((str(section_id), str(rule_name)), []))
+
+    def rule_row(self, rule_id):
+        """
+        :param rule_id: The id of a rule
+        :return: The rule as a DfwRule like the ones returned by dfw_rule_list, or None if there is no such rule
+        """
+        if self._fresh()._rule_rows is None:
+            rule_rows = dict()
+            for rule_list in self.rule_list():
+                for row in rule_list:
+                    rule_rows.setdefault(str(row[0]), row)
+            self._rule_rows = rule_rows
+        return self._rule_rows.get(str(rule_id))
+
+    def update_rule(self, section_id, rule):
+        """
+        This method replaces a rule with its updated version, without reading the configuration again
+        :param section_id: The id of the section of the rule
+        :param rule: The dictionary of the updated rule
+        """
+        self._replace_rule(section_id, str(rule['@id']), rule)
+
+    def remove_rule(self, rule_id):
+        """
+        This method removes a deleted rule, without reading the configuration again
+        :param rule_id: The id of the deleted rule
+        """
+        section_id = self.rule_section_id(rule_id)
+        if section_id:
+            self._replace_rule(section_id, str(rule_id), None)
+
+    def _replace_rule(self, section_id, rule_id, new_rule):
+        section = self.section(section_id)
+        if section is None:
+            return
+        if new_rule is not None and 'sectionId' not in new_rule:
+            new_rule['sectionId'] = str(section_id)
+        rules = [rule for rule in self._client_session.normalize_list_return(section.get('rule'))]
+        for i, rule in enumerate(rules):
+            if str(rule['@id']) == rule_id:
+                if new_rule is None:
+                    del rules[i]
+                else:
+                    rules[i] = new_rule
+                break
+        section['rule'] = rules
+        self._index(self.firewall_configuration)
+
+
+def dfw_rule_config(client_session, rule_id, section_id=None):
+    """
+    This function returns a DfwConfig with just what is needed to work on one rule, instead of the whole firewall
+    configuration. If the section id of the rule is known only this section is read, otherwise NSX Manager is asked
+    for the rule id, one rule type after the other
+    :param client_session: An instance of an NsxClient Session
+    :param rule_id: The id of the rule
+    :param section_id: (Optional) The id of the section of the rule
+    :return: A DfwConfig instance, not containing the rule if no rule with this id exists
+    """
+    rule_id = str(rule_id)
+
+    # a rule missing from a section or a rule type is answered with an error status, which must not exit
+    if section_id:
+        for rule_type, sections_key, section_resource, section_parameter in DFW_SECTION_RESOURCES:
+            section = call_with_status(client_session.read, section_resource,
+                                       uri_parameters={section_parameter: str(section_id)})
+            if section['status'] == 200 and section['body'] and 'section' in section['body']:
+                dfw_config = DfwConfig(client_session, {sections_key: {'section': section['body']['section']}})
+                if section['Etag']:
+                    dfw_config.set_section_etag(section_id, section['Etag'])
+                if dfw_config.rule(rule_id):
+                    return dfw_config
+                # a wrong hint falls back to the lookup by rule id
+                break
+
+    for rule_type, sections_key, section_resource, section_parameter in DFW_SECTION_RESOURCES:
+        response = call_with_status(client_session.read, 'dfwConfig',
+                                    query_parameters_dict={'ruleType': rule_type, 'ruleId': rule_id})
+        if response['status'] == 200 and response['body']:
+            dfw_config = DfwConfig(client_session, response['body']['firewallConfiguration'])
+            if dfw_config.rule(rule_id):
+                return dfw_config
+
+    return DfwConfig(client_session, dict())
+
+
+def dfw_config_stream(client_session, query_parameters_dict=None):
+    """
+    This function reads the distributed firewall configuration and yields its sections and rules one at a time while
+    the response is received and parsed, so that neither the whole configuration nor its rows are held in memory
+    :param client_session: An instance of an NsxClient Session
+    :param query_parameters_dict: (Optional) The dfwConfig query parameters, e.g. {'ruleType': 'LAYER3'}
+    :return: A generator of tuples, each containing the record kind ('section' or 'rule'), the rule type of the
+             section ('LAYER3', 'LAYER2' or 'L3REDIRECT') and a dictionary. For a section the dictionary holds the
+             section attributes ('@id', '@name', '@type', ...), for a rule it is the rule as returned by NSX Manager.
+             A section is yielded before its rules
+    """
+    rule_types = dict((sections_key, rule_type) for rule_type, sections_key, section_resource, section_parameter
+                      in DFW_SECTION_RESOURCES)
+
+    response = stream_resource(client_session, 'dfwConfig', query_parameters_dict=query_parameters_dict)
+    if response is None:
+        return
+
+    try:
+        rule_type = None
+        section_id = None
+        for event, element in etree.iterparse(response.raw, events=('start', 'end')):
+            if event == 'start':
+                if element.tag in rule_types:
+                    rule_type = rule_types[element.tag]
+                elif element.tag == 'section' and rule_type:
+                    section_id = element.get('id')
+                    yield 'section', rule_type, dict(('@' + key, value) for key, value in element.attrib.items())
+            elif element.tag == 'rule' and rule_type:
+                rule = xml_to_dict(element)['rule']
+                rule.setdefault('sectionId', section_id)
+                yield 'rule', rule_type, rule
+                # drop the parsed rule and the ones before it, only the current element is kept in memory
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif element.tag == 'section' and rule_type:
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif element.tag in rule_types:
+                rule_type = None
+    finally:
+        response.close()
+
+
+def dfw_rule_rows_stream(client_session, query_parameters_dict=None):
+    """
+    This function yields the rows of dfw_rule_list one at a time while the firewall configuration is parsed
+    :param client_session: An instance of an NsxClient Session
+    :param query_parameters_dict: (Optional) The dfwConfig query parameters, e.g. {'ruleType': 'LAYER3'}
+    :return: A generator of tuples, each containing the rule type ('LAYER3', 'LAYER2' or 'L3REDIRECT') and the rule
+             row with the fields "ID", "Name", "Source", "Destination", "Service", "Action", "Direction",
+             "Packet Type", "Applied-To", "ID (Section)"
+    """
+    for kind, rule_type, record in dfw_config_stream(client_session, query_parameters_dict):
+        if kind == 'rule':
+            yield rule_type, dfw_rule_list_helper(client_session, [record], [])[0]
+
+
+def _dfw_rule_resource(rule_type_selector):
+    if rule_type_selector == 'LAYER2':
+        return 'dfwL2Rule'
+    elif rule_type_selector == 'LAYER3':
+        return 'dfwL3Rule'
+    else:
+        return 'rule'
+
+
+def dfw_section_list(client_session, dfw_config=None):
     """
     This function returns all the sections of the NSX distributed firewall
     :param client_session: An instance of an NsxClient Session
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
     :return returns
             - for each of the three available sections types (L2, L3Redirect, L3) a list with item 0 containing the
               section name as string, item 1 containing the section id as string, item 2 containing the section type
               as a string
             - a dictionary containing all sections' details, including dfw rules
     """
-    all_dfw_sections = client_session.read('dfwConfig')['body']['firewallConfiguration']
+    if dfw_config is None:
+        dfw_config = DfwConfig(client_session)
+    return dfw_config.section_list()
 
+
+def _dfw_section_list(all_dfw_sections):
     if str(all_dfw_sections['layer2Sections']) != 'None':
         l2_dfw_sections = all_dfw_sections['layer2Sections']['section']
     else:
@@ -112,20 +438,30 @@ def dfw_section_list(client_session):
 
 
 def _dfw_section_list_print(client_session, **kwargs):
-    l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
     if kwargs['verbose']:
+        l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
         print detailed_dfw_sections
     else:
+        # the rules are not printed, so only the section attributes are kept while the configuration is parsed
+        section_lists = {'LAYER2': list(), 'LAYER3': list(), 'L3REDIRECT': list()}
+        for kind, rule_type, record in dfw_config_stream(client_session):
+            if kind == 'section':
+                section_lists[rule_type].append((record.get('@name', '<empty name>'), record['@id'],
+                                                 record.get('@type')))
+        l2_section_list = section_lists['LAYER2'] or [['---', '---', '---']]
+        l3r_section_list = section_lists['L3REDIRECT'] or [['---', '---', '---']]
+        l3_section_list = section_lists['LAYER3'] or [['---', '---', '---']]
         print tabulate(l2_section_list, headers=["Name", "ID", "Type"], tablefmt="psql")
         print tabulate(l3r_section_list, headers=["Name", "ID", "Type"], tablefmt="psql")
         print tabulate(l3_section_list, headers=["Name", "ID", "Type"], tablefmt="psql")
 
 
-def dfw_section_delete(client_session, section_id):
+def dfw_section_delete(client_session, section_id, dfw_config=None):
     """
     This function delete a section given its id
     :param client_session: An instance of an NsxClient Session
     :param section_id: The id of the section that must be deleted
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
     :return returns
             - A table containing these information: Return Code (True/False), Section ID, Section Name, Section Type
             - ( verbose option ) A list containing a single list which elements are Return Code (True/False),
@@ -137,13 +473,17 @@ def dfw_section_delete(client_session, section_id):
                 - Section Name is set to "---"
                 - Section Type is set to "---"
     """
-    l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
+    if dfw_config is None:
+        dfw_config = DfwConfig(client_session)
+    l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session,
+                                                                                                dfw_config)
 
     dfw_section_id = str(section_id)
 
     for i, val in enumerate(l3_section_list):
         if dfw_section_id == str(val[1]) and str(val[0]) != 'Default Section Layer3':
             client_session.delete('dfwL3SectionId', uri_parameters={'sectionId': dfw_section_id})
+            dfw_config.mark_stale()
             result = [["True", dfw_section_id, str(val[0]), str(val[-1])]]
             return result
         if dfw_section_id == str(val[1]) and str(val[0]) == 'Default Section Layer3':
@@ -153,6 +493,7 @@ def dfw_section_delete(client_session, section_id):
     for i, val in enumerate(l2_section_list):
         if dfw_section_id == str(val[1]) and str(val[0]) != 'Default Section Layer2':
             client_session.delete('dfwL2SectionId', uri_parameters={'sectionId': dfw_section_id})
+            dfw_config.mark_stale()
             result = [["True", dfw_section_id, str(val[0]), str(val[-1])]]
             return result
         if dfw_section_id == str(val[1]) and str(val[0]) == 'Default Section Layer2':
@@ -162,6 +503,7 @@ def dfw_section_delete(client_session, section_id):
     for i, val in enumerate(l3r_section_list):
         if dfw_section_id == str(val[1]) and str(val[0]) != 'Default Section':
             client_session.delete('section', uri_parameters={'section': dfw_section_id})
+            dfw_config.mark_stale()
             result = [["True", dfw_section_id, str(val[0]), str(val[-1])]]
             return result
         if dfw_section_id == str(val[1]) and str(val[0]) == 'Default Section':
@@ -185,11 +527,14 @@ def _dfw_section_delete_print(client_session, **kwargs):
         print tabulate(result, headers=["Return Code", "Section ID", "Section Name", "Section Type"], tablefmt="psql")
 
 
-def dfw_rule_delete(client_session, rule_id):
+def dfw_rule_delete(client_session, rule_id, dfw_config=None, section_id=None):
     """
     This function delete a dfw rule given its id
     :param client_session: An instance of an NsxClient Session
     :param rule_id: The id of the rule that must be deleted
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
+    :param section_id: (Optional) The id of the section of the rule, only this section is read if the DfwConfig is
+                       not specified
     :return returns
             - A table containing these information: Return Code (True/False), Rule ID, Rule Name, Applied-To, Section ID
             - ( verbose option ) A list containing a single list which elements are Return Code (True/False),
@@ -200,48 +545,37 @@ def dfw_rule_delete(client_session, rule_id):
                 - Rule ID is set to the value passed as input parameter
                 - All other returned parameters are set to "---"
     """
-    l2_rule_list, l3_rule_list, l3r_rule_list = dfw_rule_list(client_session)
+    if dfw_config is None:
+        dfw_config = dfw_rule_config(client_session, rule_id, section_id)
     dfw_rule_id = str(rule_id)
 
-    for i, val in enumerate(l3_rule_list):
-        if dfw_rule_id == str(val[0]) and str(val[1]) != 'Default Rule':
-            dfw_section_id = str(val[-1])
-            section_list, dfwL3_section_details = dfw_section_read(client_session, dfw_section_id)
-            etag = str(section_list[0][3])
-            client_session.delete('dfwL3Rule', uri_parameters={'ruleId': dfw_rule_id, 'sectionId': dfw_section_id},
-                                  additional_headers={'If-match': etag})
-            result = [["True", dfw_rule_id, str(val[1]), str(val[-2]), str(val[-1])]]
-            return result
-        else:
-            result = [["False-Delete Default Rule is not allowed", dfw_rule_id, "---", "---", "---"]]
-            return result
-
-    for i, val in enumerate(l2_rule_list):
-        if dfw_rule_id == str(val[0]) and str(val[1]) != 'Default Rule':
-            dfw_section_id = str(val[-1])
-            section_list, dfwL2_section_details = dfw_section_read(client_session, dfw_section_id)
-            etag = str(section_list[0][3])
-            client_session.delete('dfwL2Rule', uri_parameters={'ruleId': dfw_rule_id, 'sectionId': dfw_section_id},
-                                  additional_headers={'If-match': etag})
-            result = [["True", dfw_rule_id, str(val[1]), str(val[-2]), str(val[-1])]]
-            return result
-        else:
-            result = [["False-Delete Default Rule is not allowed", dfw_rule_id, "---", "---", "---"]]
-            return result
+    val = dfw_config.rule_row(dfw_rule_id)
+    if not val:
+        result = [["False", dfw_rule_id, "---", "---", "---"]]
+        return result
+    if str(val[1]) == 'Default Rule':
+        result = [["False-Delete Default Rule is not allowed", dfw_rule_id, "---", "---", "---"]]
+        return result
 
-    for i, val in enumerate(l3r_rule_list):
-        if dfw_rule_id == str(val[0]) and str(val[1]) != 'Default Rule':
-            dfw_section_id = str(val[-1])
-            section_list, dfwL3r_section_details = dfw_section_read(client_session, dfw_section_id)
-            etag = str(section_list[0][3])
-            client_session.delete('rule', uri_parameters={'ruleID': dfw_rule_id, 'section': dfw_section_id})
-            result = [["True", dfw_rule_id, str(val[1]), str(val[-2]), str(val[-1])]]
-            return result
+    dfw_section_id = str(val[-1])
+    rule_type_selector = dfw_config.section_type(dfw_section_id)
+    if rule_type_selector == 'LAYER3' or rule_type_selector == 'LAYER2':
+        if rule_type_selector == 'LAYER3':
+            section_type = 'dfwL3SectionId'
         else:
-            result = [["False-Delete Default Rule is not allowed", dfw_rule_id, "---", "---", "---"]]
-            return result
+            section_type = 'dfwL2SectionId'
+        etag = dfw_config.section_etag(dfw_section_id)
+        if etag is None:
+            # the section comes with its Etag only when it was read on its own, e.g. with the section id hint
+            etag = str(client_session.read(section_type, uri_parameters={'sectionId': dfw_section_id})['Etag'])
+        client_session.delete(_dfw_rule_resource(rule_type_selector),
+                              uri_parameters={'ruleId': dfw_rule_id, 'sectionId': dfw_section_id},
+                              additional_headers={'If-match': etag})
+    else:
+        client_session.delete('rule', uri_parameters={'ruleID': dfw_rule_id, 'section': dfw_section_id})
+    dfw_config.remove_rule(dfw_rule_id)
 
-    result = [["False", dfw_rule_id, "---", "---", "---"]]
+    result = [["True", dfw_rule_id, str(val[1]), str(val[-2]), str(val[-1])]]
     return result
 
 
@@ -250,7 +584,7 @@ def _dfw_rule_delete_print(client_session, **kwargs):
         print ('Mandatory parameters missing: [-rid RULE ID]')
         return None
     rule_id = kwargs['dfw_rule_id']
-    result = dfw_rule_delete(client_session, rule_id)
+    result = dfw_rule_delete(client_session, rule_id, section_id=kwargs['dfw_section_id'])
 
     if kwargs['verbose']:
         print result
@@ -259,31 +593,22 @@ def _dfw_rule_delete_print(client_session, **kwargs):
                        tablefmt="psql")
 
 
-def dfw_section_id_read(client_session, dfw_section_name):
+def dfw_section_id_read(client_session, dfw_section_name, dfw_config=None):
     """
     This function returns the section(s) ID(s) given a section name
     :param client_session: An instance of an NsxClient Session
     :param dfw_section_name: The name ( case sensitive ) of the section for which the ID is wanted
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
     :return returns
             - A list of dictionaries. Each dictionary contains the type and the id of each section with named as
               specified by the input parameter. If no such section exist, the list contain a single dictionary with
               {'Type': 0, 'Id': 0}
     """
-    l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
-    dfw_section_id = list()
-    dfw_section_name = str(dfw_section_name)
+    if dfw_config is None:
+        dfw_config = DfwConfig(client_session)
 
-    for i, val in enumerate(l3_section_list):
-        if str(val[0]) == dfw_section_name:
-            dfw_section_id.append({'Type': str(val[2]), 'Id': int(val[1])})
-
-    for i, val in enumerate(l3r_section_list):
-        if str(val[0]) == dfw_section_name:
-            dfw_section_id.append({'Type': str(val[2]), 'Id': int(val[1])})
-
-    for i, val in enumerate(l2_section_list):
-        if str(val[0]) == dfw_section_name:
-            dfw_section_id.append({'Type': str(val[2]), 'Id': int(val[1])})
+    dfw_section_id = [{'Type': dfw_config.section_type(section_id), 'Id': int(section_id)}
+                      for section_id in dfw_config.section_ids(dfw_section_name)]
 
     if len(dfw_section_id) == 0:
         dfw_section_id.append({'Type': 0, 'Id': 0})
@@ -304,43 +629,28 @@ def _dfw_section_id_read_print(client_session, **kwargs):
         dfw_section_id_csv = ",".join([str(section['Id']) for section in dfw_section_id])
         print dfw_section_id_csv
 
-def dfw_rule_id_read(client_session, dfw_section_id, dfw_rule_name):
+def dfw_rule_id_read(client_session, dfw_section_id, dfw_rule_name, dfw_config=None):
     """
     This function returns the rule(s) ID(s) given a section id and a rule name
     :param client_session: An instance of an NsxClient Session
     :param dfw_rule_name: The name ( case sensitive ) of the rule for which the ID is/are wanted. If rhe name includes
                       includes spaces, enclose it between ""
     :param dfw_section_id: The id of the section where the rule must be searched
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
     :return returns
             - A dictionary with the rule name as the key and a list as a value. The list contains all the matching
               rules id(s). For example {'RULE_ONE': [1013, 1012]}. If no matching rule exist, an empty dictionary is
               returned
     """
+    if dfw_config is None:
+        dfw_config = DfwConfig(client_session)
 
-    l2_rule_list, l3_rule_list, l3r_rule_list = dfw_rule_list(client_session)
-
-    list_names = list()
-    list_ids = list()
     dfw_rule_name = str(dfw_rule_name)
-    dfw_section_id = str(dfw_section_id)
-
-    for i, val in enumerate(l2_rule_list):
-        if (dfw_rule_name == val[1]) and (dfw_section_id == val[-1]):
-            list_names.append(dfw_rule_name)
-            list_ids.append(int(val[0]))
-
-    for i, val in enumerate(l3_rule_list):
-        if (dfw_rule_name == val[1]) and (dfw_section_id == val[-1]):
-            list_names.append(dfw_rule_name)
-            list_ids.append(int(val[0]))
-
-    for i, val in enumerate(l3r_rule_list):
-        if (dfw_rule_name == val[1]) and (dfw_section_id == val[-1]):
-            list_names.append(dfw_rule_name)
-            list_ids.append(int(val[0]))
+    list_ids = [int(rule_id) for rule_id in dfw_config.rule_ids(dfw_section_id, dfw_rule_name)]
 
-    dfw_rule_id = dict.fromkeys(list_names, list_ids)
-    return dfw_rule_id
+    if len(list_ids) == 0:
+        return dict()
+    return {dfw_rule_name: list_ids}
 
 
 def _dfw_rule_id_read_print(client_session, **kwargs):
@@ -367,10 +677,11 @@ def _dfw_rule_id_read_print(client_session, **kwargs):
             print 'Rule name {} not found in section Id {}'.format(kwargs['dfw_rule_name'], kwargs['dfw_section_id'])
 
 
-def dfw_rule_list(client_session):
+def dfw_rule_list(client_session, dfw_config=None):
     """
     This function returns all the rules of the NSX distributed firewall
     :param client_session: An instance of an NsxClient Session
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
     :return returns
             - a tabular view of all the  dfw rules defined across L2, L3, L3Redirect
             - ( verbose option ) a list containing as many list as the number of dfw rules defined across
@@ -378,8 +689,17 @@ def dfw_rule_list(client_session):
               "ID", "Name", "Source", "Destination", "Service", "Action", "Direction", "Packet Type", "Applied-To",
               "ID (Section)"
     """
-    all_dfw_sections_response = client_session.read('dfwConfig')
-    all_dfw_sections = client_session.normalize_list_return(all_dfw_sections_response['body']['firewallConfiguration'])
+    if dfw_config is not None:
+        return dfw_config.rule_list()
+
+    rule_lists = {'LAYER2': list(), 'LAYER3': list(), 'L3REDIRECT': list()}
+    for rule_type, rule_row in dfw_rule_rows_stream(client_session):
+        rule_lists[rule_type].append(rule_row)
+    return rule_lists['LAYER2'], rule_lists['LAYER3'], rule_lists['L3REDIRECT']
+
+
+def _dfw_rule_list(client_session, firewall_configuration):
+    all_dfw_sections = client_session.normalize_list_return(firewall_configuration)
 
     if str(all_dfw_sections[0]['layer3Sections']) != 'None':
         l3_dfw_sections = all_dfw_sections[0]['layer3Sections']['section']
@@ -463,6 +783,15 @@ def dfw_rule_list(client_session):
 
 
 def _dfw_rule_list_print(client_session, **kwargs):
+    if kwargs['dfw_stream']:
+        rule_writer = csv.writer(sys.stdout)
+        rule_writer.writerow(["Type", "ID", "Name", "Source", "Destination", "Service", "Action", "Direction",
+                              "Packet Type", "Applied-To", "ID (Section)"])
+        for rule_type, rule_row in dfw_rule_rows_stream(client_session):
+            rule_writer.writerow([rule_type] + [unicode(value).encode('utf-8') for value in rule_row])
+            sys.stdout.flush()
+        return
+
     l2_rule_list, l3_rule_list, l3r_rule_list = dfw_rule_list(client_session)
     if kwargs['verbose']:
         print l2_rule_list, l3_rule_list, l3r_rule_list
@@ -482,24 +811,26 @@ def _dfw_rule_list_print(client_session, **kwargs):
                                                "Packet Type", "Applied-To", "ID (Section)"], tablefmt="psql")
 
 
-def dfw_rule_read(client_session, rule_id):
+def dfw_rule_read(client_session, rule_id, dfw_config=None, section_id=None):
     """
     This function retrieves details of a dfw rule given its id
     :param client_session: An instance of an NsxClient Session
     :param rule_id: The ID of the dfw rule to retrieve
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
+    :param section_id: (Optional) The id of the section of the rule, only this section is read if the DfwConfig is
+                       not specified
     :return: returns
             - tabular view of the dfw rule
             - ( verbose option ) a list containing the dfw rule information: ID(Rule)- Name(Rule)- Source- Destination-
               Services- Action - Direction- Pktytpe- AppliedTo- ID(section)
     """
-    rule_list = dfw_rule_list(client_session)
-    rule = list()
+    if dfw_config is None:
+        dfw_config = dfw_rule_config(client_session, rule_id, section_id)
 
-    for sectionptr in rule_list:
-        for ruleptr in sectionptr:
-            if ruleptr[0] == str(rule_id):
-                rule.append(ruleptr)
-    return rule
+    ruleptr = dfw_config.rule_row(rule_id)
+    if ruleptr:
+        return [ruleptr]
+    return list()
 
 
 def _dfw_rule_read_print(client_session, **kwargs):
@@ -507,7 +838,7 @@ def _dfw_rule_read_print(client_session, **kwargs):
         print ('Mandatory parameters missing: [-rid RULE ID]')
         return None
     rule_id = kwargs['dfw_rule_id']
-    rule = dfw_rule_read(client_session, rule_id)
+    rule = dfw_rule_read(client_session, rule_id, section_id=kwargs['dfw_section_id'])
     if kwargs['verbose']:
         print rule
     else:
@@ -515,12 +846,15 @@ def _dfw_rule_read_print(client_session, **kwargs):
                                       "Packet Type", "Applied-To", "ID (Section)"], tablefmt="psql")
 
 
-def dfw_rule_source_delete(client_session, rule_id, source):
+def dfw_rule_source_delete(client_session, rule_id, source, dfw_config=None, section_id=None):
     """
     This function delete one of the sources of a dfw rule given the rule id and the source to be deleted
     If two or more sources have the same name, the function will delete all of them
     :param client_session: An instance of an NsxClient Session
     :param rule_id: The ID of the dfw rule to retrieve
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
+    :param section_id: (Optional) The id of the section of the rule, only this section is read if the DfwConfig is
+                       not specified
     :param source: The source of the dfw rule to be deleted. If the source name contains any space, then it must be
                    enclosed in double quotes (like "VM Network")
     :return: returns
@@ -531,40 +865,29 @@ def dfw_rule_source_delete(client_session, rule_id, source):
     """
 
     source = str(source)
-    rule = dfw_rule_read(client_session, rule_id)
+    if dfw_config is None:
+        dfw_config = dfw_rule_config(client_session, rule_id, section_id)
+    rule = dfw_rule_read(client_session, rule_id, dfw_config)
 
     if len(rule) == 0:
         # It means a rule with id = rule_id does not exist
         result = [[rule_id, "---", source, "---", "---", "---", "---", "---", "---", "---"]]
         return result
 
+    if not rule[0].has_source(source):
+        # Nothing to delete, so the rule is neither read nor updated
+        return rule
+
     # Get the rule data structure that will be modified and then piped into the update function
-    section_list = dfw_section_list(client_session)
-    sections = [section_list[0], section_list[1], section_list[2]]
     section_id = rule[0][-1]
-
-    rule_type_selector = ''
-    for scan in sections:
-        for val in scan:
-            if val[1] == section_id:
-                rule_type_selector = val[2]
-
-    if rule_type_selector == '':
-        print 'ERROR: RULE TYPE SELECTOR CANNOT BE EMPTY - ABORT !'
-        return
-    if rule_type_selector == 'LAYER2':
-        rule_type = 'dfwL2Rule'
-    elif rule_type_selector == 'LAYER3':
-        rule_type = 'dfwL3Rule'
-    else:
-        rule_type = 'rule'
+    rule_type = _dfw_rule_resource(dfw_config.section_type(section_id))
 
     rule_schema = client_session.read(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id})
     rule_etag = rule_schema.items()[-1][1]
 
     if 'sources' not in rule_schema.items()[1][1]['rule']:
         # It means the only source is "any" and it cannot be deleted short of deleting the whole rule
-        rule = dfw_rule_read(client_session, rule_id)
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
     if type(rule_schema.items()[1][1]['rule']['sources']['source']) == list:
@@ -578,7 +901,8 @@ def dfw_rule_source_delete(client_session, rule_id, source):
         rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                      request_body_dict=rule_schema.items()[1][1],
                                      additional_headers={'If-match': rule_etag})
-        rule = dfw_rule_read(client_session, rule_id)
+        dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
     if type(rule_schema.items()[1][1]['rule']['sources']['source']) == dict:
@@ -590,8 +914,9 @@ def dfw_rule_source_delete(client_session, rule_id, source):
             rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                          request_body_dict=rule_schema.items()[1][1],
                                          additional_headers={'If-match': rule_etag})
+            dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
 
-        rule = dfw_rule_read(client_session, rule_id)
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
 
@@ -604,7 +929,7 @@ def _dfw_rule_source_delete_print(client_session, **kwargs):
         return None
     rule_id = kwargs['dfw_rule_id']
     source = kwargs['dfw_rule_source']
-    rule = dfw_rule_source_delete(client_session, rule_id, source)
+    rule = dfw_rule_source_delete(client_session, rule_id, source, section_id=kwargs['dfw_section_id'])
     if kwargs['verbose']:
         print rule
     else:
@@ -612,12 +937,15 @@ def _dfw_rule_source_delete_print(client_session, **kwargs):
                                       "Packet Type", "Applied-To", "ID (Section)"], tablefmt="psql")
 
 
-def dfw_rule_destination_delete(client_session, rule_id, destination):
+def dfw_rule_destination_delete(client_session, rule_id, destination, dfw_config=None, section_id=None):
     """
     This function delete one of the destinations of a dfw rule given the rule id and the destination to be deleted.
     If two or more destinations have the same name, the function will delete all of them
     :param client_session: An instance of an NsxClient Session
     :param rule_id: The ID of the dfw rule to retrieve
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
+    :param section_id: (Optional) The id of the section of the rule, only this section is read if the DfwConfig is
+                       not specified
     :param destination: The destination of the dfw rule to be deleted. If the destination name contains any space, then
                         it must be enclosed in double quotes (like "VM Network")
     :return: returns
@@ -628,40 +956,29 @@ def dfw_rule_destination_delete(client_session, rule_id, destination):
     """
 
     destination = str(destination)
-    rule = dfw_rule_read(client_session, rule_id)
+    if dfw_config is None:
+        dfw_config = dfw_rule_config(client_session, rule_id, section_id)
+    rule = dfw_rule_read(client_session, rule_id, dfw_config)
 
     if len(rule) == 0:
         # It means a rule with id = rule_id does not exist
         result = [[rule_id, "---", "---", destination, "---", "---", "---", "---", "---", "---"]]
         return result
 
+    if not rule[0].has_destination(destination):
+        # Nothing to delete, so the rule is neither read nor updated
+        return rule
+
     # Get the rule data structure that will be modified and then piped into the update function
-    section_list = dfw_section_list(client_session)
-    sections = [section_list[0], section_list[1], section_list[2]]
     section_id = rule[0][-1]
-
-    rule_type_selector = ''
-    for scan in sections:
-        for val in scan:
-            if val[1] == section_id:
-                rule_type_selector = val[2]
-
-    if rule_type_selector == '':
-        print 'ERROR: RULE TYPE SELECTOR CANNOT BE EMPTY - ABORT !'
-        return
-    if rule_type_selector == 'LAYER2':
-        rule_type = 'dfwL2Rule'
-    elif rule_type_selector == 'LAYER3':
-        rule_type = 'dfwL3Rule'
-    else:
-        rule_type = 'rule'
+    rule_type = _dfw_rule_resource(dfw_config.section_type(section_id))
 
     rule_schema = client_session.read(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id})
     rule_etag = rule_schema.items()[-1][1]
 
     if 'destinations' not in rule_schema.items()[1][1]['rule']:
         # It means the only destination is "any" and it cannot be deleted short of deleting the whole rule
-        rule = dfw_rule_read(client_session, rule_id)
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
     if type(rule_schema.items()[1][1]['rule']['destinations']['destination']) == list:
@@ -676,7 +993,8 @@ def dfw_rule_destination_delete(client_session, rule_id, destination):
         rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                      request_body_dict=rule_schema.items()[1][1],
                                      additional_headers={'If-match': rule_etag})
-        rule = dfw_rule_read(client_session, rule_id)
+        dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
     if type(rule_schema.items()[1][1]['rule']['destinations']['destination']) == dict:
@@ -689,8 +1007,9 @@ def dfw_rule_destination_delete(client_session, rule_id, destination):
             rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                          request_body_dict=rule_schema.items()[1][1],
                                          additional_headers={'If-match': rule_etag})
+            dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
 
-        rule = dfw_rule_read(client_session, rule_id)
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
 
@@ -703,7 +1022,7 @@ def _dfw_rule_destination_delete_print(client_session, **kwargs):
         return None
     rule_id = kwargs['dfw_rule_id']
     destination = kwargs['dfw_rule_destination']
-    rule = dfw_rule_destination_delete(client_session, rule_id, destination)
+    rule = dfw_rule_destination_delete(client_session, rule_id, destination, section_id=kwargs['dfw_section_id'])
     if kwargs['verbose']:
         print rule
     else:
@@ -721,7 +1040,8 @@ def dfw_rule_create(client_session, section_id, rule_name, rule_source_value, ru
                     rule_source_type='Ipv4Address', rule_destination_type='Ipv4Address', rule_source_excluded='false',
                     rule_destination_excluded='false', rule_logged='false', rule_source_name=None,
                     rule_destination_name=None, rule_service_protocolname=None, rule_service_destport=None,
-                    rule_service_srcport=None, rule_service_name=None, rule_note=None, rule_tag=None, vccontent=None):
+                    rule_service_srcport=None, rule_service_name=None, rule_note=None, rule_tag=None, vccontent=None,
+                    dfw_config=None):
 
     if rule_applyto == 'any':
         rule_applyto = 'ANY'
@@ -759,25 +1079,14 @@ def dfw_rule_create(client_session, section_id, rule_name, rule_source_value, ru
 
     # TODO: complete the description
 
-    API_TYPES = {'dc': 'Datacenter', 'ipset': 'IPSet', 'macset': 'MACSet', 'ls': 'VirtualWire',
-                 'secgroup': 'SecurityGroup', 'host': 'HostSystem', 'vm':'VirtualMachine',
-                 'cluster': 'ClusterComputeResource', 'dportgroup': 'DistributedVirtualPortgroup',
-                 'portgroup': 'Network', 'respool': 'ResourcePool', 'vapp': 'ResourcePool', 'vnic': 'VirtualMachine',
-                 'Ipv4Address': 'Ipv4Address'}
-
     # Verify that in the target section a rule with the same name does not exist
     # Find the rule type from the target section
 
-    l2_rule_list, l3_rule_list, l3r_rule_list = dfw_rule_list(client_session)
-
-    section_list = dfw_section_list(client_session)
-    sections = [section_list[0], section_list[1], section_list[2]]
+    if dfw_config is None:
+        dfw_config = DfwConfig(client_session)
+    l2_rule_list, l3_rule_list, l3r_rule_list = dfw_rule_list(client_session, dfw_config)
 
-    rule_type_selector = ''
-    for scan in sections:
-        for val in scan:
-            if val[1] == section_id:
-                rule_type_selector = val[2]
+    rule_type_selector = dfw_config.section_type(section_id) or ''
 
     if rule_type_selector == '':
         print 'Error: cannot find a section matching the section-id specified. Aborting. No action have been performed ' \
@@ -941,6 +1250,7 @@ def dfw_rule_create(client_session, section_id, rule_name, rule_source_value, ru
     try:
         rule = client_session.create(rule_type, uri_parameters={'sectionId': section_id}, request_body_dict=rule_schema,
                                  additional_headers={'If-match': section_etag})
+        dfw_config.mark_stale()
 
         return rule
 
@@ -1174,12 +1484,522 @@ def _dfw_rule_create_print(client_session, vccontent, **kwargs):
         print tabulate(l3_rule_list, headers=["ID", "Name", "Source", "Destination", "Service", "Action", "Direction",
                                               "Packet Type", "Applied-To", "ID (Section)"], tablefmt="psql")
 
-def dfw_rule_service_delete(client_session, rule_id, service):
+
+def _dfw_service_index(client_session):
+    index = dict()
+    servicegroups = client_session.read('serviceGroups', uri_parameters={'scopeId': 'globalroot-0'})
+    servicegrouplist = client_session.normalize_list_return(servicegroups.items()[1][1]['list']['applicationGroup'])
+    for servicegroupdict in servicegrouplist:
+        index[str(servicegroupdict['name'])] = str(servicegroupdict['objectId'])
+    # services take precedence over service groups with the same name, like in dfw_rule_create
+    services = client_session.read('servicesScope', uri_parameters={'scopeId': 'globalroot-0'})
+    for servicedict in client_session.normalize_list_return(services.items()[1][1]['list']['application']):
+        index[str(servicedict['name'])] = str(servicedict['objectId'])
+    return index
+
+
+def _dfw_bulk_rule(rule_template, rule, rule_type_selector, resolve_name, resolve_service):
+    # returns the rule dictionary for the section body and None, or None and an error message
+    rule_values = dict(DFW_RULE_DEFAULTS)
+    for key, value in rule.items():
+        if isinstance(value, bool):
+            rule_values[key] = str(value).lower()
+        elif value is not None:
+            try:
+                rule_values[key] = api_text(value if isinstance(value, basestring) else str(value))
+            except ValueError as e:
+                return None, 'Rule field {}: {}'.format(key, e)
+
+    rule_name = rule_values.get('name')
+    if not rule_name:
+        return None, 'A rule without name was found'
+
+    rule_action = rule_values['action']
+    rule_direction = rule_values['direction']
+    rule_pktype = rule_values['pktype']
+    rule_applyto = APPLYTO_VALUES.get(rule_values['applyto'], rule_values['applyto'])
+
+    if rule_direction not in ['inout', 'in', 'out'] or rule_pktype not in ['any', 'ipv4', 'ipv6']:
+        return None, 'Rule {}: allowed values are inout/in/out for direction and any/ipv6/ipv4 for pktype'.format(
+            rule_name)
+    if rule_applyto == 'ALL_EDGES' and (rule_direction != 'inout' or rule_pktype != 'any'):
+        return None, 'Rule {}: a rule applied to all edge gateways needs direction inout and pktype any'.format(
+            rule_name)
+
+    if rule_type_selector == 'LAYER2':
+        if rule_pktype != 'any':
+            return None, 'Rule {}: for a L2 rule "any" is the only allowed value for pktype'.format(rule_name)
+        if rule_action not in ['allow', 'block']:
+            return None, 'Rule {}: for a L2 rule "allow/block" are the only allowed values for action'.format(rule_name)
+        if rule_applyto in ['ANY', 'ALL_EDGES']:
+            return None, 'Rule {}: for a L2 rule "any" and "edgegw" are not allowed values for applyto'.format(
+                rule_name)
+        if 'ipset' in [rule_values['source_type'], rule_values['destination_type']]:
+            return None, 'Rule {}: for a L2 rule "ipset" is not allowed as source or destination type'.format(
+                rule_name)
+    elif rule_action not in ['allow', 'block', 'reject']:
+        return None, 'Rule {}: for a L3 rule allowed values for action are allow/block/reject'.format(rule_name)
+
+    # where the GUI shows "block" the API needs "deny"
+    if rule_action == 'block':
+        rule_action = 'deny'
+
+    rule_body = copy.deepcopy(rule_template)
+    rule_body['name'] = rule_name
+    rule_body['direction'] = rule_direction
+    rule_body['packetType'] = rule_pktype
+    rule_body['@disabled'] = rule_values['disabled']
+    rule_body['action'] = rule_action
+    rule_body['appliedToList']['appliedTo']['value'] = rule_applyto
+    rule_body['notes'] = rule_values.get('note', '')
+    # If appliedTo is 'ALL_EDGES' no tags are allowed
+    rule_body['tag'] = rule_values.get('tag', '') if rule_applyto != 'ALL_EDGES' else ''
+    rule_body['@logged'] = rule_values['logged']
+
+    for end, ends in [('source', 'sources'), ('destination', 'destinations')]:
+        end_type = rule_values['{}_type'.format(end)]
+        end_value = rule_values.get('{}_value'.format(end), '')
+        end_name = rule_values.get('{}_name'.format(end), '')
+        if end_type not in API_TYPES:
+            return None, 'Rule {}: unknown {} type {}'.format(rule_name, end, end_type)
+        if end_value == 'any' or (end_value == '' and end_name == ''):
+            del rule_body[ends]
+            continue
+        if end_value == '':
+            if end_type == 'Ipv4Address':
+                return None, 'Rule {}: an Ipv4Address {} needs a value instead of a name'.format(rule_name, end)
+            end_value = resolve_name(end_type, end_name)
+            if not end_value:
+                return None, 'Rule {}: matching {} object id not found for {} {}'.format(rule_name, end, end_type,
+                                                                                        end_name)
+        rule_body[ends][end]['value'] = end_value
+        rule_body[ends][end]['type'] = API_TYPES[end_type]
+        rule_body[ends]['@excluded'] = rule_values['{}_excluded'.format(end)]
+
+    service_protocolname = rule_values.get('service_protocolname', '')
+    service_destport = rule_values.get('service_destport', '')
+    service_srcport = rule_values.get('service_srcport', '')
+    service_name = rule_values.get('service_name', '')
+    if service_protocolname == '' and service_destport != '':
+        return None, 'Rule {}: a protocol name is needed if a destination port is specified'.format(rule_name)
+    if service_protocolname != '' and service_name != '':
+        return None, 'Rule {}: service can be specified either via protocol/port or name'.format(rule_name)
+    if service_protocolname == '' and service_name == '':
+        del rule_body['services']
+    elif service_protocolname != '':
+        rule_body['services']['service']['protocolName'] = service_protocolname
+        if service_destport != '':
+            rule_body['services']['service']['destinationPort'] = service_destport
+        if service_srcport != '':
+            rule_body['services']['service']['sourcePort'] = service_srcport
+    else:
+        service_id = resolve_service(service_name)
+        if not service_id:
+            return None, 'Rule {}: invalid service {} specified'.format(rule_name, service_name)
+        rule_body['services']['service']['value'] = service_id
+
+    return rule_body, None
+
+
+def dfw_rules_bulk_create(client_session, section_id, rules, section_type='L3', vccontent=None, max_retries=3):
+    """
+    This function creates many dfw rules in a section with a single update of the section. The names used in the
+    rules are translated into ids with one read per object type, and the new rules are added on top of the section
+    with one If-match PUT. If the section was changed by someone else in the meantime, the update is refused by NSX,
+    and the section is read again and the update retried
+    :param client_session: An instance of an NsxClient Session
+    :param section_id: The id of the section the rules are added to
+    :param rules: A list of dictionaries, one per rule, with the keys name, action, direction, pktype, applyto,
+                  disabled, logged, note, tag, source_type, source_value, source_name, source_excluded,
+                  destination_type, destination_value, destination_name, destination_excluded, service_protocolname,
+                  service_destport, service_srcport and service_name. They take the same values as the create_rule
+                  parameters, and only name is mandatory. See DFW_RULE_DEFAULTS for the values of missing keys
+    :param section_type: (Optional) The type of the section, L3 (default) or L2
+    :param vccontent: (Optional) The vCenter service content, needed if vCenter objects are referenced by name
+    :param max_retries: (Optional) How often the update is retried if the section was changed in the meantime
+    :return: returns a tuple, the first item is a list containing for each created rule a list with its id and name,
+             the second is a list of error messages. If there are errors, no action has been performed on the system
+    """
+    section_id = str(section_id)
+    if section_type == 'L2':
+        section_resource = 'dfwL2SectionId'
+        rule_type_selector = 'LAYER2'
+    elif section_type == 'L3':
+        section_resource = 'dfwL3SectionId'
+        rule_type_selector = 'LAYER3'
+    else:
+        return [], ['Section type {} is not supported, allowed values are L2/L3'.format(section_type)]
+
+    # The schema for L2rules is the same as for L3rules
+    rule_template = client_session.extract_resource_body_example('dfwL3Rules', 'create')['rule']
+
+    name_indexes = dict()
+    service_index = dict()
+
+    def resolve_name(object_type, object_name):
+        if object_type not in name_indexes:
+            name_indexes[object_type] = name_to_value_index(vccontent, client_session, object_type)
+        return name_indexes[object_type].get(object_name)
+
+    def resolve_service(service_name):
+        if not service_index:
+            service_index.update(_dfw_service_index(client_session))
+        return service_index.get(service_name)
+
+    new_rules = list()
+    new_rule_names = set()
+    errors = list()
+    for rule in rules:
+        rule_body, error = _dfw_bulk_rule(rule_template, rule, rule_type_selector, resolve_name, resolve_service)
+        if error:
+            errors.append(error)
+        elif rule_body['name'] in new_rule_names:
+            errors.append('Rule {}: the name is used by more than one rule'.format(rule_body['name']))
+        else:
+            new_rule_names.add(rule_body['name'])
+            new_rules.append(rule_body)
+    if errors:
+        return [], errors
+
+    # a 412 answer means the section changed since it was read, so the client must not exit on it
+    for attempt in range(max_retries + 1):
+        section = call_with_status(client_session.read, section_resource, uri_parameters={'sectionId': section_id})
+        if section['status'] != 200:
+            return [], ['Cannot read section {}, status {}: {}'.format(section_id, section['status'],
+                                                                     section['body'])]
+
+        section_body = section['body']
+        existing_rules = client_session.normalize_list_return(section_body['section'].get('rule'))
+        for existing_rule in existing_rules:
+            if existing_rule.get('name') in new_rule_names:
+                errors.append('Rule {}: a rule with the same name already exist in section {}'.format(
+                    existing_rule.get('name'), section_id))
+        if errors:
+            return [], errors
+
+        section_body['section']['rule'] = new_rules + existing_rules
+        update = call_with_status(client_session.update, section_resource, uri_parameters={'sectionId': section_id},
+                                  request_body_dict=section_body, additional_headers={'If-match': section['Etag']})
+        if update['status'] == 200:
+            existing_ids = set([existing_rule['@id'] for existing_rule in existing_rules])
+            updated_section = (update['body'] or {}).get('section', {})
+            return [[rule['@id'], rule.get('name')]
+                    for rule in client_session.normalize_list_return(updated_section.get('rule'))
+                    if rule['@id'] not in existing_ids], []
+        if update['status'] != 412:
+            return [], ['Cannot update section {}, status {}: {}'.format(section_id, update['status'],
+                                                                       update['body'])]
+
+    return [], ['Section {} was changed by someone else on each of the {} attempts'.format(section_id,
+                                                                                          max_retries + 1)]
+
+
+def _dfw_rules_bulk_create_print(client_session, vccontent, **kwargs):
+    if not (kwargs['dfw_section_id']):
+        print ('Mandatory parameters missing: [-sid SECTION ID]')
+        return None
+    if not (kwargs['dfw_rules_file']):
+        print ('Mandatory parameters missing: [--from-file RULES FILE (yaml, json or csv)]')
+        return None
+    section_type = kwargs['dfw_section_type'] or 'L3'
+
+    try:
+        rules = read_records_file(kwargs['dfw_rules_file'], 'rules')
+    except (IOError, ValueError) as e:
+        print 'Cannot read the rules file: {}'.format(e)
+        return None
+
+    rules_created, errors = dfw_rules_bulk_create(client_session, kwargs['dfw_section_id'], rules,
+                                                  section_type=section_type, vccontent=vccontent)
+    if errors:
+        for error in errors:
+            print 'Error: {}'.format(error)
+        print 'Aborting. No action have been performed on the system'
+        return None
+
+    if kwargs['verbose']:
+        print rules_created
+    else:
+        print tabulate(rules_created, headers=["ID", "Name"], tablefmt="psql")
+
+
+# A rule change of the plan of dfw_sync, action is 'create', 'update', 'delete' or 'move', changes the changed fields
+DfwRuleChange = namedtuple('DfwRuleChange', ['section', 'action', 'rule', 'changes'])
+
+# The outcome of dfw_sync for a section. applied is True if the section was updated, False if the update failed and
+# None if nothing was sent, updates counts the If-match PUTs sent, error explains why the section was not synced
+DfwSyncResult = namedtuple('DfwSyncResult', ['section', 'section_id', 'changes', 'applied', 'updates', 'elapsed',
+                                             'error'])
+
+
+def _text(value):
+    # the values of the live rules are unicode when they are not ASCII, they are compared as text without str()
+    return value if isinstance(value, unicode) else str(value)
+
+
+def _dfw_rule_fields(client_session, rule):
+    # the fields of a rule compared by dfw_sync, with the names of the keys of the rules files
+    def rule_ends(ends_key, end_key):
+        ends = rule.get(ends_key)
+        if not ends:
+            return None
+        return (_text(ends.get('@excluded') or 'false'),
+                sorted((_text(end.get('type')), _text(end.get('value')))
+                       for end in client_session.normalize_list_return(ends.get(end_key))))
+
+    services = client_session.normalize_list_return((rule.get('services') or {}).get('service'))
+    applied_to = client_session.normalize_list_return((rule.get('appliedToList') or {}).get('appliedTo'))
+    return OrderedDict([('name', _text(rule.get('name') or '')),
+                        ('action', _text(rule.get('action') or '')),
+                        ('direction', _text(rule.get('direction') or '')),
+                        ('pktype', _text(rule.get('packetType') or '')),
+                        ('disabled', _text(rule.get('@disabled') or 'false')),
+                        ('logged', _text(rule.get('@logged') or 'false')),
+                        ('note', _text(rule.get('notes') or '')),
+                        ('tag', _text(rule.get('tag') or '')),
+                        ('source', rule_ends('sources', 'source')),
+                        ('destination', rule_ends('destinations', 'destination')),
+                        ('service', sorted((_text(service.get('value') or ''), _text(service.get('protocolName') or ''),
+                                            _text(service.get('destinationPort') or ''),
+                                            _text(service.get('sourcePort') or '')) for service in services)),
+                        ('applyto', sorted(_text(target.get('value')) for target in applied_to))])
+
+
+def _dfw_section_plan(client_session, section, desired_rules, match):
+    # returns the rules of the synced section, in the order of the policy, and the list of DfwRuleChange
+    section_name = section.get('@name')
+    live_rules = client_session.normalize_list_return(section.get('rule'))
+    live_by_key = dict()
+    for live_rule in live_rules:
+        if live_rule.get(match):
+            live_by_key.setdefault(_text(live_rule[match]), live_rule)
+
+    new_rules = list()
+    changes = list()
+    for desired_rule in desired_rules:
+        live_rule = live_by_key.pop(_text(desired_rule[match]), None)
+        if live_rule is None:
+            new_rules.append(desired_rule)
+            changes.append(DfwRuleChange(section_name, 'create', desired_rule['name'], []))
+            continue
+        live_fields = _dfw_rule_fields(client_session, live_rule)
+        differences = [field for field, value in _dfw_rule_fields(client_session, desired_rule).items()
+                       if live_fields[field] != value]
+        if differences:
+            updated_rule = copy.deepcopy(desired_rule)
+            updated_rule['@id'] = live_rule['@id']
+            new_rules.append(updated_rule)
+            changes.append(DfwRuleChange(section_name, 'update', desired_rule['name'], differences))
+        else:
+            new_rules.append(live_rule)
+
+    kept_rules = [rule for rule in new_rules if '@id' in rule]
+    kept_ids = [str(rule['@id']) for rule in kept_rules]
+    for live_rule in live_rules:
+        if str(live_rule['@id']) not in kept_ids:
+            changes.append(DfwRuleChange(section_name, 'delete', live_rule.get('name'), []))
+
+    # the rules kept from the section must keep the order of the policy
+    live_order = [str(rule['@id']) for rule in live_rules if str(rule['@id']) in kept_ids]
+    for live_id, kept_rule in zip(live_order, kept_rules):
+        if live_id != str(kept_rule['@id']):
+            changes.append(DfwRuleChange(section_name, 'move', kept_rule.get('name'), ['position']))
+    return new_rules, changes
+
+
+def read_dfw_policy(policy_file):
+    """
+    This function reads a dfw policy from a yaml or json file, e.g.
+
+    sections:
+      - name: web-tier
+        match: name
+        rules:
+          - {name: allow-http, destination_type: ipset, destination_name: web, service_protocolname: TCP,
+             service_destport: 80}
+          - {name: deny-all, action: block}
+
+    The rules take the keys of the rules files of create_rules, see dfw_rules_bulk_create, in the order of the
+    section. match is name (default) or tag, the rule field matching the rules of the policy with the rules of the
+    section
+    :param policy_file: The path to the yaml or json file
+    :return: The list of the sections of the policy, as dictionaries
+    """
+    sections = read_records_file(policy_file, 'sections')
+    for section in sections:
+        if not isinstance(section, dict) or not section.get('name'):
+            raise ValueError('Every section of {} needs a name'.format(policy_file))
+        if section.get('match', 'name') not in ['name', 'tag']:
+            raise ValueError('Section {}: allowed values for match are name/tag'.format(section['name']))
+        if not isinstance(section.get('rules') or [], list):
+            raise ValueError('Section {}: rules must be a list'.format(section['name']))
+    return sections
+
+
+def dfw_sync(client_session, policy_sections, vccontent=None, dry_run=False, dfw_config=None, max_retries=3):
+    """
+    This function brings the sections of a dfw policy to their desired rules. The configuration is read once, the
+    rules of each section are matched by name or tag with the rules of the policy, and every section with changes is
+    updated with one If-match PUT, using the generation number of the section as Etag. The rules of a section missing
+    from the policy are deleted, the rules are ordered like in the policy. If a section was changed by someone else
+    in the meantime, it is read again and its changes computed again
+    :param client_session: An instance of an NsxClient Session
+    :param policy_sections: The sections of the policy, as returned by read_dfw_policy
+    :param vccontent: (Optional) The vCenter service content, needed if vCenter objects are referenced by name
+    :param dry_run: (Optional) If True, only the changes are computed
+    :param dfw_config: (Optional) A DfwConfig to compare the policy with, it is read if not specified
+    :param max_retries: (Optional) How often the update of a section is retried if it was changed in the meantime
+    :return: returns a tuple, the first item is a list of DfwSyncResult in the order of the policy sections, the
+             second the seconds spent reading the configuration
+    """
+    read_start = time.time()
+    if dfw_config is None:
+        dfw_config = DfwConfig(client_session)
+    read_time = time.time() - read_start
+
+    rule_template = client_session.extract_resource_body_example('dfwL3Rules', 'create')['rule']
+    section_resources = dict((rule_type, (section_resource, section_parameter))
+                             for rule_type, sections_key, section_resource, section_parameter
+                             in DFW_SECTION_RESOURCES)
+
+    name_indexes = dict()
+    service_index = dict()
+
+    def resolve_name(object_type, object_name):
+        if object_type not in name_indexes:
+            name_indexes[object_type] = name_to_value_index(vccontent, client_session, object_type)
+        return name_indexes[object_type].get(object_name)
+
+    def resolve_service(service_name):
+        if not service_index:
+            service_index.update(_dfw_service_index(client_session))
+        return service_index.get(service_name)
+
+    results = list()
+    for policy_section in policy_sections:
+        start_time = time.time()
+        section_name = policy_section['name']
+        match = policy_section.get('match', 'name')
+
+        def result(section_id=None, changes=(), applied=None, updates=0, error=None):
+            return DfwSyncResult(section_name, section_id, list(changes), applied, updates, time.time() - start_time,
+                                 error)
+
+        section_ids = dfw_config.section_ids(section_name)
+        if len(section_ids) != 1:
+            results.append(result(error='{} sections with this name found'.format(len(section_ids))))
+            continue
+        section_id = section_ids[0]
+        section = dfw_config.section(section_id)
+        rule_type_selector = str(section['@type'])
+        if rule_type_selector not in ['LAYER3', 'LAYER2']:
+            results.append(result(section_id, error='{} sections are not supported'.format(rule_type_selector)))
+            continue
+
+        desired_rules = list()
+        errors = list()
+        for rule in policy_section.get('rules') or []:
+            rule_body, error = _dfw_bulk_rule(rule_template, rule, rule_type_selector, resolve_name, resolve_service)
+            if error:
+                errors.append(error)
+            elif not rule_body.get(match):
+                errors.append('Rule {}: a {} is needed to match the rule'.format(rule_body['name'], match))
+            elif rule_body[match] in [desired_rule[match] for desired_rule in desired_rules]:
+                errors.append('Rule {}: the {} is used by more than one rule'.format(rule_body['name'], match))
+            else:
+                desired_rules.append(rule_body)
+        if errors:
+            results.append(result(section_id, error='; '.join(errors)))
+            continue
+
+        new_rules, changes = _dfw_section_plan(client_session, section, desired_rules, match)
+        if dry_run or not changes:
+            results.append(result(section_id, changes))
+            continue
+
+        section_resource, section_parameter = section_resources[rule_type_selector]
+        etag = str(section['@generationNumber'])
+        updates = 0
+        # a 412 answer means the section changed since it was read, so the client must not exit on it
+        for attempt in range(max_retries + 1):
+            section_body = {'section': dict(section, rule=new_rules)}
+            update = call_with_status(client_session.update, section_resource,
+                                      uri_parameters={section_parameter: section_id}, request_body_dict=section_body,
+                                      additional_headers={'If-match': etag})
+            updates += 1
+            if update['status'] == 200:
+                results.append(result(section_id, changes, True, updates))
+                break
+            if update['status'] != 412:
+                error = 'Cannot update the section, status {}: {}'.format(update['status'], update['body'])
+                results.append(result(section_id, changes, False, updates, error))
+                break
+            fresh_section = call_with_status(client_session.read, section_resource,
+                                             uri_parameters={section_parameter: section_id})
+            if fresh_section['status'] != 200:
+                error = 'Cannot read the section again, status {}: {}'.format(fresh_section['status'],
+                                                                             fresh_section['body'])
+                results.append(result(section_id, changes, False, updates, error))
+                break
+            section = fresh_section['body']['section']
+            etag = str(fresh_section['Etag'])
+            new_rules, changes = _dfw_section_plan(client_session, section, desired_rules, match)
+            if not changes:
+                results.append(result(section_id, changes, None, updates))
+                break
+        else:
+            error = 'The section was changed by someone else on each of the {} attempts'.format(max_retries + 1)
+            results.append(result(section_id, changes, False, updates, error))
+    if not dry_run:
+        dfw_config.mark_stale()
+    return results, read_time
+
+
+def _dfw_sync_print(client_session, vccontent, **kwargs):
+    if not (kwargs['dfw_policy_file']):
+        print ('Mandatory parameters missing: [POLICY FILE (yaml or json)]')
+        return None
+    try:
+        policy_sections = read_dfw_policy(kwargs['dfw_policy_file'])
+    except (IOError, ValueError) as e:
+        print 'Cannot read the policy file: {}'.format(e)
+        return None
+
+    start_time = time.time()
+    results, read_time = dfw_sync(client_session, policy_sections, vccontent=vccontent,
+                                  dry_run=kwargs['dfw_dry_run'])
+
+    plan = [(change.section, change.action, change.rule, ', '.join(change.changes))
+            for sync_result in results for change in sync_result.changes]
+    if kwargs['verbose']:
+        print [sync_result._asdict() for sync_result in results]
+    else:
+        print tabulate(plan, headers=["Section", "Action", "Rule", "Changes"], tablefmt="psql")
+
+    for sync_result in results:
+        if sync_result.error:
+            print 'Section {}: {}'.format(sync_result.section, sync_result.error)
+        elif kwargs['dfw_dry_run']:
+            print 'Section {}: {} changes planned'.format(sync_result.section, len(sync_result.changes))
+        elif sync_result.applied:
+            print 'Section {}: {} changes applied with {} updates in {:.2f} seconds'.format(
+                sync_result.section, len(sync_result.changes), sync_result.updates, sync_result.elapsed)
+        else:
+            print 'Section {}: in sync'.format(sync_result.section)
+    print 'dfw configuration read in {:.2f} seconds, {} sections {} in {:.2f} seconds'.format(
+        read_time, len([sync_result for sync_result in results if sync_result.changes]),
+        'to change' if kwargs['dfw_dry_run'] else 'changed', time.time() - start_time)
+
+
+def dfw_rule_service_delete(client_session, rule_id, service, dfw_config=None, section_id=None):
     """
     This function delete one of the services of a dfw rule given the rule id and the service to be deleted.
     If two or more services have the same name, the function will delete all of them
     :param client_session: An instance of an NsxClient Session
     :param rule_id: The ID of the dfw rule to retrieve
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
+    :param section_id: (Optional) The id of the section of the rule, only this section is read if the DfwConfig is
+                       not specified
     :param service: The service of the dfw rule to be deleted. If the service name contains any space, then
                     it must be enclosed in double quotes (like "VM Network"). For TCP/UDP services the syntax is as
                     follows: Proto:SourcePort:DestinationPort ( example TCP:9090:any )
@@ -1196,7 +2016,9 @@ def dfw_rule_service_delete(client_session, rule_id, service):
     if len(service) == 2:
         service.append('')
 
-    rule = dfw_rule_read(client_session, rule_id)
+    if dfw_config is None:
+        dfw_config = dfw_rule_config(client_session, rule_id, section_id)
+    rule = dfw_rule_read(client_session, rule_id, dfw_config)
 
     if len(rule) == 0:
         # It means a rule with id = rule_id does not exist
@@ -1204,32 +2026,15 @@ def dfw_rule_service_delete(client_session, rule_id, service):
         return result
 
     # Get the rule data structure that will be modified and then piped into the update function
-    section_list = dfw_section_list(client_session)
-    sections = [section_list[0], section_list[1], section_list[2]]
     section_id = rule[0][-1]
-
-    rule_type_selector = ''
-    for scan in sections:
-        for val in scan:
-            if val[1] == section_id:
-                rule_type_selector = val[2]
-
-    if rule_type_selector == '':
-        print 'ERROR: RULE TYPE SELECTOR CANNOT BE EMPTY - ABORT !'
-        return
-    if rule_type_selector == 'LAYER2':
-        rule_type = 'dfwL2Rule'
-    elif rule_type_selector == 'LAYER3':
-        rule_type = 'dfwL3Rule'
-    else:
-        rule_type = 'rule'
+    rule_type = _dfw_rule_resource(dfw_config.section_type(section_id))
 
     rule_schema = client_session.read(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id})
     rule_etag = rule_schema.items()[-1][1]
 
     if 'services' not in rule_schema.items()[1][1]['rule']:
         # It means the only service is "any" and it cannot be deleted short of deleting the whole rule
-        rule = dfw_rule_read(client_session, rule_id)
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
     if type(rule_schema.items()[1][1]['rule']['services']['service']) == list:
@@ -1251,7 +2056,8 @@ def dfw_rule_service_delete(client_session, rule_id, service):
         rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                      request_body_dict=rule_schema.items()[1][1],
                                      additional_headers={'If-match': rule_etag})
-        rule = dfw_rule_read(client_session, rule_id)
+        dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
     if type(rule_schema.items()[1][1]['rule']['services']['service']) == dict:
@@ -1272,8 +2078,9 @@ def dfw_rule_service_delete(client_session, rule_id, service):
             rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                          request_body_dict=rule_schema.items()[1][1],
                                          additional_headers={'If-match': rule_etag})
+            dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
 
-        rule = dfw_rule_read(client_session, rule_id)
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
 
@@ -1286,7 +2093,7 @@ def _dfw_rule_service_delete_print(client_session, **kwargs):
         return None
     rule_id = kwargs['dfw_rule_id']
     service = kwargs['dfw_rule_service']
-    rule = dfw_rule_service_delete(client_session, rule_id, service)
+    rule = dfw_rule_service_delete(client_session, rule_id, service, section_id=kwargs['dfw_section_id'])
     if kwargs['verbose']:
         print rule
     else:
@@ -1294,12 +2101,15 @@ def _dfw_rule_service_delete_print(client_session, **kwargs):
                                       "Packet Type", "Applied-To", "ID (Section)"], tablefmt="psql")
 
 
-def dfw_rule_applyto_delete(client_session, rule_id, applyto):
+def dfw_rule_applyto_delete(client_session, rule_id, applyto, dfw_config=None, section_id=None):
     """
     This function delete one of the applyto clauses of a dfw rule given the rule id and the clause to be deleted.
     If two or more clauses have the same name, the function will delete all of them
     :param client_session: An instance of an NsxClient Session
     :param rule_id: The ID of the dfw rule to retrieve
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
+    :param section_id: (Optional) The id of the section of the rule, only this section is read if the DfwConfig is
+                       not specified
     :param applyto: The name of the applyto clause of the dfw rule to be deleted. If it contains any space, then
                     it must be enclosed in double quotes (like "VM Network").
     :return: returns
@@ -1310,33 +2120,22 @@ def dfw_rule_applyto_delete(client_session, rule_id, applyto):
     """
 
     apply_to = str(applyto)
-    rule = dfw_rule_read(client_session, rule_id)
+    if dfw_config is None:
+        dfw_config = dfw_rule_config(client_session, rule_id, section_id)
+    rule = dfw_rule_read(client_session, rule_id, dfw_config)
 
     if len(rule) == 0:
         # It means a rule with id = rule_id does not exist
         result = [[rule_id, "---", "---", "---", "---", "---", "---", "---", apply_to, "---"]]
         return result
 
+    if not rule[0].has_applied_to(apply_to):
+        # Nothing to delete, so the rule is neither read nor updated
+        return rule
+
     # Get the rule data structure that will be modified and then piped into the update function
-    section_list = dfw_section_list(client_session)
-    sections = [section_list[0], section_list[1], section_list[2]]
     section_id = rule[0][-1]
-
-    rule_type_selector = ''
-    for scan in sections:
-        for val in scan:
-            if val[1] == section_id:
-                rule_type_selector = val[2]
-
-    if rule_type_selector == '':
-        print 'ERROR: RULE TYPE SELECTOR CANNOT BE EMPTY - ABORT !'
-        return
-    if rule_type_selector == 'LAYER2':
-        rule_type = 'dfwL2Rule'
-    elif rule_type_selector == 'LAYER3':
-        rule_type = 'dfwL3Rule'
-    else:
-        rule_type = 'rule'
+    rule_type = _dfw_rule_resource(dfw_config.section_type(section_id))
 
     rule_schema = client_session.read(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id})
     rule_etag = rule_schema.items()[-1][1]
@@ -1352,7 +2151,8 @@ def dfw_rule_applyto_delete(client_session, rule_id, applyto):
         rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                      request_body_dict=rule_schema.items()[1][1],
                                      additional_headers={'If-match': rule_etag})
-        rule = dfw_rule_read(client_session, rule_id)
+        dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
     if type(rule_schema.items()[1][1]['rule']['appliedToList']['appliedTo']) == dict:
@@ -1363,7 +2163,7 @@ def dfw_rule_applyto_delete(client_session, rule_id, applyto):
         if 'name' in val and val['name'] == "DISTRIBUTED_FIREWALL":
             # It means the only applyto clause is "DISTRIBUTED_FIREWALL" and it cannot be deleted short of deleting
             # the whole rule
-            rule = dfw_rule_read(client_session, rule_id)
+            rule = dfw_rule_read(client_session, rule_id, dfw_config)
             return rule
 
         if 'name' in val and val['name'] == apply_to:
@@ -1371,8 +2171,9 @@ def dfw_rule_applyto_delete(client_session, rule_id, applyto):
             rule = client_session.update(rule_type, uri_parameters={'ruleId': rule_id, 'sectionId': section_id},
                                          request_body_dict=rule_schema.items()[1][1],
                                          additional_headers={'If-match': rule_etag})
+            dfw_config.update_rule(section_id, rule_schema.items()[1][1]['rule'])
 
-        rule = dfw_rule_read(client_session, rule_id)
+        rule = dfw_rule_read(client_session, rule_id, dfw_config)
         return rule
 
 
@@ -1385,7 +2186,7 @@ def _dfw_rule_applyto_delete_print(client_session, **kwargs):
         return None
     rule_id = kwargs['dfw_rule_id']
     applyto = kwargs['dfw_rule_applyto']
-    rule = dfw_rule_applyto_delete(client_session, rule_id, applyto)
+    rule = dfw_rule_applyto_delete(client_session, rule_id, applyto, section_id=kwargs['dfw_section_id'])
     if kwargs['verbose']:
         print rule
     else:
@@ -1430,7 +2231,7 @@ def _dfw_section_read_print(client_session, **kwargs):
         print tabulate(section_list, headers=["Name", "ID", "Type", "Etag"], tablefmt="psql")
 
 
-def dfw_section_create(client_session, dfw_section_name, dfw_section_type):
+def dfw_section_create(client_session, dfw_section_name, dfw_section_type, dfw_config=None):
     """
     This function creates a new dfw section given its name and its type
     The new section is created on top of all other existing sections and with no rules
@@ -1438,6 +2239,7 @@ def dfw_section_create(client_session, dfw_section_name, dfw_section_type):
     :param client_session: An instance of an NsxClient Session
     :param dfw_section_name: The name of the dfw section to be created
     :param dfw_section_type: The type of the section. Allowed values are L2/L3/L3R
+    :param dfw_config: (Optional) A DfwConfig instance to use instead of reading the configuration from NSX Manager
     :return: returns
             - a tabular view of all the sections of the same type of the one just created. The table contains the
               following information: Name, Section id, Section type
@@ -1469,7 +2271,10 @@ def dfw_section_create(client_session, dfw_section_name, dfw_section_type):
     del section_schema['section']['rule']
 
     # Check for duplicate sections of the same type as the one that will be created, create and return
-    l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
+    if dfw_config is None:
+        dfw_config = DfwConfig(client_session)
+    l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session,
+                                                                                                dfw_config)
 
     if dfw_section_type == 'dfwL2Section':
         for val in l2_section_list:
@@ -1477,7 +2282,9 @@ def dfw_section_create(client_session, dfw_section_name, dfw_section_type):
                 # Section with the same name already exist
                 return l2_section_list, detailed_dfw_sections
         section = client_session.create(dfw_section_type, request_body_dict=section_schema)
-        l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
+        dfw_config.mark_stale()
+        l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session,
+                                                                                                    dfw_config)
         return l2_section_list, detailed_dfw_sections
 
     if dfw_section_type == 'dfwL3Section':
@@ -1486,7 +2293,9 @@ def dfw_section_create(client_session, dfw_section_name, dfw_section_type):
                 # Section with the same name already exist
                 return l3_section_list, detailed_dfw_sections
         section = client_session.create(dfw_section_type, request_body_dict=section_schema)
-        l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
+        dfw_config.mark_stale()
+        l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session,
+                                                                                                    dfw_config)
         return l3_section_list, detailed_dfw_sections
 
     if dfw_section_type == 'layer3RedirectSections':
@@ -1495,7 +2304,9 @@ def dfw_section_create(client_session, dfw_section_name, dfw_section_type):
                 # Section with the same name already exist
                 return l3r_section_list, detailed_dfw_sections
         section = client_session.create(dfw_section_type, request_body_dict=section_schema)
-        l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session)
+        dfw_config.mark_stale()
+        l2_section_list, l3r_section_list, l3_section_list, detailed_dfw_sections = dfw_section_list(client_session,
+                                                                                                    dfw_config)
         return l3r_section_list, detailed_dfw_sections
 
 
@@ -1538,6 +2349,9 @@ def contruct_parser(subparsers):
     read_rule:       return the details of a dfw rule given its id
     read_rule_id:    return the id of a rule given its name and the id of the section to which it belongs
     create_rule:     create a new rule given the id of the section, the rule name and all the rule parameters
+    create_rules:    create all the rules of a yaml, json or csv file in a section given its id, with one update
+    sync:            bring the sections of a yaml or json policy file to their rules, with one update per changed
+                     section, e.g. pynsxv dfw sync policy.yaml --dry-run
     delete_rule:     delete a rule given its id
     delete_rule_source: delete one rule's source given the rule id and the source identifier
     delete_rule_destination: delete one rule's destination given the rule id and the destination identifier
@@ -1546,9 +2360,13 @@ def contruct_parser(subparsers):
     move_rule_above:   move one rule above another rule given the id of the rule to be moved and the id of the base rule
     """)
 
+    parser.add_argument("dfw_policy_file",
+                        nargs="?",
+                        help="yaml or json file with the dfw policy for sync")
     parser.add_argument("-sid",
                         "--dfw_section_id",
-                        help="dfw section id needed for create, read and delete operations")
+                        help="dfw section id needed for create, read and delete operations. Optional for the rule\n"
+                             "read and delete operations, where it avoids looking up the section of the rule")
     parser.add_argument("-rid",
                         "--dfw_rule_id",
                         help="dfw rule id needed for create, read and delete operations")
@@ -1633,6 +2451,18 @@ def contruct_parser(subparsers):
     parser.add_argument("-stype",
                         "--dfw_section_type",
                         help="dfw section type")
+    parser.add_argument("--from-file",
+                        dest="dfw_rules_file",
+                        help="yaml, json or csv file with the rules for create_rules")
+    parser.add_argument("--stream",
+                        dest="dfw_stream",
+                        action="store_true",
+                        help="list_rules writes the rules as csv while the configuration is read, instead of\n"
+                             "printing tables once all the rules have been read")
+    parser.add_argument("--dry-run",
+                        dest="dfw_dry_run",
+                        action="store_true",
+                        help="sync only prints the changes it would make")
 
     parser.set_defaults(func=_dfw_main)
 
@@ -1646,17 +2476,10 @@ def _dfw_main(args):
     config = ConfigParser.ConfigParser()
     assert config.read(args.ini), 'could not read config file {}'.format(args.ini)
 
-    try:
-        nsxramlfile = config.get('nsxraml', 'nsxraml_file')
-    except (ConfigParser.NoSectionError):
-        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
-        nsxramlfile = '{}/nsxvapi.raml'.format(nsxramlfile_dir)
-
-    client_session = NsxClient(nsxramlfile, config.get('nsxv', 'nsx_manager'),
-                               config.get('nsxv', 'nsx_username'), config.get('nsxv', 'nsx_password'), debug=debug)
+    client_session = nsx_client_from_config(config, debug=debug, refresh_cache=args.refresh_cache)
 
-    vccontent = connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
-                              config.get('vcenter', 'vcenter_passwd'))
+    vccontent = lazy_connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
+                                   config.get('vcenter', 'vcenter_passwd'))
 
     try:
         command_selector = {
@@ -1674,6 +2497,8 @@ def _dfw_main(args):
             'delete_rule_applyto': _dfw_rule_applyto_delete_print,
             'create_section': _dfw_section_create_print,
             'create_rule': _dfw_rule_create_print,
+            'create_rules': _dfw_rules_bulk_create_print,
+            'sync': _dfw_sync_print,
             }
         command_selector[args.command](client_session, vccontent=vccontent, verbose=args.verbose,
                                        dfw_section_id=args.dfw_section_id,
@@ -1697,7 +2522,9 @@ def _dfw_main(args):
                                        dfw_rule_service_srcport=args.dfw_rule_service_srcport,
                                        dfw_rule_service_name=args.dfw_rule_service_name,
                                        dfw_rule_tag=args.dfw_rule_tag, dfw_rule_note=args.dfw_rule_note,
-                                       dfw_rule_logged=args.dfw_rule_logged,)
+                                       dfw_rule_logged=args.dfw_rule_logged,
+                                       dfw_rules_file=args.dfw_rules_file, dfw_stream=args.dfw_stream,
+                                       dfw_policy_file=args.dfw_policy_file, dfw_dry_run=args.dfw_dry_run)
 
     except KeyError as e:
         print('Unknown command {}'.format(e))
@@ -26,10 +26,9 @@ import argparse
 import ConfigParser
 import json
 from tabulate import tabulate
-from libutils import check_for_parameters, get_edge, get_vm_by_name, connect_to_vc
-from nsxramlclient.client import NsxClient
+from libutils import check_for_parameters, get_edge, get_vm_by_name, lazy_connect_to_vc
+from libutils import nsx_client_from_config
 from argparse import RawTextHelpFormatter
-from pkg_resources import resource_filename
 
 
 __author__ = 'yfauser'
@@ -670,17 +669,10 @@ def _dhcp_main(args):
     config = ConfigParser.ConfigParser()
     assert config.read(args.ini), 'could not read config file {}'.format(args.ini)
 
-    try:
-        nsxramlfile = config.get('nsxraml', 'nsxraml_file')
-    except ConfigParser.NoSectionError:
-        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
-        nsxramlfile = '{}/nsxvapi.raml'.format(nsxramlfile_dir)
-
-    client_session = NsxClient(nsxramlfile, config.get('nsxv', 'nsx_manager'),
-                               config.get('nsxv', 'nsx_username'), config.get('nsxv', 'nsx_password'), debug=debug)
+    client_session = nsx_client_from_config(config, debug=debug, refresh_cache=args.refresh_cache)
 
-    vccontent = connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
-                              config.get('vcenter', 'vcenter_passwd'))
+    vccontent = lazy_connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
+                                   config.get('vcenter', 'vcenter_passwd'))
     try:
         command_selector = {
             'enable_server': _enable_server,
@@ -27,12 +27,12 @@ __author__ = 'Dimitri Desmidt'
 import argparse
 import ConfigParser
 import json
-from libutils import get_logical_switch, get_vdsportgroupid, connect_to_vc
+from libutils import get_logical_switch, get_vdsportgroupid, lazy_connect_to_vc
 from libutils import get_datacentermoid, get_edgeresourcepoolmoid, get_edge, get_datastoremoid
+from libutils import invalidate_edge_cache
+from libutils import nsx_client_from_config
 from tabulate import tabulate
-from nsxramlclient.client import NsxClient
 from argparse import RawTextHelpFormatter
-from pkg_resources import resource_filename
 
 
 def dlr_add_interface(client_session, dlr_id, interface_ls_id, interface_ip, interface_subnet):
@@ -201,6 +201,7 @@ def dlr_create(client_session, dlr_name, dlr_pwd, dlr_size,
     del dlr_create_dict['edge']['appliances']['appliance']['customField']
 
     new_dlr = client_session.create('nsxEdges', request_body_dict=dlr_create_dict)
+    invalidate_edge_cache(client_session)
 
     # add default gateway to the created dlr if dgw entered
     if uplink_dgw:
@@ -344,6 +345,7 @@ def dlr_delete(client_session, dlr_name):
     if not dlr_id:
         return False, None
     client_session.delete('nsxEdge', uri_parameters={'edgeId': dlr_id})
+    invalidate_edge_cache(client_session)
     return True, dlr_id
 
 
@@ -463,17 +465,10 @@ def _dlr_main(args):
     config = ConfigParser.ConfigParser()
     assert config.read(args.ini), 'could not read config file {}'.format(args.ini)
 
-    try:
-        nsxramlfile = config.get('nsxraml', 'nsxraml_file')
-    except (ConfigParser.NoSectionError):
-        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
-        nsxramlfile = '{}/nsxvapi.raml'.format(nsxramlfile_dir)
-
-    client_session = NsxClient(nsxramlfile, config.get('nsxv', 'nsx_manager'),
-                               config.get('nsxv', 'nsx_username'), config.get('nsxv', 'nsx_password'), debug=debug)
+    client_session = nsx_client_from_config(config, debug=debug, refresh_cache=args.refresh_cache)
 
-    vccontent = connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
-                              config.get('vcenter', 'vcenter_passwd'))
+    vccontent = lazy_connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
+                                   config.get('vcenter', 'vcenter_passwd'))
 
     datacenter_name = config.get('defaults', 'datacenter_name')
     edge_datastore = config.get('defaults', 'edge_datastore')
@@ -27,12 +27,12 @@ __author__ = 'yfauser'
 import argparse
 import ConfigParser
 import json
-from libutils import get_logical_switch, get_vdsportgroupid, connect_to_vc, check_for_parameters
+from libutils import get_logical_switch, get_vdsportgroupid, lazy_connect_to_vc, check_for_parameters
 from libutils import get_datacentermoid, get_edgeresourcepoolmoid, get_edge, get_datastoremoid
+from libutils import invalidate_edge_cache
+from libutils import nsx_client_from_config
 from tabulate import tabulate
-from nsxramlclient.client import NsxClient
 from argparse import RawTextHelpFormatter
-from pkg_resources import resource_filename
 
 
 def esg_create(client_session, esg_name, esg_pwd, esg_size, datacentermoid, datastoremoid, resourcepoolid, default_pg,
@@ -77,6 +77,7 @@ def esg_create(client_session, esg_name, esg_pwd, esg_size, datacentermoid, data
     esg_create_dict['edge']['appliances']['appliance']['resourcePoolId'] = resourcepoolid
 
     new_esg = client_session.create('nsxEdges', request_body_dict=esg_create_dict)
+    invalidate_edge_cache(client_session)
     if new_esg['status'] == 201:
         return new_esg['objectId'], new_esg['body']
     else:
@@ -117,6 +118,7 @@ def esg_delete(client_session, esg_name):
     if not esg_id:
         return False, None
     client_session.delete('nsxEdge', uri_parameters={'edgeId': esg_id})
+    invalidate_edge_cache(client_session)
     return True, esg_id
 
 
@@ -822,17 +824,10 @@ def _esg_main(args):
     config = ConfigParser.ConfigParser()
     assert config.read(args.ini), 'could not read config file {}'.format(args.ini)
 
-    try:
-        nsxramlfile = config.get('nsxraml', 'nsxraml_file')
-    except (ConfigParser.NoSectionError):
-        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
-        nsxramlfile = '{}/nsxvapi.raml'.format(nsxramlfile_dir)
-
-    client_session = NsxClient(nsxramlfile, config.get('nsxv', 'nsx_manager'),
-                               config.get('nsxv', 'nsx_username'), config.get('nsxv', 'nsx_password'), debug=debug)
+    client_session = nsx_client_from_config(config, debug=debug, refresh_cache=args.refresh_cache)
 
-    vccontent = connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
-                              config.get('vcenter', 'vcenter_passwd'))
+    vccontent = lazy_connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
+                                   config.get('vcenter', 'vcenter_passwd'))
 
     if args.datacenter_name:
         datacenter_name = args.datacenter_name
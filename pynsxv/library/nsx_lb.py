@@ -24,17 +24,111 @@
 
 import argparse
 import ConfigParser
+import copy
 import json
+import time
+from collections import OrderedDict, namedtuple
 from tabulate import tabulate
-from libutils import get_edge, check_for_parameters
-from nsxramlclient.client import NsxClient
+from libutils import api_text, get_edge, check_for_parameters
+from libutils import nsx_client_from_config, read_records_file
+from libutils import call_with_status, parallel_map, PARALLEL_WORKERS
 from argparse import RawTextHelpFormatter
-from pkg_resources import resource_filename
 
 
 __author__ = 'yfauser'
 
 
+class LbConfig(object):
+    """
+    A snapshot of the Load Balancer configuration of an ESG, read with one 'loadBalancer' call, with the application
+    profiles, pools, members, VIPs and monitors indexed by name and by Id. The list and read functions of this module
+    take it as their optional lb_config parameter, to be served from the snapshot instead of reading NSX again
+    """
+    def __init__(self, client_session, esg_id, lb_config):
+        """
+        :param client_session: A nsxramlclient session Object
+        :param esg_id: The Id of the ESG
+        :param lb_config: The body of the 'loadBalancer' read, a dict with the key 'loadBalancer'
+        """
+        self.esg_id = esg_id
+        self.body = lb_config
+        config = lb_config['loadBalancer'] or {}
+        self.app_profiles = client_session.normalize_list_return(config.get('applicationProfile'))
+        self.pools = client_session.normalize_list_return(config.get('pool'))
+        self.vips = client_session.normalize_list_return(config.get('virtualServer'))
+        self.monitors = client_session.normalize_list_return(config.get('monitor'))
+        self._members = {}
+        for pool in self.pools:
+            self._members[pool.get('name')] = client_session.normalize_list_return(pool.get('member'))
+
+        self._app_profiles = self._index(self.app_profiles, 'applicationProfileId')
+        self._pools = self._index(self.pools, 'poolId')
+        self._vips = self._index(self.vips, 'virtualServerId')
+        self._monitors = self._index(self.monitors, 'monitorId')
+
+    @classmethod
+    def read(cls, client_session, esg_name):
+        """
+        :param client_session: A nsxramlclient session Object
+        :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
+        :return: The LbConfig of the ESG, None if the ESG was not found in NSX
+        """
+        esg_id, esg_params = get_edge(client_session, esg_name)
+        if not esg_id:
+            return None
+        lb_config = client_session.read('loadBalancer', uri_parameters={'edgeId': esg_id})['body']
+        return cls(client_session, esg_id, lb_config)
+
+    @staticmethod
+    def _index(objects, id_key):
+        index = {'name': {}, 'id': {}}
+        for obj in objects:
+            # keep the first object found with a given name, like the list based lookups do
+            index['name'].setdefault(obj.get('name'), obj)
+            index['id'][obj.get(id_key)] = obj
+        return index
+
+    def app_profile(self, name=None, profile_id=None):
+        """
+        :return: The details of the application profile with this name or Id, None if not found
+        """
+        return self._app_profiles['name'].get(name) if profile_id is None else self._app_profiles['id'].get(profile_id)
+
+    def pool(self, name=None, pool_id=None):
+        """
+        :return: The details of the pool with this name or Id, None if not found
+        """
+        return self._pools['name'].get(name) if pool_id is None else self._pools['id'].get(pool_id)
+
+    def vip(self, name=None, vip_id=None):
+        """
+        :return: The details of the VIP with this name or Id, None if not found
+        """
+        return self._vips['name'].get(name) if vip_id is None else self._vips['id'].get(vip_id)
+
+    def monitor(self, name=None, monitor_id=None):
+        """
+        :return: The details of the monitor with this name or Id, None if not found
+        """
+        return self._monitors['name'].get(name) if monitor_id is None else self._monitors['id'].get(monitor_id)
+
+    def members(self, pool_name):
+        """
+        :return: The list of the member details of the pool with this name, None if the pool was not found
+        """
+        return self._members.get(pool_name)
+
+    def member(self, pool_name, name=None, member_id=None):
+        """
+        :return: The details of the member of the pool with this name or Id, None if not found
+        """
+        for member in self._members.get(pool_name) or []:
+            if (member_id is None and member.get('name') == name) or \
+                    (member_id is not None and member.get('memberId') == member_id):
+                return member
+        return None
+
+
 def add_app_profile(client_session, esg_name, prof_name, template, persistence=None, expire_time=None, cookie_name=None,
                     cookie_mode=None, xforwardedfor=None, url=None):
     """
@@ -130,7 +224,7 @@ def _add_app_profile(client_session, **kwargs):
         print 'LB App configuration on esg {} failed'.format(kwargs['esg_name'])
 
 
-def read_app_profile(client_session, esg_name, prof_name):
+def read_app_profile(client_session, esg_name, prof_name, lb_config=None):
     """
     This function read a Load Balancer Application profile on an ESG and returns its Id and details
 
@@ -140,10 +234,18 @@ def read_app_profile(client_session, esg_name, prof_name):
     :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
     :type prof_name: str
     :param prof_name: The name for the to be created Load Balancer Application profile
+    :type lb_config: LbConfig
+    :param lb_config: (Optional) A snapshot of the Load Balancer configuration of the ESG to read the profile from
     :return: Returns a tuple, the first item of the tuple contains the Id of the profile as a string, the second
              item contains the profile details returned from the NSX API as a dict
     :rtype: tuple
     """
+    if lb_config is not None:
+        profile_details = lb_config.app_profile(prof_name)
+        if not profile_details:
+            return None, None
+        return profile_details['applicationProfileId'], profile_details
+
     esg_id, esg_params = get_edge(client_session, esg_name)
     if not esg_id:
         return None, None
@@ -216,7 +318,7 @@ def _delete_app_profile(client_session, **kwargs):
         print 'Deleting Application Profile {} on esg {} failed'.format(kwargs['profile_id'], kwargs['esg_name'])
 
 
-def list_app_profiles(client_session, esg_name):
+def list_app_profiles(client_session, esg_name, lb_config=None):
     """
     This function lists all Load Balancing Application Profiles on an ESG
 
@@ -236,18 +338,21 @@ def list_app_profiles(client_session, esg_name):
             The second item contains all profile details on the system as a list of dicts
     :rtype: tuple
     """
-    esg_id, esg_params = get_edge(client_session, esg_name)
-    if not esg_id:
-        return None
-
-    app_profiles_api = client_session.read('applicationProfiles', uri_parameters={'edgeId': esg_id})['body']
-    if app_profiles_api['loadBalancer']:
-        if 'applicationProfile' in app_profiles_api['loadBalancer']:
-            profs = client_session.normalize_list_return(app_profiles_api['loadBalancer']['applicationProfile'])
+    if lb_config is not None:
+        profs = lb_config.app_profiles
+    else:
+        esg_id, esg_params = get_edge(client_session, esg_name)
+        if not esg_id:
+            return None
+
+        app_profiles_api = client_session.read('applicationProfiles', uri_parameters={'edgeId': esg_id})['body']
+        if app_profiles_api['loadBalancer']:
+            if 'applicationProfile' in app_profiles_api['loadBalancer']:
+                profs = client_session.normalize_list_return(app_profiles_api['loadBalancer']['applicationProfile'])
+            else:
+                profs = []
         else:
             profs = []
-    else:
-        profs = []
 
     prof_lst = []
     for prof in profs:
@@ -365,7 +470,7 @@ def _add_pool(client_session, **kwargs):
         print 'LB Server Pool configuration on esg {} failed'.format(kwargs['esg_name'])
 
 
-def read_pool(client_session, esg_name, pool_name):
+def read_pool(client_session, esg_name, pool_name, lb_config=None):
     """
     This function returns the Id and Details of a Load Balancing Server Pool on an ESG
 
@@ -375,10 +480,18 @@ def read_pool(client_session, esg_name, pool_name):
     :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
     :type pool_name: str
     :param pool_name: The name of the to be created pool
+    :type lb_config: LbConfig
+    :param lb_config: (Optional) A snapshot of the Load Balancer configuration of the ESG to read the pool from
     :return: Returns a tuple, the first item of the tuple contains the Id of the pool as a string, the second
              item contains the pool details returned from the NSX API as a dict
     :rtype: tuple
     """
+    if lb_config is not None:
+        pool_details = lb_config.pool(pool_name)
+        if not pool_details:
+            return None, None
+        return pool_details['poolId'], pool_details
+
     esg_id, esg_params = get_edge(client_session, esg_name)
     if not esg_id:
         return None, None
@@ -450,7 +563,7 @@ def _delete_pool(client_session, **kwargs):
         print 'Deleting LB Server Pool {} on esg {} failed'.format(kwargs['pool_id'], kwargs['esg_name'])
 
 
-def list_pools(client_session, esg_name):
+def list_pools(client_session, esg_name, lb_config=None):
     """
     This function lists all LB Server Pools on an ESG
 
@@ -469,18 +582,21 @@ def list_pools(client_session, esg_name):
             The second item contains all pool details on the system as a list of dicts
     :rtype: tuple
     """
-    esg_id, esg_params = get_edge(client_session, esg_name)
-    if not esg_id:
-        return None
-
-    pools_api = client_session.read('pools', uri_parameters={'edgeId': esg_id})['body']
-    if pools_api['loadBalancer']:
-        if 'pool' in pools_api['loadBalancer']:
-            pools = client_session.normalize_list_return(pools_api['loadBalancer']['pool'])
+    if lb_config is not None:
+        pools = lb_config.pools
+    else:
+        esg_id, esg_params = get_edge(client_session, esg_name)
+        if not esg_id:
+            return None
+
+        pools_api = client_session.read('pools', uri_parameters={'edgeId': esg_id})['body']
+        if pools_api['loadBalancer']:
+            if 'pool' in pools_api['loadBalancer']:
+                pools = client_session.normalize_list_return(pools_api['loadBalancer']['pool'])
+            else:
+                pools = []
         else:
             pools = []
-    else:
-        pools = []
 
     pool_lst = [(pool.get('poolId'), pool.get('name'), pool.get('description'), pool.get('algorithm'),
                  pool.get('algorithmParameters'), pool.get('monitorId'), pool.get('transparent')) for pool in pools]
@@ -580,7 +696,7 @@ def _add_member(client_session, **kwargs):
         print 'LB Member configuration  on esg {} failed'.format(kwargs['esg_name'])
 
 
-def read_member(client_session, esg_name, pool_name, member_name):
+def read_member(client_session, esg_name, pool_name, member_name, lb_config=None):
     """
     This reads the details of a Member inside a Server Pool on an ESG
 
@@ -592,10 +708,18 @@ def read_member(client_session, esg_name, pool_name, member_name):
     :param pool_name: The name of the pool where this member is present in
     :type member_name: str
     :param member_name: The name of searched member in the server pool
+    :type lb_config: LbConfig
+    :param lb_config: (Optional) A snapshot of the Load Balancer configuration of the ESG to read the member from
     :return: Returns a tuple, the first item of the tuple contains the Id of the member as a string, the second
              item contains the member details returned from the NSX API as a dict
     :rtype: tuple
     """
+    if lb_config is not None:
+        member = lb_config.member(pool_name, member_name)
+        if not member:
+            return None, None
+        return member['memberId'], member
+
     esg_id, esg_params = get_edge(client_session, esg_name)
     if not esg_id:
         return None, None
@@ -694,7 +818,7 @@ def _delete_member(client_session, **kwargs):
                                                                       kwargs['esg_name'])
 
 
-def list_members(client_session, esg_name, pool_name):
+def list_members(client_session, esg_name, pool_name, lb_config=None):
     """
     This function lists all Members in a Server Pool on an ESG
 
@@ -717,19 +841,22 @@ def list_members(client_session, esg_name, pool_name):
             The second item contains all member details on the system as a list of dicts
     :rtype: tuple
     """
-    esg_id, esg_params = get_edge(client_session, esg_name)
-    if not esg_id:
-        return None
+    if lb_config is not None:
+        members = lb_config.members(pool_name) or []
+    else:
+        esg_id, esg_params = get_edge(client_session, esg_name)
+        if not esg_id:
+            return None
 
-    pool_id, pool_details = read_pool(client_session, esg_name, pool_name)
+        pool_id, pool_details = read_pool(client_session, esg_name, pool_name)
 
-    if pool_details:
-        if 'member' in pool_details:
-            members = client_session.normalize_list_return(pool_details['member'])
+        if pool_details:
+            if 'member' in pool_details:
+                members = client_session.normalize_list_return(pool_details['member'])
+            else:
+                members = []
         else:
             members = []
-    else:
-        members = []
 
     member_lst = [(member.get('memberId'), member.get('name'), member.get('ipAddress'), member.get('port'),
                    member.get('monitorPort'), member.get('weight'), member.get('maxConn'), member.get('minConn'),
@@ -754,6 +881,296 @@ def _list_members(client_session, **kwargs):
                                              "Max Conn", "Min Conn", "Condition"], tablefmt="psql")
 
 
+# Fields of the member records passed to add_members and replace_members, and the keys of the NSX API they are set to
+MEMBER_FIELDS = OrderedDict([('name', 'name'), ('ip', 'ipAddress'), ('port', 'port'), ('monitor_port', 'monitorPort'),
+                             ('weight', 'weight'), ('max_conn', 'maxConn'), ('min_conn', 'minConn'),
+                             ('condition', 'condition')])
+
+
+def _member_body(member):
+    return dict((api_key, api_text(member[field])) for field, api_key in MEMBER_FIELDS.items()
+                if member.get(field) is not None)
+
+
+def _update_pool_members(client_session, esg_name, pool_name, update):
+    esg_id, esg_params = get_edge(client_session, esg_name)
+    if not esg_id:
+        return None
+
+    # all the pools of the edge and their members are returned by one read, the pool is found by name there
+    pools_api = client_session.read('pools', uri_parameters={'edgeId': esg_id})['body']
+    if pools_api['loadBalancer'] and 'pool' in pools_api['loadBalancer']:
+        pools = client_session.normalize_list_return(pools_api['loadBalancer']['pool'])
+    else:
+        pools = []
+    try:
+        pool_details = [pool for pool in pools if pool.get('name') == pool_name][0]
+    except IndexError:
+        return None
+
+    if 'member' in pool_details and pool_details['member']:
+        members = client_session.normalize_list_return(pool_details['member'])
+    else:
+        members = []
+    pool_details['member'] = update(members)
+
+    result = client_session.update('pool', uri_parameters={'edgeId': esg_id, 'poolID': pool_details['poolId']},
+                                   request_body_dict={'pool': pool_details})
+    if result['status'] != 204:
+        return False
+    else:
+        return True
+
+
+def add_members(client_session, esg_name, pool_name, members):
+    """
+    This function adds many Members to a Server Pool on an ESG with one read and one update of the pool. A member
+    with the name of a member already in the pool replaces it, keeping its Id
+
+    :type client_session: nsxramlclient.client.NsxClient
+    :param client_session: A nsxramlclient session Object
+    :type esg_name: str
+    :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
+    :type pool_name: str
+    :param pool_name: The name of the pool where the members should be added to
+    :type members: list
+    :param members: A list of dicts with the keys of MEMBER_FIELDS, name and ip are needed, e.g.
+                    {'name': 'web01', 'ip': '10.0.0.11', 'port': '80'}
+    :return: Returns True on success, False on a failure, and None if the ESG or the pool was not found in NSX
+    :rtype: bool
+    """
+    new_members = OrderedDict((member['name'], _member_body(member)) for member in members)
+
+    def update(current_members):
+        updated_members = []
+        for member in current_members:
+            if member['name'] in new_members:
+                new_member = new_members.pop(member['name'])
+                new_member['memberId'] = member['memberId']
+                updated_members.append(new_member)
+            else:
+                updated_members.append(member)
+        return updated_members + new_members.values()
+
+    return _update_pool_members(client_session, esg_name, pool_name, update)
+
+
+def remove_members(client_session, esg_name, pool_name, member_names):
+    """
+    This function removes many Members from a Server Pool on an ESG with one read and one update of the pool
+
+    :type client_session: nsxramlclient.client.NsxClient
+    :param client_session: A nsxramlclient session Object
+    :type esg_name: str
+    :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
+    :type pool_name: str
+    :param pool_name: The name of the pool where the members are present in
+    :type member_names: list
+    :param member_names: The names or the Ids of the members to be removed from the pool
+    :return: Returns True on success, False on a failure, and None if the ESG or the pool was not found in NSX
+    :rtype: bool
+    """
+    member_names = set(member_names)
+    return _update_pool_members(client_session, esg_name, pool_name,
+                                lambda current_members: [member for member in current_members
+                                                         if member['name'] not in member_names and
+                                                         member['memberId'] not in member_names])
+
+
+def replace_members(client_session, esg_name, pool_name, members):
+    """
+    This function replaces all the Members of a Server Pool on an ESG with one read and one update of the pool. The
+    members keeping their name keep their Id
+
+    :type client_session: nsxramlclient.client.NsxClient
+    :param client_session: A nsxramlclient session Object
+    :type esg_name: str
+    :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
+    :type pool_name: str
+    :param pool_name: The name of the pool whose members are replaced
+    :type members: list
+    :param members: A list of dicts with the keys of MEMBER_FIELDS, name and ip are needed
+    :return: Returns True on success, False on a failure, and None if the ESG or the pool was not found in NSX
+    :rtype: bool
+    """
+    def update(current_members):
+        member_ids = dict((member['name'], member['memberId']) for member in current_members)
+        new_members = []
+        for member in members:
+            new_member = _member_body(member)
+            if member['name'] in member_ids:
+                new_member['memberId'] = member_ids[member['name']]
+            new_members.append(new_member)
+        return new_members
+
+    return _update_pool_members(client_session, esg_name, pool_name, update)
+
+
+def _members_by_pool(**kwargs):
+    if not kwargs['members_file']:
+        print 'You are missing the mandatory parameter: members_file'
+        return None
+    try:
+        records = read_records_file(kwargs['members_file'], 'members')
+    except (IOError, ValueError) as e:
+        print 'Could not read the members file: {}'.format(e)
+        return None
+
+    members_by_pool = OrderedDict()
+    for record in records:
+        if isinstance(record, dict):
+            pool_name = record.get('pool') or kwargs['pool_name']
+        else:
+            # a list of names is enough to remove members
+            pool_name, record = kwargs['pool_name'], {'name': record}
+        if not pool_name or not record.get('name'):
+            print 'The member {} has no name or no pool, use a pool field or --pool_name'.format(record)
+            return None
+        members_by_pool.setdefault(pool_name, []).append(record)
+    return members_by_pool
+
+
+def _change_members(client_session, change, **kwargs):
+    needed_params = ['esg_name']
+    if not check_for_parameters(needed_params, kwargs):
+        return None
+    members_by_pool = _members_by_pool(**kwargs)
+    if members_by_pool is None:
+        return None
+
+    for pool_name, members in members_by_pool.items():
+        try:
+            result = change(client_session, kwargs['esg_name'], pool_name, members)
+        except ValueError as e:
+            print 'LB Members configuration of Pool {} on esg {} failed: {}'.format(pool_name, kwargs['esg_name'], e)
+            continue
+        if result:
+            print 'LB Members configuration of Pool {} on esg {} succeeded, {} members'.format(
+                pool_name, kwargs['esg_name'], len(members))
+        elif result is None:
+            print 'LB Server Pool {} on esg {} not found'.format(pool_name, kwargs['esg_name'])
+        else:
+            print 'LB Members configuration of Pool {} on esg {} failed'.format(pool_name, kwargs['esg_name'])
+
+
+def _add_members(client_session, **kwargs):
+    _change_members(client_session, add_members, **kwargs)
+
+
+def _remove_members(client_session, **kwargs):
+    _change_members(client_session, lambda session, esg_name, pool_name, members:
+                    remove_members(session, esg_name, pool_name, [member['name'] for member in members]), **kwargs)
+
+
+def _replace_members(client_session, **kwargs):
+    _change_members(client_session, replace_members, **kwargs)
+
+
+# States of a member in its pool, set in the condition of the member
+MEMBER_STATES = ('enabled', 'disabled')
+
+# The outcome of set_member_state
+MemberStateResult = namedtuple('MemberStateResult', ['result', 'changed', 'not_found', 'elapsed', 'api_calls'])
+
+
+def set_member_state(client_session, esg_name, member_states):
+    """
+    This function enables or disables many Members across the Server Pools of an ESG. The Load Balancer configuration
+    is read once, all the states are changed in it and it is updated once, only if a state changed
+
+    :type client_session: nsxramlclient.client.NsxClient
+    :param client_session: A nsxramlclient session Object
+    :type esg_name: str
+    :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
+    :type member_states: list
+    :param member_states: A list of (pool name, member name, state) tuples, the state being 'enabled' or 'disabled'
+    :return: Returns a MemberStateResult with:
+             result: True on success, False on a failure of the update and None if the ESG was not found in NSX
+             changed: The list of (pool name, member name) tuples whose state changed
+             not_found: The list of (pool name, member name) tuples not found on the ESG
+             elapsed: The seconds spent
+             api_calls: The number of calls made to the Load Balancer configuration, the ESG Id comes from the edge
+                        cache of get_edge
+    :rtype: MemberStateResult
+    """
+    start_time = time.time()
+    esg_id, esg_params = get_edge(client_session, esg_name)
+    if not esg_id:
+        return MemberStateResult(None, [], [], time.time() - start_time, 0)
+
+    for pool_name, member_name, state in member_states:
+        if state not in MEMBER_STATES:
+            raise ValueError('The state of the member {} in Pool {} must be one of {}'.format(
+                member_name, pool_name, ', '.join(MEMBER_STATES)))
+
+    lb_config = client_session.read('loadBalancer', uri_parameters={'edgeId': esg_id})['body']
+    api_calls = 1
+
+    members = {}
+    if lb_config['loadBalancer'] and 'pool' in lb_config['loadBalancer']:
+        pools = client_session.normalize_list_return(lb_config['loadBalancer']['pool'])
+        lb_config['loadBalancer']['pool'] = pools
+        for pool in pools:
+            if 'member' in pool and pool['member']:
+                pool['member'] = client_session.normalize_list_return(pool['member'])
+                for member in pool['member']:
+                    members[(pool.get('name'), member.get('name'))] = member
+
+    changed = []
+    not_found = []
+    for pool_name, member_name, state in member_states:
+        member = members.get((pool_name, member_name))
+        if member is None:
+            not_found.append((pool_name, member_name))
+        elif member.get('condition') != state:
+            member['condition'] = state
+            changed.append((pool_name, member_name))
+
+    result = True
+    if changed:
+        update = client_session.update('loadBalancer', uri_parameters={'edgeId': esg_id}, request_body_dict=lb_config)
+        api_calls += 1
+        result = update['status'] == 204
+
+    return MemberStateResult(result, changed, not_found, time.time() - start_time, api_calls)
+
+
+def _set_member_state(client_session, **kwargs):
+    needed_params = ['esg_name']
+    if not check_for_parameters(needed_params, kwargs):
+        return None
+
+    if kwargs['members_file']:
+        members_by_pool = _members_by_pool(**kwargs)
+        if members_by_pool is None:
+            return None
+        member_states = [(pool_name, member['name'], member.get('condition') or kwargs['state'])
+                         for pool_name, members in members_by_pool.items() for member in members]
+    elif check_for_parameters(['pool_name', 'member_name', 'state'], kwargs):
+        member_states = [(kwargs['pool_name'], kwargs['member_name'], kwargs['state'])]
+    else:
+        return None
+
+    try:
+        result = set_member_state(client_session, kwargs['esg_name'], member_states)
+    except ValueError as e:
+        print e
+        return None
+
+    if result.result is None:
+        print 'ESG {} not found'.format(kwargs['esg_name'])
+        return None
+    for pool_name, member_name in result.not_found:
+        print 'Member {} in Pool {} on esg {} not found'.format(member_name, pool_name, kwargs['esg_name'])
+    if kwargs['verbose']:
+        print json.dumps(result._asdict())
+    elif result.result:
+        print 'LB Member states on esg {} set, {} changed in {:.2f} seconds with {} API calls'.format(
+            kwargs['esg_name'], len(result.changed), result.elapsed, result.api_calls)
+    else:
+        print 'LB Member states on esg {} failed'.format(kwargs['esg_name'])
+
+
 def add_vip(client_session, esg_name, vip_name, app_profile, vip_ip, protocol, port, pool_name, vip_description=None,
             conn_limit=None, conn_rate_limit=None, acceleration=None):
     """
@@ -843,7 +1260,7 @@ def _add_vip(client_session, **kwargs):
         print 'LB VIP configuration on esg {} failed'.format(kwargs['esg_name'])
 
 
-def read_vip(client_session, esg_name, vip_name):
+def read_vip(client_session, esg_name, vip_name, lb_config=None):
     """
     This function returns the Id and Details of a VIP on an ESG
 
@@ -853,10 +1270,18 @@ def read_vip(client_session, esg_name, vip_name):
     :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
     :type vip_name: str
     :param vip_name: The name of the VIP searched
+    :type lb_config: LbConfig
+    :param lb_config: (Optional) A snapshot of the Load Balancer configuration of the ESG to read the VIP from
     :return: Returns a tuple, the first item of the tuple contains the Id of the VIP as a string, the second
              item contains the VIP details returned from the NSX API as a dict
     :rtype: tuple
     """
+    if lb_config is not None:
+        vip_details = lb_config.vip(vip_name)
+        if not vip_details:
+            return None, None
+        return vip_details['virtualServerId'], vip_details
+
     esg_id, esg_params = get_edge(client_session, esg_name)
     if not esg_id:
         return None, None
@@ -928,7 +1353,7 @@ def _delete_vip(client_session, **kwargs):
         print 'Deleting VIP {} on esg {} failed'.format(kwargs['vip_id'], kwargs['esg_name'])
 
 
-def list_vips(client_session, esg_name):
+def list_vips(client_session, esg_name, lb_config=None):
     """
     This function lists all VIPs on an ESG
 
@@ -952,19 +1377,22 @@ def list_vips(client_session, esg_name):
             The second item contains all VIP details on the system as a list of dicts
     :rtype: tuple
     """
-    esg_id, esg_params = get_edge(client_session, esg_name)
-    if not esg_id:
-        return None
+    if lb_config is not None:
+        vips = lb_config.vips
+    else:
+        esg_id, esg_params = get_edge(client_session, esg_name)
+        if not esg_id:
+            return None
 
-    vips_api = client_session.read('virtualServers', uri_parameters={'edgeId': esg_id})['body']
+        vips_api = client_session.read('virtualServers', uri_parameters={'edgeId': esg_id})['body']
 
-    if vips_api['loadBalancer']:
-        if 'virtualServer' in vips_api['loadBalancer']:
-            vips = client_session.normalize_list_return(vips_api['loadBalancer']['virtualServer'])
+        if vips_api['loadBalancer']:
+            if 'virtualServer' in vips_api['loadBalancer']:
+                vips = client_session.normalize_list_return(vips_api['loadBalancer']['virtualServer'])
+            else:
+                vips = []
         else:
             vips = []
-    else:
-        vips = []
 
     vips_lst = [(vip.get('virtualServerId'), vip.get('name'), vip.get('description'), vip.get('enabled'),
                  vip.get('ipAddress'), vip.get('protocol'), vip.get('port'), vip.get('defaultPoolId'),
@@ -1127,7 +1555,7 @@ def _delete_monitor(client_session, **kwargs):
         print 'Deleting Monitor {} on esg {} failed'.format(kwargs['mon_id'], kwargs['esg_name'])
 
 
-def read_monitor(client_session, esg_name, monitor_name):
+def read_monitor(client_session, esg_name, monitor_name, lb_config=None):
     """
     This function returns the Id and Details of a Monitor on an ESG
 
@@ -1137,10 +1565,18 @@ def read_monitor(client_session, esg_name, monitor_name):
     :param esg_name: The display name of a Edge Service Gateway used for Load Balancing
     :type monitor_name: str
     :param monitor_name: The name of the monitor to get the details from
+    :type lb_config: LbConfig
+    :param lb_config: (Optional) A snapshot of the Load Balancer configuration of the ESG to read the monitor from
     :return: Returns a tuple, the first item of the tuple contains the Id of the Monitor as a string, the second
              item contains the Monitor details returned from the NSX API as a dict
     :rtype: tuple
     """
+    if lb_config is not None:
+        mon_details = lb_config.monitor(monitor_name)
+        if not mon_details:
+            return None, None
+        return mon_details['monitorId'], mon_details
+
     esg_id, esg_params = get_edge(client_session, esg_name)
     if not esg_id:
         return None, None
@@ -1173,7 +1609,7 @@ def _read_monitor(client_session, **kwargs):
         print 'LB Monitor {} on ESG {} has the Id: {}'.format(kwargs['monitor'], kwargs['esg_name'], mon_id)
 
 
-def list_monitors(client_session, esg_name):
+def list_monitors(client_session, esg_name, lb_config=None):
     """
     This function lists all LB Monitors on an ESG
 
@@ -1191,19 +1627,22 @@ def list_monitors(client_session, esg_name):
             The second item contains all monitor details on the system as a list of dicts
     :rtype: tuple
     """
-    esg_id, esg_params = get_edge(client_session, esg_name)
-    if not esg_id:
-        return None
+    if lb_config is not None:
+        mons = lb_config.monitors
+    else:
+        esg_id, esg_params = get_edge(client_session, esg_name)
+        if not esg_id:
+            return None
 
-    mons_api = client_session.read('lbMonitors', uri_parameters={'edgeId': esg_id})['body']
+        mons_api = client_session.read('lbMonitors', uri_parameters={'edgeId': esg_id})['body']
 
-    if mons_api['loadBalancer']:
-        if 'monitor' in mons_api['loadBalancer']:
-            mons = client_session.normalize_list_return(mons_api['loadBalancer']['monitor'])
+        if mons_api['loadBalancer']:
+            if 'monitor' in mons_api['loadBalancer']:
+                mons = client_session.normalize_list_return(mons_api['loadBalancer']['monitor'])
+            else:
+                mons = []
         else:
             mons = []
-    else:
-        mons = []
 
     mons_lst = [(mon.get('monitorId'), mon.get('name'), mon.get('interval'), mon.get('timeout'),
                  mon.get('maxRetries'), mon.get('type')) for mon in mons]
@@ -1325,7 +1764,7 @@ def _disable_lb(client_session, **kwargs):
         print 'Disabling Load Balancing on Edge Services Gateway {} succeeded'.format(kwargs['esg_name'])
 
 
-def show_loadbalancer(client_session, esg_name):
+def show_loadbalancer(client_session, esg_name, lb_config=None):
     """
     This function returns the Loadbalancer Configuration and Status
 
@@ -1339,13 +1778,18 @@ def show_loadbalancer(client_session, esg_name):
               [2] The Syslog logging level for the LB
               [3] The Acceleration status ('true'/'false')
              the second item in the tuple contains the details configuration as a dict as returned from the API
+    :type lb_config: LbConfig
+    :param lb_config: (Optional) A snapshot of the Load Balancer configuration of the ESG to show
     :rtype: tuple
     """
-    esg_id, esg_params = get_edge(client_session, esg_name)
-    if not esg_id:
-        return None
+    if lb_config is not None:
+        conf_api = lb_config.body
+    else:
+        esg_id, esg_params = get_edge(client_session, esg_name)
+        if not esg_id:
+            return None
 
-    conf_api = client_session.read('loadBalancer', uri_parameters={'edgeId': esg_id})['body']
+        conf_api = client_session.read('loadBalancer', uri_parameters={'edgeId': esg_id})['body']
 
     if conf_api['loadBalancer']:
         conf = conf_api['loadBalancer']
@@ -1406,6 +1850,323 @@ def _delete_load_balancer(client_session, **kwargs):
         print 'Deleting LB Config on esg {} failed'.format(kwargs['esg_name'])
 
 
+# The Load Balancer objects managed by lb_apply, in the order they are created. kind is the key of the object list in
+# the desired state and the LbConfig attribute, references maps the keys of a desired object naming an other object
+# to the kind of this object and to the key of its Id in the NSX API
+LbObjectType = namedtuple('LbObjectType', ['kind', 'body_key', 'id_key', 'create_resource', 'resource',
+                                           'id_parameter', 'references'])
+
+LB_OBJECT_TYPES = [LbObjectType('monitors', 'monitor', 'monitorId', 'lbMonitors', 'lbMonitor', 'monitorID', {}),
+                   LbObjectType('app_profiles', 'applicationProfile', 'applicationProfileId', 'applicationProfiles',
+                                'applicationProfile', 'appProfileID', {}),
+                   LbObjectType('pools', 'pool', 'poolId', 'pools', 'pool', 'poolID',
+                                {'monitor': ('monitors', 'monitorId')}),
+                   LbObjectType('vips', 'virtualServer', 'virtualServerId', 'virtualServers', 'virtualServer',
+                                'virtualserverID', {'pool': ('pools', 'defaultPoolId'),
+                                                    'applicationProfile': ('app_profiles', 'applicationProfileId')})]
+
+# A change of the plan of lb_apply, action is 'create', 'update' or 'delete' and changes the list of changed keys
+LbChange = namedtuple('LbChange', ['edge', 'action', 'kind', 'name', 'changes', 'desired', 'current'])
+
+# The outcome of lb_apply for an ESG, applied is a list of (LbChange, success) tuples in the order of the plan
+LbApplyResult = namedtuple('LbApplyResult', ['edge', 'plan', 'applied', 'elapsed', 'error'])
+
+
+def _lb_as_list(value):
+    if not value:
+        return []
+    elif isinstance(value, list):
+        return value
+    return [value]
+
+
+def _lb_value(value):
+    # the NSX API returns all values as strings
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, dict):
+        return dict((key, _lb_value(item)) for key, item in value.items())
+    elif isinstance(value, list):
+        return [_lb_value(item) for item in value]
+    elif value is None or isinstance(value, basestring):
+        return api_text(value)
+    return str(value)
+
+
+def _lb_named_list(value):
+    return all(isinstance(item, dict) and 'name' in item for item in value)
+
+
+def _lb_differences(desired, current, prefix=''):
+    differences = []
+    for key, value in desired.items():
+        current_value = current.get(key)
+        if isinstance(value, dict):
+            differences.extend(_lb_differences(value, current_value if isinstance(current_value, dict) else {},
+                                               '{}{}.'.format(prefix, key)))
+        elif isinstance(value, list) and _lb_named_list(value):
+            current_items = dict((item.get('name'), item) for item in _lb_as_list(current_value))
+            if set(item['name'] for item in value) != set(current_items):
+                differences.append(prefix + key)
+            elif [item for item in value if _lb_differences(item, current_items[item['name']])]:
+                differences.append(prefix + key)
+        elif isinstance(value, list):
+            if sorted(value) != sorted(_lb_as_list(current_value)):
+                differences.append(prefix + key)
+        elif value != current_value:
+            differences.append(prefix + key)
+    return differences
+
+
+def _lb_merge(current, desired):
+    merged = copy.deepcopy(current)
+    for key, value in desired.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _lb_merge(merged[key], value)
+        elif isinstance(value, list) and _lb_named_list(value):
+            # objects keeping their name, like pool members, keep their Id and the settings not given
+            current_items = dict((item.get('name'), item) for item in _lb_as_list(merged.get(key)))
+            merged[key] = [_lb_merge(current_items.get(item['name'], {}), item) for item in value]
+        else:
+            merged[key] = value
+    return merged
+
+
+def _lb_resolve(desired, object_type, object_ids):
+    resolved = dict((key, value) for key, value in desired.items() if key not in object_type.references)
+    for reference_key, (reference_kind, reference_id_key) in object_type.references.items():
+        if reference_key in desired:
+            # an object created by the same plan has no Id yet
+            resolved[reference_id_key] = object_ids[reference_kind].get(desired[reference_key]) or \
+                '<new {}>'.format(desired[reference_key])
+    return _lb_value(resolved)
+
+
+def read_lb_desired_state(desired_file):
+    """
+    This function reads the desired Load Balancer state of ESGs from a yaml or json file, e.g.
+
+    edges:
+      - name: esg-01
+        monitors:
+          - {name: web-mon, type: http, interval: 5, timeout: 15, maxRetries: 3, method: GET, url: /health}
+        app_profiles:
+          - {name: web-profile, template: HTTP, insertXForwardedFor: true}
+        pools:
+          - name: web
+            algorithm: round-robin
+            monitor: web-mon
+            member:
+              - {name: web01, ipAddress: 10.0.0.11, port: 80, weight: 1}
+        vips:
+          - {name: web-vip, ipAddress: 10.0.1.10, protocol: http, port: 80, pool: web, applicationProfile: web-profile}
+
+    The objects take the keys of the NSX API, except the references to other objects which take their name: monitor
+    for the monitor of a pool, pool and applicationProfile for the default pool and application profile of a VIP. The
+    object kinds listed for an ESG are managed completely, their objects missing from the file are deleted
+
+    :type desired_file: str
+    :param desired_file: The path to the yaml or json file
+    :return: The list of the desired states of the ESGs, as dicts
+    :rtype: list
+    """
+    edges = read_records_file(desired_file, 'edges')
+    kinds = [object_type.kind for object_type in LB_OBJECT_TYPES]
+    for edge_state in edges:
+        if not isinstance(edge_state, dict) or not edge_state.get('name'):
+            raise ValueError('Every edge of {} needs a name'.format(desired_file))
+        for kind, objects in edge_state.items():
+            if kind == 'name':
+                continue
+            if kind not in kinds:
+                raise ValueError('Unknown object kind {} for edge {}, use one of {}'.format(
+                    kind, edge_state['name'], ', '.join(kinds)))
+            if not isinstance(objects or [], list) or \
+                    [obj for obj in objects or [] if not isinstance(obj, dict) or not obj.get('name')]:
+                raise ValueError('The {} of edge {} must be a list of objects with a name'.format(
+                    kind, edge_state['name']))
+    return edges
+
+
+def lb_plan(lb_config, edge_state):
+    """
+    This function computes the changes turning the Load Balancer configuration of an ESG into its desired state
+
+    :type lb_config: LbConfig
+    :param lb_config: The current Load Balancer configuration of the ESG
+    :type edge_state: dict
+    :param edge_state: The desired state of the ESG, as returned by read_lb_desired_state
+    :return: Returns the list of LbChange, the creations and updates in the order of LB_OBJECT_TYPES followed by the
+             deletions in the reverse order, so that an object is created before and deleted after its users
+    :rtype: list
+    """
+    object_ids = {}
+    for object_type in LB_OBJECT_TYPES:
+        object_ids[object_type.kind] = dict((obj.get('name'), obj.get(object_type.id_key))
+                                            for obj in getattr(lb_config, object_type.kind))
+
+    plan = []
+    for object_type in LB_OBJECT_TYPES:
+        current_objects = dict((obj.get('name'), obj) for obj in getattr(lb_config, object_type.kind))
+        for desired in edge_state.get(object_type.kind) or []:
+            for reference_key, (reference_kind, reference_id_key) in object_type.references.items():
+                if reference_key in desired and desired[reference_key] not in object_ids[reference_kind] and \
+                        desired[reference_key] not in [obj['name'] for obj in edge_state.get(reference_kind) or []]:
+                    raise ValueError('{} {} of edge {} references the unknown {} {}'.format(
+                        object_type.body_key, desired['name'], edge_state['name'], reference_key,
+                        desired[reference_key]))
+            resolved = _lb_resolve(desired, object_type, object_ids)
+            current = current_objects.get(desired['name'])
+            if current is None:
+                plan.append(LbChange(edge_state['name'], 'create', object_type.kind, desired['name'],
+                                     sorted(resolved), desired, None))
+            else:
+                differences = _lb_differences(resolved, current)
+                if differences:
+                    plan.append(LbChange(edge_state['name'], 'update', object_type.kind, desired['name'],
+                                         differences, desired, current))
+
+    for object_type in reversed(LB_OBJECT_TYPES):
+        if object_type.kind not in edge_state:
+            continue
+        desired_names = set(obj['name'] for obj in edge_state[object_type.kind] or [])
+        for current in getattr(lb_config, object_type.kind):
+            if current.get('name') not in desired_names:
+                plan.append(LbChange(edge_state['name'], 'delete', object_type.kind, current.get('name'), [], None,
+                                     current))
+    return plan
+
+
+def lb_apply_edge(client_session, edge_state, dry_run=False):
+    """
+    This function brings the Load Balancer configuration of an ESG to its desired state, reading the configuration
+    once and making only the calls of the changes found by lb_plan. It stops at the first change that fails, the
+    error of this change is set in the result
+
+    :type client_session: nsxramlclient.client.NsxClient
+    :param client_session: A nsxramlclient session Object
+    :type edge_state: dict
+    :param edge_state: The desired state of the ESG, as returned by read_lb_desired_state
+    :type dry_run: bool
+    :param dry_run: (Optional) If True, only the plan is computed
+    :return: Returns a LbApplyResult
+    :rtype: LbApplyResult
+    """
+    start_time = time.time()
+    lb_config = LbConfig.read(client_session, edge_state['name'])
+    if lb_config is None:
+        raise ValueError('ESG {} not found'.format(edge_state['name']))
+
+    plan = lb_plan(lb_config, edge_state)
+    applied = []
+    if dry_run:
+        return LbApplyResult(edge_state['name'], plan, applied, time.time() - start_time, None)
+
+    types = dict((object_type.kind, object_type) for object_type in LB_OBJECT_TYPES)
+    object_ids = {}
+    for object_type in LB_OBJECT_TYPES:
+        object_ids[object_type.kind] = dict((obj.get('name'), obj.get(object_type.id_key))
+                                            for obj in getattr(lb_config, object_type.kind))
+
+    error = None
+    for change in plan:
+        object_type = types[change.kind]
+        # a failed change must not exit, so that the changes done before it are reported
+        if change.action == 'create':
+            result = call_with_status(client_session.create, object_type.create_resource,
+                                      uri_parameters={'edgeId': lb_config.esg_id},
+                                      request_body_dict={object_type.body_key: _lb_resolve(change.desired, object_type,
+                                                                                           object_ids)})
+            success = result['status'] == 201
+            if success:
+                object_ids[change.kind][change.name] = result['objectId']
+        else:
+            uri_parameters = {'edgeId': lb_config.esg_id, object_type.id_parameter: change.current[object_type.id_key]}
+            if change.action == 'update':
+                body = _lb_merge(change.current, _lb_resolve(change.desired, object_type, object_ids))
+                result = call_with_status(client_session.update, object_type.resource, uri_parameters=uri_parameters,
+                                          request_body_dict={object_type.body_key: body})
+            else:
+                result = call_with_status(client_session.delete, object_type.resource, uri_parameters=uri_parameters)
+            success = result['status'] in (200, 204)
+        applied.append((change, success))
+        if not success:
+            error = 'Cannot {} {} {}, status {}: {}'.format(change.action, object_type.body_key, change.name,
+                                                           result['status'], result['body'])
+            break
+
+    return LbApplyResult(edge_state['name'], plan, applied, time.time() - start_time, error)
+
+
+def lb_apply(client_session, desired_edges, dry_run=False, workers=PARALLEL_WORKERS):
+    """
+    This function brings the Load Balancer configuration of many ESGs to their desired state, the ESGs are processed
+    concurrently, the changes of an ESG one after the other
+
+    :type client_session: nsxramlclient.client.NsxClient
+    :param client_session: A nsxramlclient session Object
+    :type desired_edges: list
+    :param desired_edges: The desired states of the ESGs, as returned by read_lb_desired_state
+    :type dry_run: bool
+    :param dry_run: (Optional) If True, only the plans are computed
+    :type workers: int
+    :param workers: (Optional) The maximum number of ESGs processed concurrently
+    :return: Returns a list of LbApplyResult, in the order of desired_edges. The error of an ESG that could not be
+             processed is set in its result
+    :rtype: list
+    """
+    results = parallel_map(lambda edge_state: lb_apply_edge(client_session, edge_state, dry_run), desired_edges,
+                           workers)
+    return [result if error is None else LbApplyResult(edge_state['name'], [], [], 0, error)
+            for edge_state, (result, error) in zip(desired_edges, results)]
+
+
+def _lb_apply(client_session, **kwargs):
+    needed_params = ['desired_file']
+    if not check_for_parameters(needed_params, kwargs):
+        return None
+    try:
+        desired_edges = read_lb_desired_state(kwargs['desired_file'])
+    except (IOError, ValueError) as e:
+        print 'Could not read the desired state: {}'.format(e)
+        return None
+
+    results = lb_apply(client_session, desired_edges, dry_run=kwargs['dry_run'], workers=kwargs['workers'])
+
+    plan_rows = []
+    for result in results:
+        for index, change in enumerate(result.plan):
+            if kwargs['dry_run']:
+                status = 'planned'
+            elif index < len(result.applied):
+                # the changes are applied in the order of the plan
+                status = 'done' if result.applied[index][1] else 'failed'
+            else:
+                status = 'skipped'
+            plan_rows.append((change.edge, change.action, change.kind, change.name, ', '.join(change.changes),
+                              status))
+
+    if kwargs['verbose']:
+        print json.dumps([dict(zip(['edge', 'action', 'kind', 'name', 'changes', 'status'], row))
+                          for row in plan_rows])
+    else:
+        print tabulate(plan_rows, headers=["Edge", "Action", "Type", "Name", "Changes", "Status"], tablefmt="psql")
+
+    for result in results:
+        if result.error is not None and result.applied:
+            print 'Load Balancer of esg {}: {} of {} changes applied, {}'.format(
+                result.edge, len([success for change, success in result.applied if success]), len(result.plan),
+                result.error)
+        elif result.error is not None:
+            print 'Load Balancer of esg {} not applied: {}'.format(result.edge, result.error)
+        elif kwargs['dry_run']:
+            print 'Load Balancer of esg {}: {} changes planned'.format(result.edge, len(result.plan))
+        else:
+            print 'Load Balancer of esg {}: {} of {} changes applied in {:.2f} seconds'.format(
+                result.edge, len([success for change, success in result.applied if success]), len(result.plan),
+                result.elapsed)
+
+
 def contruct_parser(subparsers):
     parser = subparsers.add_parser('lb', description="Functions for Load Balancer configurations "
                                                      "on Edge Service Gateways",
@@ -1427,6 +2188,11 @@ def contruct_parser(subparsers):
     read_member:        Reads the Id of a member from the Pool
     delete_member:      Deletes a member from the Pool
     list_members:       Lists all members in the Pool
+    add_members:        Adds or updates the members of a file (--from-file) in their Pool, one update per Pool
+    remove_members:     Removes the members of a file (--from-file) from their Pool, one update per Pool
+    replace_members:    Replaces all members of the Pools of a file (--from-file), one update per Pool
+    set_member_state:   Enables or disables a member, or the members of a file (--from-file) with their condition
+                        field, with one update of the Load Balancer
     add_vip:            Add a virtual server (VIP) to the Load Balancer
     read_vip:           Reads the Id of a VIP on the Load Balancer
     delete_vip:         Deletes a VIP from the Load Balancer
@@ -1439,8 +2205,22 @@ def contruct_parser(subparsers):
     disable_lb:         Disables the Load Balancing Service on the ESG
     show_lb:            Show the current LB Configuration and Status
     delete_lb:          Delete the complete LB Configuration on the Load Balancer
+    apply:              Brings the Load Balancers of the ESGs of a yaml file to their desired state, with the
+                        minimal set of changes, e.g. pynsxv lb apply desired.yaml --dry-run
     """)
 
+    parser.add_argument("desired_file",
+                        nargs="?",
+                        help="The yaml or json file with the desired Load Balancer state for apply")
+    parser.add_argument("--dry-run",
+                        dest="dry_run",
+                        action="store_true",
+                        help="Only print the plan of the changes of apply")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=PARALLEL_WORKERS,
+                        help="Number of ESGs applied concurrently, default {}".format(PARALLEL_WORKERS))
+
     parser.add_argument("-n",
                         "--esg_name",
                         help="ESG name")
@@ -1503,6 +2283,15 @@ def contruct_parser(subparsers):
     parser.add_argument("-m",
                         "--member",
                         help="The ip address of a server pool member")
+    parser.add_argument("--from-file",
+                        dest="members_file",
+                        help="A yaml, json or csv file with the members for add_members, remove_members and\n"
+                             "replace_members, with the fields pool, name, ip, port, monitor_port, weight,\n"
+                             "max_conn, min_conn and condition. The pool field defaults to --pool_name")
+    parser.add_argument("--state",
+                        choices=MEMBER_STATES,
+                        help="The state of server pool members for set_member_state, the default of the\n"
+                             "members of a file without a condition field")
     parser.add_argument("-po",
                         "--port",
                         help="UDP/TCP Port used in server pool members and VIPs")
@@ -1593,14 +2382,7 @@ def _lb_main(args):
     config = ConfigParser.ConfigParser()
     assert config.read(args.ini), 'could not read config file {}'.format(args.ini)
 
-    try:
-        nsxramlfile = config.get('nsxraml', 'nsxraml_file')
-    except ConfigParser.NoSectionError:
-        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
-        nsxramlfile = '{}/nsxvapi.raml'.format(nsxramlfile_dir)
-
-    client_session = NsxClient(nsxramlfile, config.get('nsxv', 'nsx_manager'),
-                               config.get('nsxv', 'nsx_username'), config.get('nsxv', 'nsx_password'), debug=debug)
+    client_session = nsx_client_from_config(config, debug=debug, refresh_cache=args.refresh_cache)
 
     try:
         command_selector = {
@@ -1616,6 +2398,10 @@ def _lb_main(args):
             'read_member': _read_member,
             'delete_member': _delete_member,
             'list_members': _list_members,
+            'add_members': _add_members,
+            'remove_members': _remove_members,
+            'replace_members': _replace_members,
+            'set_member_state': _set_member_state,
             'add_vip': _add_vip,
             'read_vip': _read_vip,
             'delete_vip': _delete_vip,
@@ -1627,7 +2413,8 @@ def _lb_main(args):
             'enable_lb': _enable_lb,
             'disable_lb': _disable_lb,
             'show_lb': _show_loadbalancer,
-            'delete_lb': _delete_load_balancer
+            'delete_lb': _delete_load_balancer,
+            'apply': _lb_apply
             }
         command_selector[args.command](client_session, esg_name=args.esg_name, profile_name=args.profile_name,
                                        profile_id=args.profile_id, protocol=args.protocol,
@@ -1639,8 +2426,10 @@ def _lb_main(args):
                                        member_name=args.member_name, port=args.port, monitor_port=args.monitor_port,
                                        monitor=args.monitor, weight=args.weight, max_conn=args.max_conn,
                                        min_conn=args.min_conn, pool_id=args.pool_id, member_id=args.member_id,
-                                       member=args.member, vip_name=args.vip_name, vip_ip=args.vip_ip,
-                                       conn_limit=args.conn_limit, conn_rate_limit=args.conn_rate_limit,
+                                       member=args.member, members_file=args.members_file, state=args.state,
+                                       desired_file=args.desired_file, dry_run=args.dry_run, workers=args.workers,
+                                       vip_name=args.vip_name, vip_ip=args.vip_ip, conn_limit=args.conn_limit,
+                                       conn_rate_limit=args.conn_rate_limit,
                                        vip_description=args.vip_description, vip_id=args.vip_id, logging=args.logging,
                                        log_level=args.log_level, mon_name=args.mon_name, mon_id=args.mon_id,
                                        timeout=args.timeout, interval=args.interval, max_retries=args.max_retries,
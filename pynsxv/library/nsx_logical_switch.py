@@ -26,13 +26,16 @@ __author__ = 'Dimitri Desmidt, Emanuele Mazza, Yves Fauser'
 
 import argparse
 import ConfigParser
+import copy
 import json
+from collections import OrderedDict
 from libutils import get_scope
 from libutils import get_logical_switch
+from libutils import nsx_client_from_config, invalidate_inventory_cache
+from libutils import expand_name_pattern, read_names_file
+from libutils import parallel_map, PARALLEL_WORKERS
 from tabulate import tabulate
-from nsxramlclient.client import NsxClient
 from argparse import RawTextHelpFormatter
-from pkg_resources import resource_filename
 
 
 def logical_switch_create(client_session, transport_zone, logical_switch_name, control_plane_mode=None):
@@ -53,15 +56,59 @@ def logical_switch_create(client_session, transport_zone, logical_switch_name, c
     # get a template dict for the lswitch create
     lswitch_create_dict = client_session.extract_resource_body_example('logicalSwitches', 'create')
 
+    new_ls = _logical_switch_submit(client_session, vdn_scope_id, lswitch_create_dict, logical_switch_name,
+                                    control_plane_mode)
+    invalidate_inventory_cache(client_session, 'logical_switches')
+    return new_ls['body'], new_ls['location']
+
+
+def _logical_switch_submit(client_session, vdn_scope_id, lswitch_create_dict, logical_switch_name, control_plane_mode):
     # fill the details for the new lswitch in the body dict
     lswitch_create_dict['virtualWireCreateSpec']['controlPlaneMode'] = control_plane_mode
     lswitch_create_dict['virtualWireCreateSpec']['name'] = logical_switch_name
     lswitch_create_dict['virtualWireCreateSpec']['tenantId'] = ''
 
     # create new lswitch
-    new_ls = client_session.create('logicalSwitches', uri_parameters={'scopeId': vdn_scope_id},
-                                   request_body_dict=lswitch_create_dict)
-    return new_ls['body'], new_ls['location']
+    return client_session.create('logicalSwitches', uri_parameters={'scopeId': vdn_scope_id},
+                                 request_body_dict=lswitch_create_dict)
+
+
+def logical_switch_create_many(client_session, transport_zone, logical_switch_names, control_plane_mode=None,
+                               workers=PARALLEL_WORKERS):
+    """
+    This function creates many logical switches in NSX. The Transport Zone and the body template are read once, the
+    creates are submitted concurrently
+    :param client_session: An instance of an NsxClient Session
+    :param transport_zone: The name of the Scope (Transport Zone)
+    :param logical_switch_names: The list of names of the new logical switches
+    :param control_plane_mode: (Optional) Control Plane Mode, uses the Transport Zone default if not specified
+    :param workers: (Optional) The maximum number of concurrent creates
+    :return: returns a tuple, the first item is an OrderedDict of the logical switch IDs of the created switches by
+             name, the second item is an OrderedDict of the errors of the switches that could not be created by name
+    """
+    vdn_scope_id, vdn_scope = get_scope(client_session, transport_zone)
+    assert vdn_scope_id, 'The Transport Zone you defined could not be found'
+    if not control_plane_mode:
+        control_plane_mode = vdn_scope['controlPlaneMode']
+
+    lswitch_create_template = client_session.extract_resource_body_example('logicalSwitches', 'create')
+
+    def create(logical_switch_name):
+        new_ls = _logical_switch_submit(client_session, vdn_scope_id, copy.deepcopy(lswitch_create_template),
+                                        logical_switch_name, control_plane_mode)
+        return new_ls['body']
+
+    results = parallel_map(create, logical_switch_names, workers)
+    invalidate_inventory_cache(client_session, 'logical_switches')
+
+    created = OrderedDict()
+    failed = OrderedDict()
+    for logical_switch_name, (logical_switch_id, error) in zip(logical_switch_names, results):
+        if error is not None:
+            failed[logical_switch_name] = error
+        else:
+            created[logical_switch_name] = logical_switch_id
+    return created, failed
 
 
 def _logical_switch_create(client_session, **kwargs):
@@ -90,6 +137,7 @@ def logical_switch_delete(client_session, logical_switch_name):
     if not logical_switch_id:
         return False, None
     client_session.delete('logicalSwitch', uri_parameters={'virtualWireID': logical_switch_id})
+    invalidate_inventory_cache(client_session, 'logical_switches')
     return True, logical_switch_id
 
 
@@ -119,6 +167,93 @@ def logical_switch_read(client_session, logical_switch_name):
     return logical_switch_id, logical_switch_params
 
 
+def logical_switch_delete_many(client_session, logical_switch_names, workers=PARALLEL_WORKERS):
+    """
+    This function deletes many logical switches in NSX. The logical switches are listed once, the deletes are
+    submitted concurrently
+    :param client_session: An instance of an NsxClient Session
+    :param logical_switch_names: The list of names of the logical switches to delete
+    :param workers: (Optional) The maximum number of concurrent deletes
+    :return: returns a tuple, the first item is an OrderedDict of the logical switch IDs of the deleted switches by
+             name, the second item is an OrderedDict of the errors of the switches that could not be deleted by name,
+             the switches not found have a None error
+    """
+    switch_list, all_logical_switches = logical_switch_list(client_session)
+    switch_ids = {}
+    for lsname, logical_switch_id in switch_list:
+        switch_ids.setdefault(lsname, logical_switch_id)
+
+    found_names = [name for name in logical_switch_names if name in switch_ids]
+
+    def delete(logical_switch_name):
+        client_session.delete('logicalSwitch', uri_parameters={'virtualWireID': switch_ids[logical_switch_name]})
+
+    results = dict(zip(found_names, parallel_map(delete, found_names, workers)))
+    if found_names:
+        invalidate_inventory_cache(client_session, 'logical_switches')
+
+    deleted = OrderedDict()
+    failed = OrderedDict()
+    for logical_switch_name in logical_switch_names:
+        if logical_switch_name not in results:
+            failed[logical_switch_name] = None
+        elif results[logical_switch_name][1] is not None:
+            failed[logical_switch_name] = results[logical_switch_name][1]
+        else:
+            deleted[logical_switch_name] = switch_ids[logical_switch_name]
+    return deleted, failed
+
+
+def _logical_switch_names(**kwargs):
+    if kwargs['names_file']:
+        try:
+            return read_names_file(kwargs['names_file'])
+        except (IOError, ValueError) as e:
+            print 'Cannot read the names file: {}'.format(e)
+            return None
+    if kwargs['logical_switch_name']:
+        return expand_name_pattern(kwargs['logical_switch_name'])
+    return []
+
+
+def _logical_switch_create_many(client_session, **kwargs):
+    logical_switch_names = _logical_switch_names(**kwargs)
+    if logical_switch_names is None:
+        return None
+    if not logical_switch_names:
+        print 'You must specify a logical switch name pattern or a names file for create_many'
+        return None
+    created, failed = logical_switch_create_many(client_session, kwargs['transport_zone'], logical_switch_names,
+                                                 workers=kwargs['workers'])
+    if kwargs['verbose']:
+        print json.dumps(created)
+    else:
+        print tabulate(created.items(), headers=["LS name", "LS ID"], tablefmt="psql")
+    for logical_switch_name, error in failed.items():
+        print 'Logical Switch {} creation failed: {}'.format(logical_switch_name, error)
+    print '{} Logical Switches created, {} failed'.format(len(created), len(failed))
+
+
+def _logical_switch_delete_many(client_session, **kwargs):
+    logical_switch_names = _logical_switch_names(**kwargs)
+    if logical_switch_names is None:
+        return None
+    if not logical_switch_names:
+        print 'You must specify a logical switch name pattern or a names file for delete_many'
+        return None
+    deleted, failed = logical_switch_delete_many(client_session, logical_switch_names, workers=kwargs['workers'])
+    if kwargs['verbose']:
+        print json.dumps(deleted)
+    else:
+        print tabulate(deleted.items(), headers=["LS name", "LS ID"], tablefmt="psql")
+    for logical_switch_name, error in failed.items():
+        if error is None:
+            print 'Logical Switch {} not found'.format(logical_switch_name)
+        else:
+            print 'Logical Switch {} deletion failed: {}'.format(logical_switch_name, error)
+    print '{} Logical Switches deleted, {} failed'.format(len(deleted), len(failed))
+
+
 def _logical_switch_read(client_session, **kwargs):
     logical_switch_name = kwargs['logical_switch_name']
     if not logical_switch_name:
@@ -170,6 +305,8 @@ def contruct_parser(subparsers):
     read:   return the virtual wire id of a logical switch
     delete: delete a logical switch"
     list:   return a list of all logical switches
+    create_many: create the logical switches of a name pattern or a names file
+    delete_many: delete the logical switches of a name pattern or a names file
     """)
 
     parser.add_argument("-t",
@@ -177,7 +314,15 @@ def contruct_parser(subparsers):
                         help="nsx transport zone")
     parser.add_argument("-n",
                         "--name",
-                        help="logical switch name, needed for create, read and delete")
+                        help="logical switch name, needed for create, read and delete. For create_many and\n"
+                             "delete_many a name pattern, e.g. tenant-{001..500} or web-{a,b}")
+    parser.add_argument("--names_file",
+                        help="file with the logical switch names for create_many and delete_many, a text file\n"
+                             "with one name per line or a yaml, json or csv file with a name field")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=PARALLEL_WORKERS,
+                        help="number of concurrent creates or deletes, default {}".format(PARALLEL_WORKERS))
 
     parser.set_defaults(func=_lswitch_main)
 
@@ -196,14 +341,7 @@ def _lswitch_main(args):
     else:
         transport_zone = config.get('defaults', 'transport_zone')
 
-    try:
-        nsxramlfile = config.get('nsxraml', 'nsxraml_file')
-    except (ConfigParser.NoSectionError):
-        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
-        nsxramlfile = '{}/nsxvapi.raml'.format(nsxramlfile_dir)
-
-    client_session = NsxClient(nsxramlfile, config.get('nsxv', 'nsx_manager'),
-                               config.get('nsxv', 'nsx_username'), config.get('nsxv', 'nsx_password'), debug=debug)
+    client_session = nsx_client_from_config(config, debug=debug, refresh_cache=args.refresh_cache)
 
     try:
         command_selector = {
@@ -211,9 +349,12 @@ def _lswitch_main(args):
             'create': _logical_switch_create,
             'delete': _logical_switch_delete,
             'read': _logical_switch_read,
+            'create_many': _logical_switch_create_many,
+            'delete_many': _logical_switch_delete_many,
             }
         command_selector[args.command](client_session, transport_zone=transport_zone,
-                                       logical_switch_name=args.name, verbose=args.verbose)
+                                       logical_switch_name=args.name, names_file=args.names_file,
+                                       workers=args.workers, verbose=args.verbose)
     except KeyError:
         print('Unknown command')
 
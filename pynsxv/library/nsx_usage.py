@@ -26,15 +26,41 @@ __author__ = 'yfauser'
 
 import argparse
 import ConfigParser
+import csv
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
 from tabulate import tabulate
-from nsxramlclient.client import NsxClient
-from libutils import connect_to_vc
+from libutils import lazy_connect_to_vc
+from libutils import nsx_client_from_config
 from libutils import VIM_TYPES
-from libutils import get_all_objs
-from pkg_resources import resource_filename
-
-
-def host_prep_state(session):
+from libutils import retrieve_properties
+from libutils import parallel_map, PARALLEL_WORKERS
+from libutils import write_json_file
+
+
+def _cluster_hosts_collect(session, cluster_moid, dfw_enabled):
+    hosts_status = session.read('childStatus', uri_parameters={'parentResourceID': cluster_moid})
+    enabled_hosts = session.normalize_list_return(hosts_status['body']['resourceStatuses']['resourceStatus'])
+    return [(host['resource']['name'], host['resource']['scope']['name'], host['resource']['objectId'],
+             host['resource']['scope']['id'], dfw_enabled) for host in enabled_hosts]
+
+
+def host_prep_state(session, workers=PARALLEL_WORKERS, deadline=None):
+    """
+    This function returns the hosts prepared for NSX, the hosts of the prepared clusters are read concurrently
+    :param session: An instance of an NsxClient Session
+    :param workers: (Optional) The maximum number of concurrent cluster reads
+    :param deadline: (Optional) The seconds after which the cluster reads not finished yet are given up
+    :return: A tuple with the number of prepared hosts, the number of hosts with DFW enabled and the list of host
+             tuples (host name, cluster name, host moid, cluster moid, DFW enabled), in the order of the clusters.
+             The clusters whose hosts could not be read are printed and left out
+    """
     resource_status = session.read('statusResourceType', uri_parameters={'resourceType': 'ClusterComputeResource'})
     enabled_clusters = session.normalize_list_return(resource_status['body']['resourceStatuses']['resourceStatus'])
     clusters = []
@@ -44,13 +70,14 @@ def host_prep_state(session):
                        if feature['featureId'] == 'com.vmware.vshield.firewall'][0]
         clusters.append((cluster['resource']['objectId'], cluster['resource']['name'], dfw_enabled))
 
+    results = parallel_map(lambda cluster: _cluster_hosts_collect(session, cluster[0], cluster[2]), clusters,
+                           workers, deadline)
     hosts = []
-    for cluster_moid, cluster_name, dfw_enabled in clusters:
-        hosts_status = session.read('childStatus', uri_parameters={'parentResourceID': cluster_moid})
-        enabled_hosts = session.normalize_list_return(hosts_status['body']['resourceStatuses']['resourceStatus'])
-        hosts.extend([(host['resource']['name'], host['resource']['scope']['name'],
-                       host['resource']['objectId'], host['resource']['scope']['id'],
-                       dfw_enabled) for host in enabled_hosts])
+    for (cluster_moid, cluster_name, dfw_enabled), (cluster_hosts, error) in zip(clusters, results):
+        if error is not None:
+            print 'failed to retrieve the hosts of cluster {}/{}: {}'.format(cluster_name, cluster_moid, error)
+        else:
+            hosts.extend(cluster_hosts)
 
     prepared_hosts_count = len(hosts)
     dfw_enabled_hosts_count = len([host for host in hosts if host[4] == 'true'])
@@ -59,51 +86,62 @@ def host_prep_state(session):
 
 
 def get_host_info(vccontent, host_list):
+    """
+    This function returns the CPU socket and VM count of the hosts, read for all hosts with one property retrieval
+    :param vccontent: The vCenter service content
+    :param host_list: The list of host tuples as returned by host_prep_state
+    :return: A list of (host name, CPU socket count, VM count) tuples, in the order of host_list. The hosts not found
+             in vCenter are printed and left out
+    """
     host_info = []
-    host_modict = get_all_objs(vccontent, VIM_TYPES['host'])
+    host_props = dict((props['name'], props) for host_mo, props in
+                      retrieve_properties(vccontent, VIM_TYPES['host'], ['hardware.cpuInfo.numCpuPackages', 'vm']))
     for host_name in [host[0] for host in host_list]:
-        print 'retrieving details (hardware & vms) for host {} ....'.format(host_name),
-        host_object = [host_mo for host_mo in host_modict if host_mo.name == host_name][0]
-        cpu_count = host_object.hardware.cpuInfo.numCpuPackages
+        props = host_props.get(host_name)
+        if props is None:
+            print 'host {} not found in vCenter'.format(host_name)
+            continue
+        cpu_count = props.get('hardware.cpuInfo.numCpuPackages', 0)
         #TODO: Filter service VMs out of the count
-        vm_moids = [vm._moId for vm in host_object.vm]
-        vm_count = len(vm_moids)
+        vm_count = len(props.get('vm', []))
         host_info.extend([(host_name, cpu_count, vm_count)])
-        print 'Done'
     return host_info
 
 
 def calculate_socket_usage(host_list, host_info):
+    dfw_enabled_by_name = dict()
+    for nsx_host in host_list:
+        dfw_enabled_by_name.setdefault(nsx_host[0], []).append(nsx_host[4])
+
     nsx_socket_count = 0
     dfw_scocket_count = 0
     for host in host_info:
-        for nsx_host in host_list:
-            if host[0] == nsx_host[0]:
-                if nsx_host[4] == 'true':
-                    dfw_scocket_count += int(host[1])
-                nsx_socket_count += int(host[1])
+        for dfw_enabled in dfw_enabled_by_name.get(host[0], []):
+            if dfw_enabled == 'true':
+                dfw_scocket_count += int(host[1])
+            nsx_socket_count += int(host[1])
     return nsx_socket_count, dfw_scocket_count
 
 
-def ls_state(session):
-    all_logical_switches = session.read_all_pages('logicalSwitchesGlobal', 'read')
+def ls_state(session, all_logical_switches=None):
+    if all_logical_switches is None:
+        all_logical_switches = session.read_all_pages('logicalSwitchesGlobal', 'read')
     ls_list = [(ls['name'], ls['objectId']) for ls in all_logical_switches if ls['isUniversal'] == 'false']
     uls_list = [(ls['name'], ls['objectId']) for ls in all_logical_switches if ls['isUniversal'] == 'true']
     hwgwls_list = [(ls['name'], ls['objectId']) for ls in all_logical_switches if 'hardwareGatewayBinding' in ls]
     return len(ls_list), ls_list, len(uls_list), uls_list, len(hwgwls_list), hwgwls_list
 
 
-def edge_state(session):
-    edge_status = session.read_all_pages('nsxEdges', 'read')
+def edge_state(session, edge_status=None):
+    if edge_status is None:
+        edge_status = session.read_all_pages('nsxEdges', 'read')
     esg_list = [(edge['objectId'], edge['name']) for edge in edge_status if edge['edgeType'] == 'gatewayServices']
     dlr_list = [(edge['objectId'], edge['name']) for edge in edge_status if edge['edgeType'] == 'distributedRouter']
     return len(esg_list), esg_list, len(dlr_list), dlr_list
 
 
 def _single_esg_feature_collect(session, edge_id, edge_name):
-    print 'retrieving the features for Services Gateway {}/{} ....'.format(edge_name, edge_id),
     edge_details = session.read('nsxEdge', uri_parameters={'edgeId': edge_id})['body']
-    print 'Done'
     feature_map = {}
     for feature in edge_details['edge']['features'].keys():
         try:
@@ -118,100 +156,515 @@ def _single_esg_feature_collect(session, edge_id, edge_name):
     return return_tupple
 
 
-def esg_features_collect(session, edge_list):
+def esg_features_collect(session, edge_list, workers=PARALLEL_WORKERS):
+    """
+    This function reads the features of the Services Gateways concurrently
+    :param session: An instance of an NsxClient Session
+    :param edge_list: A list of (edge id, edge name) tuples as returned by edge_state
+    :param workers: (Optional) The maximum number of concurrent edge reads
+    :return: A list with the features of each edge, in the order of edge_list. The edges whose features could not be
+             read are printed and left out of the list
+    """
+    print 'retrieving the features of {} Services Gateways ({} concurrent reads) ....'.format(len(edge_list),
+                                                                                              workers),
+    results = parallel_map(lambda edge: _single_esg_feature_collect(session, edge[0], edge[1]), edge_list, workers)
+    print 'Done'
+
     feature_list = []
-    for edge_name, edge_id in edge_list:
-        feature_list.append(_single_esg_feature_collect(session, edge_name, edge_id))
+    for (edge_id, edge_name), (features, error) in zip(edge_list, results):
+        if error is not None:
+            print 'failed to retrieve the features for Services Gateway {}/{}: {}'.format(edge_name, edge_id, error)
+        else:
+            feature_list.append(features)
     return feature_list
 
 
-def contruct_parser(subparsers):
-    parser = subparsers.add_parser('usage', description="Functions to retrieve NSX-v usage statistics",
-                                   help="Functions to retrieve NSX-v usage statistics")
-    parser.set_defaults(func=_usage_main)
-
-
-def _usage_main(args):
-    if args.debug:
-        debug = True
-    else:
-        debug = False
-
-    config = ConfigParser.ConfigParser()
-    assert config.read(args.ini), 'could not read config file {}'.format(args.ini)
-
-    try:
-        nsxramlfile = config.get('nsxraml', 'nsxraml_file')
-    except (ConfigParser.NoSectionError):
-        nsxramlfile_dir = resource_filename(__name__, 'api_spec')
-        nsxramlfile = '{}/nsxvapi.raml'.format(nsxramlfile_dir)
-
-    client_session = NsxClient(nsxramlfile, config.get('nsxv', 'nsx_manager'),
-                               config.get('nsxv', 'nsx_username'), config.get('nsxv', 'nsx_password'), debug=debug)
-
-    vccontent = connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
-                              config.get('vcenter', 'vcenter_passwd'))
+# Field names of the machine readable output and headers of the tables of the usage report, per section
+USAGE_SECTIONS = {'hosts': (['host_name', 'cluster_name', 'host_moid', 'cluster_moid', 'dfw_enabled'],
+                            ["Host name", "Cluster name", "Host moid", "Cluster moid", "DFW enabled"]),
+                  'host_details': (['host_name', 'cpu_sockets', 'vm_count'],
+                                   ["Host name", "CPU Socket count", "VM count"]),
+                  'logical_switches': (['name', 'id'], ["Logical switch name", "Logical switch Id"]),
+                  'universal_logical_switches': (['name', 'id'],
+                                                 ["Universal Logical switch name", "Logical switch Id"]),
+                  'hardware_gateway_logical_switches': (['name', 'id'],
+                                                        ["Logical switches using Hardware Gateway bindings",
+                                                         "Logical switch Id"]),
+                  'esgs': (['id', 'name'], ["Edge service gw name", "Edge service gw Id"]),
+                  'dlrs': (['id', 'name'], ["Logical router name", "Logical router Id"]),
+                  'esg_features': (['name', 'id', 'load_balancer', 'firewall', 'routing', 'ipsec', 'l2vpn', 'sslvpn'],
+                                   ["Edge service gw name", "Edge service gw Id", "Loadbalancer", "Firewall",
+                                    "Routing", "IPSec", "L2VPN", "SSL-VPN"]),
+                  'summary': (['key', 'description', 'count'], ["Feature / Property / Type", "Count"]),
+                  'changes': (['object_type', 'object', 'change', 'previous', 'current'],
+                              ["Object type", "Object", "Change", "Previous", "Current"]),
+                  'managers': (['manager', 'ini_file', 'seconds', 'error'],
+                               ["NSX Manager", "Ini file", "Seconds", "Error"])}
+
+# Bumped whenever the layout of the usage snapshot file changes
+USAGE_SNAPSHOT_VERSION = 1
+
+# Key and description of the counts of the usage summary
+USAGE_SUMMARY = [('prepared_hosts', 'Number of hosts prepared for NSX'),
+                 ('dfw_hosts', 'Number of hosts enabled to use DFW'),
+                 ('nsx_sockets', 'Number of CPU Sockets enabled for NSX'),
+                 ('dfw_sockets', 'Number of CPU Sockets enabled for DFW'),
+                 ('logical_switches', 'Number of local logical switches'),
+                 ('universal_logical_switches', 'Number of universal logical switches'),
+                 ('hardware_gateway_logical_switches', 'Number of logical switches with Hardware Gateway bindings'),
+                 ('esgs', 'Number of Edge services Gateways'),
+                 ('dlrs', 'Number of Distributed Routers'),
+                 ('lb_esgs', 'Number of Service Gateways with Loadbalancing Enabled'),
+                 ('fw_esgs', 'Number of Service Gateways with Firewall Enabled'),
+                 ('routing_esgs', 'Number of Service Gateways with Routing Enabled'),
+                 ('ipsec_esgs', 'Number of Service Gateways with IPSec Enabled'),
+                 ('l2vpn_esgs', 'Number of Service Gateways with L2VPN Enabled'),
+                 ('sslvpn_esgs', 'Number of Service Gateways with SSL-VPN Enabled'),
+                 ('esgs_not_retrieved', 'Number of Service Gateways with features not retrieved')]
+
+USAGE_FORMATS = ['table', 'json', 'ndjson', 'csv']
+
+
+class _UsageTableWriter(object):
+    """
+    Prints the usage report as psql tables, the sections other than the summary only in verbose mode
+    """
+    def __init__(self, stream, verbose=False):
+        self._stream = stream
+        self._verbose = verbose
+
+    def section(self, name, rows, manager=None):
+        title_suffix = ' ({})'.format(manager) if manager else ''
+        if name == 'summary':
+            self._stream.write('\n\nNSX usage summary{}:\n'.format(title_suffix))
+            self._stream.write(tabulate([(row[1], str(row[2])) for row in rows], headers=USAGE_SECTIONS[name][1],
+                                        tablefmt="psql") + '\n')
+        elif name == 'changes':
+            self._stream.write('\nChanges since the previous snapshot{}:\n'.format(title_suffix))
+            if rows:
+                self._stream.write(tabulate(rows, headers=USAGE_SECTIONS[name][1], tablefmt="psql") + '\n')
+            else:
+                self._stream.write('none\n')
+        elif name == 'managers':
+            self._stream.write('\nNSX Managers:\n')
+            self._stream.write(tabulate(rows, headers=USAGE_SECTIONS[name][1], tablefmt="psql") + '\n')
+        elif self._verbose:
+            if manager:
+                self._stream.write('{}:\n'.format(manager))
+            self._stream.write(tabulate(rows, headers=USAGE_SECTIONS[name][1], tablefmt="psql") + ' \n\n')
+        self._stream.flush()
+
+    def close(self):
+        pass
+
+
+class _UsageJsonWriter(object):
+    """
+    Writes the usage report as one json object with a list of records per section, each section being written as
+    soon as it is collected. The sections of a report over several NSX Managers are named manager/section
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._first_section = True
+
+    def section(self, name, rows, manager=None):
+        self._stream.write('{' if self._first_section else ',\n ')
+        self._first_section = False
+        self._stream.write('{}: ['.format(json.dumps('{}/{}'.format(manager, name) if manager else name)))
+        fields = USAGE_SECTIONS[name][0]
+        for index, row in enumerate(rows):
+            self._stream.write(('' if index == 0 else ',') + '\n  ' + json.dumps(OrderedDict(zip(fields, row))))
+        self._stream.write(']')
+        self._stream.flush()
+
+    def close(self):
+        self._stream.write('{}\n' if self._first_section else '}\n')
+        self._stream.flush()
+
+
+class _UsageNdjsonWriter(object):
+    """
+    Writes the usage report as one json record per line, with the section name in the 'section' field and for a
+    report over several NSX Managers the manager in the 'manager' field
+    """
+    def __init__(self, stream):
+        self._stream = stream
+
+    def section(self, name, rows, manager=None):
+        fields = USAGE_SECTIONS[name][0]
+        prefix = [('manager', manager)] if manager else []
+        for row in rows:
+            self._stream.write(json.dumps(OrderedDict(prefix + [('section', name)] + zip(fields, row))) + '\n')
+        self._stream.flush()
+
+    def close(self):
+        pass
+
+
+class _UsageCsvWriter(object):
+    """
+    Writes the usage report as csv, each section starting with a header line and each line starting with the section
+    name, preceded by the manager for a report over several NSX Managers
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._writer = csv.writer(stream)
+
+    def section(self, name, rows, manager=None):
+        prefix = [manager] if manager else []
+        self._writer.writerow((['manager'] if manager else []) + ['section'] + USAGE_SECTIONS[name][0])
+        for row in rows:
+            self._writer.writerow(prefix + [name] + [value.encode('utf-8') if isinstance(value, unicode) else value
+                                                     for value in row])
+        self._stream.flush()
+
+    def close(self):
+        pass
+
+
+def usage_report_writer(output_format, stream, verbose=False):
+    """
+    :param output_format: One of USAGE_FORMATS
+    :param stream: The file object to which the report is written
+    :param verbose: (Optional) Whether the table format prints all the sections or only the summary
+    :return: A writer to pass to usage_report
+    """
+    if output_format == 'json':
+        return _UsageJsonWriter(stream)
+    elif output_format == 'ndjson':
+        return _UsageNdjsonWriter(stream)
+    elif output_format == 'csv':
+        return _UsageCsvWriter(stream)
+    return _UsageTableWriter(stream, verbose)
+
+
+class _ManagerUsageWriter(object):
+    """
+    Passes the sections of one NSX Manager to a report writer shared by the concurrent collections of several NSX
+    Managers, one section at a time
+    """
+    def __init__(self, report_writer, manager, lock):
+        self._report_writer = report_writer
+        self._manager = manager
+        self._lock = lock
+
+    def section(self, name, rows):
+        with self._lock:
+            self._report_writer.section(name, rows, manager=self._manager)
+
+
+def usage_report(client_session, vccontent, report_writer, workers=PARALLEL_WORKERS, deadline=None,
+                 previous_snapshot=None, full_refresh=False):
+    """
+    This function collects the NSX usage report, each section is passed to the report writer as soon as it is
+    collected
+    :param client_session: An instance of an NsxClient Session
+    :param vccontent: The vCenter service content
+    :param report_writer: A writer as returned by usage_report_writer
+    :param workers: (Optional) The maximum number of concurrent NSX Manager reads
+    :param deadline: (Optional) The seconds after which the cluster host reads not finished yet are given up
+    :param previous_snapshot: (Optional) A snapshot returned by an earlier run. The features of the ESGs with an
+                              unchanged revision are not read again, and a 'changes' section with the differences to
+                              the previous snapshot is written after the summary. The hosts are always read, with one
+                              property retrieval, as their VM count has no cheaper change signal
+    :param full_refresh: (Optional) If True, the features of all the ESGs are read again, the previous snapshot is
+                         only used for the 'changes' section
+    :return: The usage snapshot, a dictionary holding the collected sections and the summary counts under 'summary',
+             the keys of the counts being the ones of USAGE_SUMMARY
+    """
+    previous_snapshot = previous_snapshot or {}
 
     print 'retrieving the hosts prepared for NSX ....',
-    host_count, dfw_enabled_hosts, host_list = host_prep_state(client_session)
+    host_count, dfw_enabled_hosts, host_list = host_prep_state(client_session, workers=workers, deadline=deadline)
     print 'Done'
-    if args.verbose:
-        print tabulate(host_list, headers=["Host name", "Cluster name", "Host moid", "Cluster moid", "DFW enabled"],
-                       tablefmt="psql"), "\n"
+    report_writer.section('hosts', host_list)
 
-    print 'retrieving the hosts detailed information ....'
+    print 'retrieving the hosts detailed information (hardware & vms) ....',
     host_info = get_host_info(vccontent, host_list)
-    if args.verbose:
-        print tabulate(host_info, headers=["Host name", "CPU Socket count", "VM count"], tablefmt="psql"), "\n"
+    print 'Done'
+    report_writer.section('host_details', host_info)
 
     print 'retrieving the number of NSX logical switches ....',
-    ls_count, ls_list, uls_count, uls_list, hwgwls_count, hwgwls_list = ls_state(client_session)
+    all_logical_switches = client_session.read_all_pages('logicalSwitchesGlobal', 'read')
+    ls_count, ls_list, uls_count, uls_list, hwgwls_count, hwgwls_list = ls_state(client_session, all_logical_switches)
     print 'Done'
-    if args.verbose:
-        print tabulate(ls_list, headers=["Logical switch name", "Logical switch Id"], tablefmt="psql"), "\n"
-        print tabulate(uls_list, headers=["Universal Logical switch name", "Logical switch Id"], tablefmt="psql"), "\n"
-        print tabulate(hwgwls_list, headers=["Logical switches using Hardware Gateway bindings", "Logical switch Id"],
-                       tablefmt="psql"), "\n"
+    report_writer.section('logical_switches', ls_list)
+    report_writer.section('universal_logical_switches', uls_list)
+    report_writer.section('hardware_gateway_logical_switches', hwgwls_list)
 
     print 'retrieving the number of NSX gateways (ESGs and DLRs) ....',
-    esg_count, esg_list, dlr_count, dlr_list = edge_state(client_session)
+    edge_status = client_session.read_all_pages('nsxEdges', 'read')
+    esg_count, esg_list, dlr_count, dlr_list = edge_state(client_session, edge_status)
     print 'Done'
-    if args.verbose:
-        print tabulate(esg_list, headers=["Edge service gw name", "Edge service gw Id"], tablefmt="psql"), "\n"
-        print tabulate(dlr_list, headers=["Logical router name", "Logical router Id"], tablefmt="psql"), "\n"
-
-    edge_feature_list = esg_features_collect(client_session, esg_list)
-    if args.verbose:
-        print tabulate(edge_feature_list,
-                       headers=["Edge service gw name", "Edge service gw Id", "Loadbalancer",
-                                "Firewall", "Routing", "IPSec", "L2VPN", "SSL-VPN"], tablefmt="psql"), "\n"
-
-    lb_esg = len([edge for edge in edge_feature_list if edge[2] == 'true'])
-    fw_esg = len([edge for edge in edge_feature_list if edge[3] == 'true'])
-    rt_esg = len([edge for edge in edge_feature_list if edge[4] == 'true'])
-    ipsec_esg = len([edge for edge in edge_feature_list if edge[5] == 'true'])
-    l2vpn_esg = len([edge for edge in edge_feature_list if edge[6] == 'true'])
-    sslvpn_esg = len([edge for edge in edge_feature_list if edge[7] == 'true'])
+    report_writer.section('esgs', esg_list)
+    report_writer.section('dlrs', dlr_list)
+
+    edges = dict((edge['objectId'], {'name': edge['name'], 'type': edge['edgeType'], 'revision': edge.get('revision')})
+                 for edge in edge_status)
+    previous_edges = {} if full_refresh else previous_snapshot.get('edges', {})
+    known_features = dict((features[1], features) for features in previous_snapshot.get('esg_features', [])
+                          if features[1] in previous_edges and edges.get(features[1]) and
+                          previous_edges[features[1]]['revision'] == edges[features[1]]['revision'])
+    if known_features:
+        print 'reusing the snapshot features of {} unchanged Services Gateways'.format(len(known_features))
+    known_features.update((features[1], features) for features in
+                          esg_features_collect(client_session, [edge for edge in esg_list
+                                                                if edge[0] not in known_features], workers=workers))
+    edge_feature_list = [known_features[edge[0]] for edge in esg_list if edge[0] in known_features]
+    report_writer.section('esg_features', edge_feature_list)
+
     nsx_sockets, dfw_sockets = calculate_socket_usage(host_list, host_info)
+    summary = {'prepared_hosts': host_count,
+               'dfw_hosts': dfw_enabled_hosts,
+               'nsx_sockets': nsx_sockets,
+               'dfw_sockets': dfw_sockets,
+               'logical_switches': ls_count,
+               'universal_logical_switches': uls_count,
+               'hardware_gateway_logical_switches': hwgwls_count,
+               'esgs': esg_count,
+               'dlrs': dlr_count,
+               'lb_esgs': len([edge for edge in edge_feature_list if edge[2] == 'true']),
+               'fw_esgs': len([edge for edge in edge_feature_list if edge[3] == 'true']),
+               'routing_esgs': len([edge for edge in edge_feature_list if edge[4] == 'true']),
+               'ipsec_esgs': len([edge for edge in edge_feature_list if edge[5] == 'true']),
+               'l2vpn_esgs': len([edge for edge in edge_feature_list if edge[6] == 'true']),
+               'sslvpn_esgs': len([edge for edge in edge_feature_list if edge[7] == 'true']),
+               'esgs_not_retrieved': esg_count - len(edge_feature_list)}
+    report_writer.section('summary', _usage_summary_rows(summary))
+
+    snapshot = {'version': USAGE_SNAPSHOT_VERSION,
+                'timestamp': time.time(),
+                'hosts': host_list,
+                'host_details': host_info,
+                'logical_switches': dict((ls['objectId'], {'name': ls['name'], 'revision': ls.get('revision')})
+                                         for ls in all_logical_switches),
+                'edges': edges,
+                'esg_features': edge_feature_list,
+                'summary': summary}
+    if previous_snapshot:
+        report_writer.section('changes', usage_changes(previous_snapshot, snapshot))
+    return snapshot
+
+
+def usage_changes(previous_snapshot, snapshot):
+    """
+    This function compares two usage snapshots
+    :param previous_snapshot: The older snapshot
+    :param snapshot: The newer snapshot
+    :return: A list of (object type, object, change, previous value, current value) tuples, for the hosts, logical
+             switches and edges added or removed, the logical switches with a new revision, the ESG features enabled
+             or disabled and the summary counts that changed
+    """
+    changes = []
+
+    previous_hosts = set(host[0] for host in previous_snapshot.get('hosts', []))
+    hosts = set(host[0] for host in snapshot['hosts'])
+    changes.extend(('host', host_name, 'added', '', '') for host_name in sorted(hosts - previous_hosts))
+    changes.extend(('host', host_name, 'removed', '', '') for host_name in sorted(previous_hosts - hosts))
+
+    for object_type, key in [('logical_switch', 'logical_switches'), ('edge', 'edges')]:
+        previous_objects = previous_snapshot.get(key, {})
+        objects = snapshot[key]
+        for object_id in sorted(set(previous_objects) | set(objects)):
+            if object_id not in previous_objects:
+                changes.append((object_type, '{}/{}'.format(objects[object_id]['name'], object_id), 'added', '',
+                                objects[object_id]['revision']))
+            elif object_id not in objects:
+                changes.append((object_type, '{}/{}'.format(previous_objects[object_id]['name'], object_id),
+                                'removed', previous_objects[object_id]['revision'], ''))
+            elif previous_objects[object_id]['revision'] != objects[object_id]['revision']:
+                changes.append((object_type, '{}/{}'.format(objects[object_id]['name'], object_id), 'changed',
+                                previous_objects[object_id]['revision'], objects[object_id]['revision']))
+
+    previous_features = dict((features[1], features) for features in previous_snapshot.get('esg_features', []))
+    feature_names = USAGE_SECTIONS['esg_features'][0]
+    for features in snapshot['esg_features']:
+        if features[1] not in previous_features:
+            continue
+        for index in range(2, len(feature_names)):
+            if previous_features[features[1]][index] != features[index]:
+                changes.append(('esg_feature', '{}/{}'.format(features[0], features[1]), feature_names[index],
+                                previous_features[features[1]][index], features[index]))
+
+    previous_summary = previous_snapshot.get('summary', {})
+    for key, description in USAGE_SUMMARY:
+        if key in previous_summary and previous_summary[key] != snapshot['summary'][key]:
+            changes.append(('summary', key, 'changed', previous_summary[key], snapshot['summary'][key]))
+
+    return changes
+
+
+def load_usage_snapshot(snapshot_file):
+    """
+    :param snapshot_file: The path of a file written by save_usage_snapshot
+    :return: The snapshot, or None if the file does not exist or was written by an other pynsxv version
+    """
+    try:
+        with open(snapshot_file) as snapshot_fd:
+            snapshot = json.load(snapshot_fd)
+    except (IOError, ValueError):
+        return None
+    if snapshot.get('version') != USAGE_SNAPSHOT_VERSION:
+        return None
+
+    # json has no tuples, the rows are compared with the ones collected by this run
+    for key in ['hosts', 'host_details', 'esg_features']:
+        snapshot[key] = [tuple(row) for row in snapshot.get(key, [])]
+    return snapshot
+
+
+def save_usage_snapshot(snapshot_file, snapshot):
+    """
+    :param snapshot_file: The path of the file
+    :param snapshot: A snapshot as returned by usage_report
+    """
+    write_json_file(snapshot_file, snapshot)
 
-    output_table = [('Number of hosts prepared for NSX', str(host_count)),
-                    ('Number of hosts enabled to use DFW', str(dfw_enabled_hosts)),
-                    ('Number of CPU Sockets enabled for NSX', str(nsx_sockets)),
-                    ('Number of CPU Sockets enabled for DFW', str(dfw_sockets)),
-                    ('Number of local logical switches', str(ls_count)),
-                    ('Number of universal logical switches', str(uls_count)),
-                    ('Number of logical switches with Hardware Gateway bindings', str(hwgwls_count)),
-                    ('Number of Edge services Gateways', str(esg_count)),
-                    ('Number of Distributed Routers', str(dlr_count)),
-                    ('Number of Service Gateways with Loadbalancing Enabled', str(lb_esg)),
-                    ('Number of Service Gateways with Firewall Enabled', str(fw_esg)),
-                    ('Number of Service Gateways with Routing Enabled', str(rt_esg)),
-                    ('Number of Service Gateways with IPSec Enabled', str(ipsec_esg)),
-                    ('Number of Service Gateways with L2VPN Enabled', str(l2vpn_esg)),
-                    ('Number of Service Gateways with SSL-VPN Enabled', str(sslvpn_esg))]
-
-    print '\n\nNSX usage summary:'
-    print tabulate(output_table, headers=["Feature / Property / Type", "Count"], tablefmt="psql")
+
+def _usage_summary_rows(summary):
+    return [(key, description, summary[key]) for key, description in USAGE_SUMMARY
+            if key != 'esgs_not_retrieved' or summary[key]]
+
+
+def contruct_parser(subparsers):
+    parser = subparsers.add_parser('usage', description="Functions to retrieve NSX-v usage statistics",
+                                   help="Functions to retrieve NSX-v usage statistics")
+    parser.add_argument("--workers",
+                        type=int,
+                        default=PARALLEL_WORKERS,
+                        help="number of concurrent NSX Manager reads, default {}".format(PARALLEL_WORKERS))
+    parser.add_argument("--deadline",
+                        type=float,
+                        help="seconds after which the cluster host reads not finished yet are given up")
+    parser.add_argument("--format",
+                        dest="output_format",
+                        choices=USAGE_FORMATS,
+                        default='table',
+                        help="output format of the report, the json, ndjson and csv formats contain all the\n"
+                             "sections, written as soon as they are collected, with the progress messages on stderr")
+    parser.add_argument("--snapshot",
+                        dest="snapshot_file",
+                        help="json file where the collected usage snapshot is saved")
+    parser.add_argument("--incremental",
+                        action="store_true",
+                        help="only read the features of the ESGs that changed since the snapshot saved in the\n"
+                             "--snapshot file and report the changes")
+    parser.add_argument("--full-refresh",
+                        dest="full_refresh",
+                        action="store_true",
+                        help="with --incremental, read the features of all the ESGs again and still report the\n"
+                             "changes since the snapshot")
+    parser.add_argument("--ini",
+                        dest="usage_ini",
+                        action="append",
+                        help="nsx configuration file or directory of .ini files, can be repeated to collect the\n"
+                             "usage of several NSX Managers concurrently into one report")
+    parser.set_defaults(func=_usage_main)
+
+
+def _usage_ini_files(ini_arguments):
+    ini_files = []
+    for ini_argument in ini_arguments:
+        if os.path.isdir(ini_argument):
+            ini_files.extend(sorted(glob.glob(os.path.join(ini_argument, '*.ini'))))
+        else:
+            ini_files.append(ini_argument)
+    return ini_files
+
+
+def _manager_snapshot_file(snapshot_file, manager):
+    snapshot_root, snapshot_extension = os.path.splitext(snapshot_file)
+    return '{}-{}{}'.format(snapshot_root, re.sub(r'[^\w.-]', '_', manager), snapshot_extension or '.json')
+
+
+def _manager_usage_report(config, args, report_writer, snapshot_file=None):
+    client_session = nsx_client_from_config(config, debug=args.debug, refresh_cache=args.refresh_cache)
+
+    vccontent = lazy_connect_to_vc(config.get('vcenter', 'vcenter'), config.get('vcenter', 'vcenter_user'),
+                                   config.get('vcenter', 'vcenter_passwd'))
+
+    previous_snapshot = None
+    if args.incremental:
+        previous_snapshot = load_usage_snapshot(snapshot_file)
+        if previous_snapshot is None:
+            print 'no usage snapshot found in {}, reading all the objects'.format(snapshot_file)
+
+    snapshot = usage_report(client_session, vccontent, report_writer, workers=args.workers, deadline=args.deadline,
+                            previous_snapshot=previous_snapshot, full_refresh=args.full_refresh)
+    if snapshot_file:
+        save_usage_snapshot(snapshot_file, snapshot)
+    return snapshot
+
+
+def usage_report_managers(configs, args, report_writer):
+    """
+    This function collects the usage reports of several NSX Managers concurrently and writes their sections, the
+    summary of all NSX Managers and a 'managers' section with the time taken per NSX Manager
+    :param configs: A list of (ini file, ConfigParser instance) tuples, one per NSX Manager
+    :param args: The parsed arguments of the usage command
+    :param report_writer: A writer as returned by usage_report_writer
+    :return: A dictionary with the summed summary counts of the NSX Managers whose report could be collected
+    """
+    writer_lock = threading.Lock()
+
+    def collect(ini_config):
+        ini_file, config = ini_config
+        manager = config.get('nsxv', 'nsx_manager')
+        snapshot_file = _manager_snapshot_file(args.snapshot_file, manager) if args.snapshot_file else None
+        start_time = time.time()
+        try:
+            return _manager_usage_report(config, args, _ManagerUsageWriter(report_writer, manager, writer_lock),
+                                         snapshot_file), time.time() - start_time
+        except (Exception, SystemExit) as e:
+            e.elapsed = time.time() - start_time
+            raise
+
+    results = parallel_map(collect, configs, workers=len(configs))
+
+    summary = dict((key, 0) for key, description in USAGE_SUMMARY)
+    managers = []
+    for (ini_file, config), (result, error) in zip(configs, results):
+        manager = config.get('nsxv', 'nsx_manager')
+        if error is not None:
+            managers.append((manager, ini_file, round(getattr(error, 'elapsed', 0), 1), str(error)))
+            continue
+        snapshot, elapsed = result
+        managers.append((manager, ini_file, round(elapsed, 1), ''))
+        for key in summary:
+            summary[key] += snapshot['summary'][key]
+
+    report_writer.section('summary', _usage_summary_rows(summary))
+    report_writer.section('managers', managers)
+    return summary
+
+
+def _usage_main(args):
+    if args.incremental and not args.snapshot_file:
+        print 'The --incremental option needs a --snapshot file'
+        return None
+
+    configs = []
+    for ini_file in _usage_ini_files(args.usage_ini or [args.ini]):
+        config = ConfigParser.ConfigParser()
+        assert config.read(ini_file), 'could not read config file {}'.format(ini_file)
+        configs.append((ini_file, config))
+    if not configs:
+        print 'No ini file found in {}'.format(', '.join(args.usage_ini))
+        return None
+
+    report_stream = sys.stdout
+    report_writer = usage_report_writer(args.output_format, report_stream, args.verbose)
+    if args.output_format != 'table':
+        # keep stdout for the report, the progress and error messages go to stderr
+        sys.stdout = sys.stderr
+    try:
+        if len(configs) == 1:
+            _manager_usage_report(configs[0][1], args, report_writer, args.snapshot_file)
+        else:
+            usage_report_managers(configs, args, report_writer)
+    finally:
+        sys.stdout = report_stream
+    report_writer.close()
 
 
 def main():